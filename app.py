@@ -1,22 +1,48 @@
-from flask import Flask, render_template, request, jsonify
+from flask import Flask, render_template, request, jsonify, Response
 import os
+import queue
 import threading
 from node import Node
-from config import WEB_PORT, NODES
+from events import EventBus, RemoteFilesPoller, format_sse
+from config import WEB_PORT, EVENT_QUEUE_SIZE, REMOTE_POLL_INTERVAL, EVENTS_KEEPALIVE_INTERVAL
 
 app = Flask(__name__)
 node = Node()
 
+# Canal de eventos hacia la interfaz web: cambios de archivos y de estado de los nodos
+event_bus = EventBus(EVENT_QUEUE_SIZE)
+remote_poller = RemoteFilesPoller(node, event_bus, REMOTE_POLL_INTERVAL)
+
+def _publish_file_changes(upserts, removes):
+    """Publica los cambios de los archivos locales"""
+    event_bus.publish("file_changes", {"node": node.node_name, "upserts": upserts, "removes": removes})
+
+def _publish_status(status):
+    """Publica el estado de los nodos y actualiza los listados remotos"""
+    event_bus.publish("status", status)
+    remote_poller.wake()
+
+node.add_file_listener(_publish_file_changes)
+node.add_status_listener(_publish_status)
+
+def _listing_args():
+    """Filtro por prefijo y paginación de los listados de archivos"""
+    prefix = request.args.get('prefix', '')
+    offset = request.args.get('offset', 0, type=int)
+    limit = request.args.get('limit', type=int)
+    return prefix, offset, limit
+
 @app.route('/api/node_files/<node_name>', methods=['GET'])
 def get_node_files(node_name):
     """API para obtener archivos de un nodo específico"""
+    prefix, offset, limit = _listing_args()
     if node_name == node.node_name:
         # Si es el nodo local, usar la función existente
-        files = node.list_files()
+        files = node.list_files(prefix, offset, limit)
         return jsonify(files)
     else:
         # Si es otro nodo, solicitar los archivos a través de la red
-        files = node.get_remote_files(node_name)
+        files = node.get_remote_files(node_name, prefix, offset, limit)
         if files is None:
             return jsonify([])
         return jsonify(files)
@@ -24,12 +50,12 @@ def get_node_files(node_name):
 @app.route('/')
 def index():
     """Página principal de la interfaz web"""
-    return render_template('index.html', node_name=node.node_name, nodes=NODES)
+    return render_template('index.html', node_name=node.node_name, nodes=node.get_node_status())
 
 @app.route('/api/files', methods=['GET'])
 def list_files():
-    """API para listar archivos"""
-    files = node.list_files()
+    """API para listar archivos (admite ?prefix=, ?offset= y ?limit=)"""
+    files = node.list_files(*_listing_args())
     return jsonify(files)
 
 @app.route('/api/transfer', methods=['POST'])
@@ -58,22 +84,154 @@ def delete_file():
     if not filename:
         return jsonify({"status": "error", "message": "Falta nombre de archivo"})
     
-    success = node.delete_file(filename)
+    results = node.delete_file(filename)
     
-    if success:
-        return jsonify({"status": "ok"})
+    if results:
+        return jsonify({"status": "ok", "nodes": results})
     else:
         return jsonify({"status": "error", "message": "Error al eliminar archivo"})
 
+@app.route('/api/events', methods=['GET'])
+def events():
+    """API de eventos (Server-Sent Events): estado inicial completo y después solo los cambios"""
+    subscriber = event_bus.subscribe()
+    
+    def stream():
+        try:
+            files = remote_poller.snapshot()
+            files[node.node_name] = node.list_files()
+            yield format_sse("snapshot", {"status": node.get_node_status(), "files": files})
+            
+            while True:
+                try:
+                    event_type, data = subscriber.get(timeout=EVENTS_KEEPALIVE_INTERVAL)
+                except queue.Empty:
+                    # Mantener viva la conexión y detectar clientes desconectados
+                    yield ": keep-alive\n\n"
+                    continue
+                yield format_sse(event_type, data)
+        finally:
+            event_bus.unsubscribe(subscriber)
+    
+    return Response(stream(), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
 @app.route('/api/status', methods=['GET'])
 def get_status():
-    """API para obtener el estado de los nodos"""
-    status = node.get_node_status()
+    """API para obtener el estado de los nodos (?detailed=1 incluye estado SWIM, encarnación y nivel phi)"""
+    status = node.get_node_status(detailed=request.args.get('detailed') == '1')
     return jsonify(status)
 
+@app.route('/api/upload', methods=['POST', 'PUT'])
+def upload_file():
+    """API para subir un archivo: el cuerpo (crudo, o el campo `file` de un formulario) se escribe por bloques en disco"""
+    upload = request.files.get('file') if request.mimetype == 'multipart/form-data' else None
+    filename = request.args.get('filename') or (upload.filename if upload else None)
+    if not filename:
+        return jsonify({"status": "error", "message": "Falta nombre de archivo"}), 400
+    
+    try:
+        if upload:
+            info = node.upload_file(filename, upload.stream)
+        else:
+            info = node.upload_file(filename, request.stream, request.content_length)
+    except ValueError as e:
+        return jsonify({"status": "error", "message": str(e)}), 400
+    except Exception as e:
+        return jsonify({"status": "error", "message": f"Error al guardar archivo: {e}"}), 500
+    
+    return jsonify(dict(info, status="ok", filename=filename))
+
+@app.route('/api/download', methods=['GET'])
+@app.route('/api/download/<path:filename>', methods=['GET'])
+def download_file(filename=None):
+    """API para descargar un archivo de este nodo o de la réplica más rápida (admite Range, If-Range, If-None-Match, ?offset= y ?length=)"""
+    filename = filename or request.args.get('filename')
+    if not filename:
+        return jsonify({"status": "error", "message": "Falta nombre de archivo"}), 400
+    
+    offset = request.args.get('offset', 0, type=int)
+    length = request.args.get('length', type=int)
+    byte_range = request.range if request.range and request.range.units == 'bytes' and len(request.range.ranges) == 1 else None
+    if_range = request.if_range
+    
+    # Las condiciones y los rangos finales necesitan el sha256 y el tamaño antes de abrir el contenido
+    if request.if_none_match or if_range.etag or if_range.date or (byte_range and byte_range.ranges[0][0] < 0):
+        info = node.get_file_info(filename)
+        if info is None:
+            return jsonify({"status": "error", "message": "Archivo no encontrado"}), 404
+        if request.if_none_match.contains(info['sha256']):
+            return Response(status=304, headers={'ETag': f'"{info["sha256"]}"'})
+        if (if_range.etag and if_range.etag != info['sha256']) or (if_range.date and info['modified'] > if_range.date.timestamp()):
+            # El cliente tiene otra versión: se envía el archivo completo
+            byte_range = None
+    
+    if byte_range:
+        start, stop = byte_range.ranges[0]
+        if start < 0:
+            start = max(0, info['size'] + start)
+        offset, length = start, (stop - start if stop is not None else None)
+    
+    opened = node.open_file(filename, offset, length)
+    if opened is None:
+        return jsonify({"status": "error", "message": "Archivo no encontrado"}), 404
+    
+    header, chunks = opened
+    headers = {
+        'Content-Length': str(header['length']),
+        'Content-Disposition': f'attachment; filename="{os.path.basename(filename)}"',
+        'Accept-Ranges': 'bytes',
+        'ETag': f'"{header["sha256"]}"'
+    }
+    
+    if not byte_range:
+        return Response(chunks, mimetype='application/octet-stream', headers=headers)
+    
+    if offset >= header['size']:
+        for _ in chunks:
+            pass
+        return Response(status=416, headers={'Content-Range': f"bytes */{header['size']}"})
+    
+    headers['Content-Range'] = f"bytes {header['offset']}-{header['offset'] + header['length'] - 1}/{header['size']}"
+    return Response(chunks, status=206, mimetype='application/octet-stream', headers=headers)
+
+@app.route('/api/offline/progress', methods=['GET'])
+def get_offline_progress():
+    """API para consultar el progreso del reenvío de la cola offline"""
+    return jsonify(node.get_offline_progress())
+
+@app.route('/api/owners', methods=['GET'])
+def get_owners():
+    """API para consultar qué nodos guardan las réplicas de un archivo"""
+    filename = request.args.get('filename')
+    if not filename:
+        return jsonify({"status": "error", "message": "Falta nombre de archivo"})
+    return jsonify({"status": "ok", "filename": filename, "owners": node.get_file_owners(filename)})
+
+@app.route('/api/conflicts', methods=['GET'])
+def get_conflicts():
+    """API para listar las escrituras concurrentes detectadas en la sincronización"""
+    return jsonify({"status": "ok", "conflicts": node.get_conflicts()})
+
+@app.route('/api/conflicts/resolve', methods=['POST'])
+def resolve_conflict():
+    """API para resolver un conflicto conservando la copia local o la remota"""
+    data = request.get_json()
+    filename = data.get('filename')
+    keep = data.get('keep', 'local')
+    
+    if not filename or keep not in ('local', 'remote'):
+        return jsonify({"status": "error", "message": "Faltan parámetros"})
+    
+    if node.resolve_conflict(filename, keep):
+        return jsonify({"status": "ok"})
+    else:
+        return jsonify({"status": "error", "message": "Error al resolver el conflicto"})
+
 def start_node():
     """Inicia el nodo en un thread separado"""
     node.start()
+    remote_poller.start()
 
 if __name__ == '__main__':
     # Iniciar el nodo en un thread separado
@@ -0,0 +1,64 @@
+import argparse
+import glob
+import json
+import os
+import random
+import time
+import compressor
+from config import STREAM_CHUNK_SIZE
+
+def sample_payloads(size):
+    """Contenidos representativos del tráfico entre nodos, de unos `size` bytes cada uno"""
+    operations = []
+    length = 0
+    while length < size:
+        i = len(operations)
+        operations.append({
+            "type": "transfer", "source_node": f"Nodo{i % 5}", "target_node": f"Nodo{(i + 1) % 5}",
+            "timestamp": 1700000000 + i * 0.37, "operation_id": f"{i:015x}_Nodo{i % 5}",
+            "filename": f"proyectos/informe_{i}.txt", "version": {f"Nodo{i % 5}": i}
+        })
+        length += len(json.dumps(operations[-1])) + 2
+    source = b''.join(open(path, 'rb').read() for path in sorted(glob.glob(os.path.join(os.path.dirname(__file__), '*.py'))))
+    return [
+        ("Respuesta de sincronización (JSON)", json.dumps({"status": "ok", "operations": operations}).encode('utf-8')[:size]),
+        ("Código fuente", (source * (size // max(len(source), 1) + 1))[:size]),
+        ("Aleatorio (ya comprimido)", random.randbytes(size)),
+    ]
+
+def run(codec, data, block_size):
+    """Comprime y descomprime `data` en bloques; devuelve (MB/s al comprimir, MB/s al descomprimir, ratio, segundos de CPU)"""
+    blocks = [data[i:i + block_size] for i in range(0, len(data), block_size)]
+
+    start, cpu = time.perf_counter(), time.process_time()
+    compressed = [compressor.compress(block, codec.name, min_size=0) for block in blocks]
+    compress_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for codec_id, block in compressed:
+        compressor.decompress(codec_id, block)
+    decompress_time = time.perf_counter() - start
+    cpu = time.process_time() - cpu
+
+    megabytes = len(data) / (1024 * 1024)
+    ratio = sum(len(block) for _, block in compressed) / len(data)
+    return megabytes / compress_time, megabytes / decompress_time, ratio, cpu
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de los códecs de compresión entre nodos")
+    parser.add_argument("--size", type=int, default=16 * 1024 * 1024, help="Bytes por contenido de prueba")
+    parser.add_argument("--block-size", type=int, default=STREAM_CHUNK_SIZE, help="Tamaño de bloque comprimido")
+    args = parser.parse_args()
+
+    print(f"Códecs disponibles: {', '.join(compressor.CODECS)}")
+    for name, data in sample_payloads(args.size):
+        sample = data[:64 * 1024]
+        print(f"\n{name}: entropía {compressor.entropy(sample):.2f} bits/byte, "
+              f"{'se comprime' if compressor.worth_compressing(None, sample) else 'se envía sin comprimir'}")
+        print(f"{'Códec':<8}{'comp. MB/s':>12}{'desc. MB/s':>12}{'ratio':>8}{'CPU s':>8}")
+        for codec in compressor.CODECS.values():
+            compress_speed, decompress_speed, ratio, cpu = run(codec, data, args.block_size)
+            print(f"{codec.name:<8}{compress_speed:>12.1f}{decompress_speed:>12.1f}{ratio:>8.3f}{cpu:>8.2f}")
+
+if __name__ == '__main__':
+    main()
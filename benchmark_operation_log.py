@@ -0,0 +1,85 @@
+import argparse
+import json
+import os
+import tempfile
+import threading
+import time
+from operation_log import OperationLog
+
+class LegacyOperationLog:
+    """Réplica del registro anterior: lista en memoria reescrita completa con indent=2 en cada operación"""
+    
+    def __init__(self, log_file):
+        self.log_file = log_file
+        self.lock = threading.Lock()
+        self.operations = []
+    
+    def add_operation(self, operation_type, source_node, target_node=None, filename=None, timestamp=None):
+        if timestamp is None:
+            timestamp = time.time()
+        
+        operation = {
+            "type": operation_type,
+            "source_node": source_node,
+            "timestamp": timestamp,
+            "operation_id": f"{source_node}_{timestamp}"
+        }
+        if target_node:
+            operation["target_node"] = target_node
+        if filename:
+            operation["filename"] = filename
+        
+        with self.lock:
+            self.operations.append(operation)
+            with open(self.log_file, 'w') as f:
+                json.dump(self.operations, f, indent=2)
+        return operation
+
+def run(log, operations, threads, **kwargs):
+    """Agrega `operations` operaciones repartidas en `threads` threads y devuelve operaciones por segundo"""
+    per_thread = operations // threads
+    
+    def worker(worker_id):
+        for i in range(per_thread):
+            log.add_operation("transfer", f"Nodo{worker_id}", target_node="Destino",
+                              filename=f"archivo_{worker_id}_{i}", **kwargs)
+    
+    workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+    start = time.perf_counter()
+    for w in workers:
+        w.start()
+    for w in workers:
+        w.join()
+    if hasattr(log, 'flush'):
+        log.flush()
+    elapsed = time.perf_counter() - start
+    return per_thread * threads / elapsed
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark de escritura del log de operaciones")
+    parser.add_argument("--operations", type=int, default=5000, help="Operaciones por escenario")
+    parser.add_argument("--legacy-operations", type=int, default=2000,
+                        help="Operaciones para el registro anterior (su coste es cuadrático)")
+    parser.add_argument("--threads", type=int, default=8, help="Threads escritores concurrentes")
+    args = parser.parse_args()
+    
+    with tempfile.TemporaryDirectory() as directory:
+        results = []
+        
+        legacy = LegacyOperationLog(os.path.join(directory, "legacy.log"))
+        results.append(("Anterior (reescritura JSON)", run(legacy, args.legacy_operations, args.threads)))
+        
+        log = OperationLog(os.path.join(directory, "sync.log"))
+        results.append(("Group commit (síncrono)", run(log, args.operations, args.threads, sync=True)))
+        log.close()
+        
+        log = OperationLog(os.path.join(directory, "async.log"))
+        results.append(("Group commit (asíncrono)", run(log, args.operations, args.threads, sync=False)))
+        log.close()
+    
+    print(f"{'Escenario':<32}{'ops/seg':>12}")
+    for name, ops_per_second in results:
+        print(f"{name:<32}{ops_per_second:>12.0f}")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,206 @@
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import logging
+from config import CHUNK_MIN_SIZE, CHUNK_MAX_SIZE, CHUNK_ANCHOR_LENGTH
+
+logger = logging.getLogger('sistema.chunks')
+
+# Tamaño de lectura al trocear archivos
+READ_SIZE = 4 * 1024 * 1024
+
+# Fragmentación definida por contenido: cada byte se clasifica en 0/1 con una tabla
+# fija (idéntica en todos los nodos) y se corta tras una racha de CHUNK_ANCHOR_LENGTH
+# bytes marcados. El corte depende solo de los bytes cercanos, así que una inserción
+# solo altera los chunks vecinos, y translate/find corren en C.
+ANCHOR_TABLE = bytes(hashlib.sha256(bytes([b])).digest()[0] & 1 for b in range(256))
+ANCHOR = b'\x01' * CHUNK_ANCHOR_LENGTH
+
+def iter_chunks(f, min_size=CHUNK_MIN_SIZE, max_size=CHUNK_MAX_SIZE):
+    """Recorre un archivo abierto y devuelve sus chunks definidos por contenido"""
+    buffer = b''
+    position = 0
+    eof = False
+    while position < len(buffer) or not eof:
+        if not eof and len(buffer) - position < max_size:
+            data = f.read(READ_SIZE)
+            if data:
+                buffer = buffer[position:] + data
+                position = 0
+                continue
+            eof = True
+        
+        marks = buffer[position:position + max_size].translate(ANCHOR_TABLE)
+        anchor = marks.find(ANCHOR, max(0, min_size - len(ANCHOR)))
+        if anchor != -1:
+            cut = anchor + len(ANCHOR)
+        else:
+            cut = min(len(buffer) - position, max_size)
+        
+        yield buffer[position:position + cut]
+        position += cut
+
+def chunk_hash(data):
+    """Identificador de un chunk por su contenido"""
+    return hashlib.sha256(data).hexdigest()
+
+class ChunkStore:
+    """Almacén de chunks direccionados por contenido con un manifiesto por archivo"""
+    
+    def __init__(self, root):
+        self.root = root
+        self.chunks_dir = os.path.join(root, "chunks")
+        self.manifests_dir = os.path.join(root, "manifests")
+        # Serializa las altas y bajas para que un chunk no se borre mientras otro archivo lo incorpora
+        self.lock = threading.RLock()
+        self.references = {}  # hash -> número de manifiestos que lo usan
+        
+        os.makedirs(self.chunks_dir, exist_ok=True)
+        os.makedirs(self.manifests_dir, exist_ok=True)
+        self._load_references()
+    
+    def _load_references(self):
+        """Reconstruye el conteo de referencias a partir de los manifiestos"""
+        for name in os.listdir(self.manifests_dir):
+            manifest = self._read_manifest_file(os.path.join(self.manifests_dir, name))
+            if manifest:
+                self._add_references(manifest)
+    
+    def _add_references(self, manifest):
+        """Suma una referencia por cada chunk de un manifiesto"""
+        for chunk, _ in manifest["chunks"]:
+            self.references[chunk] = self.references.get(chunk, 0) + 1
+    
+    def _remove_references(self, manifest):
+        """Libera las referencias de un manifiesto y borra los chunks que quedan sin uso"""
+        for chunk, _ in manifest["chunks"]:
+            count = self.references.get(chunk, 0) - 1
+            if count > 0:
+                self.references[chunk] = count
+                continue
+            self.references.pop(chunk, None)
+            try:
+                os.remove(self.chunk_path(chunk))
+            except FileNotFoundError:
+                pass
+    
+    def chunk_path(self, chunk):
+        """Ruta del archivo que contiene un chunk"""
+        return os.path.join(self.chunks_dir, chunk[:2], chunk)
+    
+    def _manifest_path(self, filename):
+        """Ruta del manifiesto de un archivo"""
+        name = hashlib.sha256(filename.encode('utf-8')).hexdigest()
+        return os.path.join(self.manifests_dir, f"{name}.json")
+    
+    def _read_manifest_file(self, path):
+        """Lee un manifiesto; devuelve None si no existe o está dañado"""
+        try:
+            with open(path, 'r') as f:
+                return json.load(f)
+        except (OSError, json.JSONDecodeError):
+            return None
+    
+    def has_chunk(self, chunk):
+        """Indica si el chunk está almacenado localmente"""
+        return os.path.exists(self.chunk_path(chunk))
+    
+    def missing_chunks(self, chunks):
+        """Devuelve los chunks de la lista que no están almacenados localmente"""
+        return [chunk for chunk in dict.fromkeys(chunks) if not self.has_chunk(chunk)]
+    
+    def put_chunk(self, chunk, data):
+        """Guarda un chunk si no existía, verificando su contenido"""
+        if chunk_hash(data) != chunk:
+            raise ValueError(f"El contenido no corresponde al chunk {chunk}")
+        
+        path = self.chunk_path(chunk)
+        if os.path.exists(path):
+            return
+        
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path))
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+        os.replace(temp_path, path)
+    
+    def get_manifest(self, filename, file_path):
+        """Devuelve el manifiesto de un archivo, regenerándolo si el archivo cambió"""
+        stat = os.stat(file_path)
+        manifest = self._read_manifest_file(self._manifest_path(filename))
+        if manifest and manifest["size"] == stat.st_size and manifest["modified"] == stat.st_mtime:
+            return manifest
+        return self.store_file(filename, file_path)
+    
+    def store_file(self, filename, file_path):
+        """Trocea un archivo, guarda sus chunks nuevos y escribe su manifiesto"""
+        chunks = []
+        with self.lock:
+            with open(file_path, 'rb') as f:
+                stat = os.fstat(f.fileno())
+                for data in iter_chunks(f):
+                    chunk = chunk_hash(data)
+                    self.put_chunk(chunk, data)
+                    chunks.append([chunk, len(data)])
+            
+            manifest = {
+                "filename": filename,
+                "size": stat.st_size,
+                "modified": stat.st_mtime,
+                "chunks": chunks
+            }
+            self._write_manifest(filename, manifest)
+        return manifest
+    
+    def _write_manifest(self, filename, manifest):
+        """Reemplaza el manifiesto de un archivo actualizando las referencias"""
+        path = self._manifest_path(filename)
+        with self.lock:
+            previous = self._read_manifest_file(path)
+            
+            fd, temp_path = tempfile.mkstemp(dir=self.manifests_dir)
+            with os.fdopen(fd, 'w') as f:
+                json.dump(manifest, f)
+            os.replace(temp_path, path)
+            
+            self._add_references(manifest)
+            if previous:
+                self._remove_references(previous)
+    
+    def remove_file(self, filename):
+        """Elimina el manifiesto de un archivo y los chunks que solo usaba él"""
+        path = self._manifest_path(filename)
+        with self.lock:
+            manifest = self._read_manifest_file(path)
+            if not manifest:
+                return
+            os.remove(path)
+            self._remove_references(manifest)
+    
+    def ingest_chunks(self, spool, chunks):
+        """Guarda los chunks recibidos concatenados en un archivo, en el orden dado"""
+        for chunk, size in chunks:
+            data = spool.read(size)
+            if len(data) < size:
+                raise ValueError("Datos de chunks truncados")
+            self.put_chunk(chunk, data)
+    
+    def assemble(self, chunks, out):
+        """Escribe en `out` el contenido de un archivo a partir de sus chunks"""
+        for chunk, _ in chunks:
+            with open(self.chunk_path(chunk), 'rb') as f:
+                out.write(f.read())
+    
+    def record_file(self, filename, file_path, chunks):
+        """Registra el manifiesto de un archivo ensamblado a partir de chunks conocidos"""
+        stat = os.stat(file_path)
+        manifest = {
+            "filename": filename,
+            "size": stat.st_size,
+            "modified": stat.st_mtime,
+            "chunks": chunks
+        }
+        self._write_manifest(filename, manifest)
+        return manifest
@@ -0,0 +1,85 @@
+import collections
+import lzma
+import math
+import os
+import zlib
+from config import COMPRESSION_CODECS, COMPRESSION_MIN_SIZE, COMPRESSION_MAX_ENTROPY
+
+try:
+    import zstandard
+except ImportError:  # zstd es opcional: sin él se negocia zlib o LZMA
+    zstandard = None
+
+# Extensiones cuyo contenido ya viene comprimido: no vale la pena intentarlo de nuevo
+COMPRESSED_EXTENSIONS = {
+    '.gz', '.tgz', '.bz2', '.xz', '.lz4', '.zst', '.zip', '.7z', '.rar', '.jar', '.apk',
+    '.jpg', '.jpeg', '.png', '.gif', '.webp', '.heic', '.mp3', '.aac', '.ogg', '.flac',
+    '.mp4', '.m4a', '.mkv', '.avi', '.mov', '.webm', '.pdf', '.docx', '.xlsx', '.pptx'
+}
+
+class Codec:
+    """Compresor de bloques independientes identificado en el cable por un número de 1 a 15"""
+
+    def __init__(self, name, codec_id, compress, decompress):
+        self.name = name
+        self.codec_id = codec_id
+        self.compress = compress
+        self.decompress = decompress
+
+CODECS = {}  # nombre -> Codec disponible en este nodo
+CODECS_BY_ID = {}  # identificador en el cable -> Codec
+
+def _register(codec):
+    """Agrega un códec a los disponibles"""
+    CODECS[codec.name] = codec
+    CODECS_BY_ID[codec.codec_id] = codec
+
+_register(Codec("zlib", 1, lambda data: zlib.compress(data, 6), zlib.decompress))
+_register(Codec("lzma", 2, lambda data: lzma.compress(data, preset=1), lzma.decompress))
+if zstandard:
+    _register(Codec("zstd", 3, lambda data: zstandard.compress(data, 3), zstandard.decompress))
+
+def available_codecs():
+    """Códecs que este nodo acepta, en orden de preferencia"""
+    return [name for name in COMPRESSION_CODECS if name in CODECS]
+
+def choose_codec(offered):
+    """El códec preferido por este nodo entre los que ofrece el otro extremo (None si no hay ninguno en común)"""
+    offered = set(offered or [])
+    for name in available_codecs():
+        if name in offered:
+            return name
+    return None
+
+def compress(data, codec_name, min_size=COMPRESSION_MIN_SIZE):
+    """Comprime un bloque si es lo bastante grande y se reduce; devuelve (identificador del códec o 0, datos)"""
+    codec = CODECS.get(codec_name) if codec_name else None
+    if codec is None or len(data) < min_size:
+        return 0, data
+    compressed = codec.compress(data)
+    if len(compressed) >= len(data):
+        # Contenido incompresible: enviarlo tal cual ahorra la descompresión
+        return 0, data
+    return codec.codec_id, compressed
+
+def decompress(codec_id, data):
+    """Descomprime un bloque según el identificador recibido"""
+    if not codec_id:
+        return data
+    codec = CODECS_BY_ID.get(codec_id)
+    if codec is None:
+        raise ValueError(f"Códec de compresión desconocido: {codec_id}")
+    return codec.decompress(data)
+
+def entropy(sample):
+    """Entropía de Shannon de una muestra en bits por byte (8 = aleatoria o ya comprimida)"""
+    if not sample:
+        return 0.0
+    total = len(sample)
+    return -sum(count / total * math.log2(count / total) for count in collections.Counter(sample).values())
+
+def worth_compressing(filename, sample):
+    """Indica si conviene comprimir un archivo según su extensión y la entropía de una muestra"""
+    if filename and os.path.splitext(filename)[1].lower() in COMPRESSED_EXTENSIONS:
+        return False
+    return entropy(sample) < COMPRESSION_MAX_ENTROPY
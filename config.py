@@ -17,11 +17,23 @@ logging.basicConfig(
 logger = logging.getLogger('sistema')
 
 # Definir manualmente qué máquina es esta usando una variable de entorno o un archivo de configuración local
-# Si quieres cambiar de máquina, solo cambia esta variable
-THIS_NODE = "MacOS1"  # Opciones: "MacOS1", "MacOS2", "Ubuntu1", "Ubuntu2"
+# Si quieres cambiar de máquina, solo cambia esta variable (o define SISTEMA_NODE)
+THIS_NODE = os.environ.get("SISTEMA_NODE", "MacOS1")  # Opciones: "MacOS1", "MacOS2", "Ubuntu1", "Ubuntu2" o cualquier nombre nuevo
+
+# Modo local: varios nodos en la misma máquina (127.0.0.1), cada uno con sus propios puertos
+LOCAL_MODE = os.environ.get("SISTEMA_LOCAL_MODE") == "1"
 
 def get_ip_address():
     """Obtiene la IP basada en el nodo configurado"""
+    # Una IP indicada explícitamente tiene prioridad
+    if os.environ.get("SISTEMA_IP"):
+        ip = os.environ["SISTEMA_IP"]
+        logger.info(f"Usando IP de SISTEMA_IP: {ip}")
+        return ip
+    if LOCAL_MODE:
+        logger.info("Modo local: usando 127.0.0.1")
+        return "127.0.0.1"
+    
     # Definimos las IPs de los nodos
     node_ips = {
         "MacOS1": "172.26.163.109",
@@ -123,33 +135,41 @@ else:
     
     # Asignamos directamente el nombre del nodo
     NODE_NAME = THIS_NODE
-    logger.info(f"Este nodo se identificó como: {NODE_NAME}")
-    
-    # Verificamos que el nodo exista en la configuración
-    if NODE_NAME not in NODES:
-        logger.error(f"El nodo '{NODE_NAME}' no existe en la configuración NODES.")
-        logger.info("Nodos disponibles:")
-        for name, info in NODES.items():
-            logger.info(f"  - {name}: {info['ip']}")
-        logger.error("Por favor, corrige la variable THIS_NODE.")
-        exit(1)
-    
-    # Verificamos que la IP coincida
-    if NODES[NODE_NAME]["ip"] != IP_ADDRESS:
-        logger.error(f"La IP configurada para {NODE_NAME} ({NODES[NODE_NAME]['ip']}) no coincide con la IP seleccionada ({IP_ADDRESS}).")
-        logger.error("Por favor, verifica la configuración de nodos y la variable THIS_NODE.")
-        exit(1)
+logger.info(f"Este nodo se identificó como: {NODE_NAME}")
 
 # Puerto para la interfaz web
-WEB_PORT = NODES[NODE_NAME]["port"]
+WEB_PORT = int(os.environ.get("SISTEMA_WEB_PORT", NODES.get(NODE_NAME, {}).get("port", 8080)))
 logger.info(f"Puerto web: {WEB_PORT}")
 
 # Puerto para la comunicación entre nodos (cambiado a un rango diferente)
-NETWORK_PORT = 9090
+NETWORK_PORT = int(os.environ.get("SISTEMA_NETWORK_PORT", 9090))
 logger.info(f"Puerto de red: {NETWORK_PORT}")
 
+# Los nodos de la configuración estática escuchan en el puerto de red por defecto
+for info in NODES.values():
+    info.setdefault("network_port", 9090)
+
+# Nodos semilla a los que se pide unirse al clúster ("ip:puerto_de_red" separados por comas)
+# Sin SISTEMA_SEEDS, los nodos de la configuración estática hacen de semillas; con él, la lista
+# estática se ignora y los demás miembros se descubren al unirse
+if os.environ.get("SISTEMA_SEEDS") is not None:
+    NODES = {}
+    SEEDS = []
+    for seed in os.environ["SISTEMA_SEEDS"].split(","):
+        if seed.strip():
+            host, _, port = seed.strip().rpartition(":")
+            SEEDS.append((host, int(port)))
+else:
+    SEEDS = [(info["ip"], info["network_port"]) for name, info in NODES.items() if name != NODE_NAME]
+
+# Un nodo fuera de la configuración estática, o con otra IP, se anuncia con su dirección real al unirse
+if NODE_NAME in NODES and NODES[NODE_NAME]["ip"] != IP_ADDRESS:
+    logger.warning(f"La IP configurada para {NODE_NAME} ({NODES[NODE_NAME]['ip']}) no coincide con la IP seleccionada ({IP_ADDRESS}); se usará {IP_ADDRESS}")
+NODES[NODE_NAME] = {"ip": IP_ADDRESS, "port": WEB_PORT, "network_port": NETWORK_PORT}
+logger.info(f"Nodos semilla: {SEEDS}")
+
 # Directorio para archivos compartidos
-SHARED_DIR = os.path.join(os.path.expanduser("~"), "sistema_tolerante_fallas_files")
+SHARED_DIR = os.environ.get("SISTEMA_SHARED_DIR", os.path.join(os.path.expanduser("~"), "sistema_tolerante_fallas_files"))
 os.makedirs(SHARED_DIR, exist_ok=True)
 logger.info(f"Directorio compartido: {SHARED_DIR}")
 
@@ -157,13 +177,92 @@ logger.info(f"Directorio compartido: {SHARED_DIR}")
 LOG_FILE = os.path.join(SHARED_DIR, "operations.log")
 logger.info(f"Archivo de log: {LOG_FILE}")
 
-# Intervalo de heartbeat en segundos (aumentado para reducir carga)
-HEARTBEAT_INTERVAL = 10
-logger.info(f"Intervalo de heartbeat: {HEARTBEAT_INTERVAL} segundos")
+# Número de operaciones agregadas al log entre compactaciones del archivo
+LOG_COMPACTION_INTERVAL = 10000
+logger.info(f"Intervalo de compactación del log: {LOG_COMPACTION_INTERVAL} operaciones")
+
+# Antigüedad a partir de la cual una lápida se descarta aunque algún nodo conocido (caído o retirado) no la haya leído (segundos)
+TOMBSTONE_RETENTION = 7 * 24 * 3600
+logger.info(f"Retención máxima de lápidas: {TOMBSTONE_RETENTION} segundos")
+
+# Espera adicional del thread de escritura del log para agrupar más operaciones por fsync (segundos)
+LOG_GROUP_COMMIT_DELAY = 0
+logger.info(f"Espera de group commit del log: {LOG_GROUP_COMMIT_DELAY} segundos")
+
+# Espera antes de reintentar un lote del log que no se pudo escribir (segundos)
+LOG_WRITE_RETRY_DELAY = 1
+logger.info(f"Reintento de escritura del log: {LOG_WRITE_RETRY_DELAY} segundos")
+
+# Si add_operation espera por defecto a que la operación esté en disco
+LOG_SYNC_COMMIT = True
+logger.info(f"Escritura síncrona del log: {LOG_SYNC_COMMIT}")
+
+# Profundidad del árbol de Merkle sobre el log (16^profundidad hojas)
+MERKLE_DEPTH = 3
+logger.info(f"Profundidad del árbol de Merkle: {MERKLE_DEPTH}")
+
+# Cursores de sincronización por nodo: hasta dónde se leyó el log de cada uno
+SYNC_CURSORS_FILE = os.path.join(SHARED_DIR, "sync_cursors.json")
+logger.info(f"Archivo de cursores de sincronización: {SYNC_CURSORS_FILE}")
+
+# Operaciones remotas que no se pudieron aplicar tras varios intentos: se reintentan aparte sin frenar el cursor
+SYNC_RETRY_FILE = os.path.join(SHARED_DIR, "sync_retry.json")
+logger.info(f"Archivo de operaciones a reintentar: {SYNC_RETRY_FILE}")
 
-# Tiempo máximo sin recibir heartbeat antes de considerar un nodo caído (aumentado)
-NODE_TIMEOUT = 30
-logger.info(f"Timeout de nodo: {NODE_TIMEOUT} segundos")
+# Intentos fallidos de una operación antes de apartarla para reintentarla en segundo plano
+SYNC_MAX_ATTEMPTS = 3
+logger.info(f"Intentos antes de apartar una operación: {SYNC_MAX_ATTEMPTS}")
+
+# Máximo de operaciones pedidas por mensaje durante la sincronización
+SYNC_BATCH_SIZE = 500
+logger.info(f"Operaciones por lote de sincronización: {SYNC_BATCH_SIZE}")
+
+# Diferencia de operaciones con el log de otro nodo a partir de la cual conviene ponerse al día con una instantánea
+SNAPSHOT_MIN_GAP = 1000
+logger.info(f"Diferencia mínima para sincronizar por instantánea: {SNAPSHOT_MIN_GAP} operaciones")
+
+# Archivos de una instantánea que se descargan en paralelo
+SNAPSHOT_WORKERS = 8
+logger.info(f"Descargas paralelas de una instantánea: {SNAPSHOT_WORKERS}")
+
+# Detector de fallos SWIM: en cada periodo se sondea un solo nodo elegido en orden aleatorio (en segundos)
+PROBE_INTERVAL = 2
+logger.info(f"Periodo de sondeo: {PROBE_INTERVAL} segundos")
+
+# Tiempo de espera de la respuesta a un sondeo directo (en segundos)
+PROBE_TIMEOUT = 1
+logger.info(f"Timeout de sondeo: {PROBE_TIMEOUT} segundos")
+
+# Nodos a los que se pide un sondeo indirecto cuando el directo falla
+INDIRECT_PROBES = 3
+logger.info(f"Sondeos indirectos: {INDIRECT_PROBES}")
+
+# Tiempo que un nodo puede seguir sospechoso antes de considerarlo caído (en segundos)
+SUSPICION_TIMEOUT = 10
+logger.info(f"Timeout de sospecha: {SUSPICION_TIMEOUT} segundos")
+
+# Actualizaciones de pertenencia adjuntas como máximo a cada mensaje
+GOSSIP_MAX_UPDATES = 8
+logger.info(f"Actualizaciones de gossip por mensaje: {GOSSIP_MAX_UPDATES}")
+
+# Cada actualización se reenvía GOSSIP_RETRANSMIT_MULT * log2(n) veces
+GOSSIP_RETRANSMIT_MULT = 3
+logger.info(f"Multiplicador de retransmisión de gossip: {GOSSIP_RETRANSMIT_MULT}")
+
+# Peso de cada nueva medición en la latencia media por nodo (media móvil exponencial)
+LATENCY_EWMA_ALPHA = 0.2
+logger.info(f"Peso de la media móvil de latencia: {LATENCY_EWMA_ALPHA}")
+
+# Una lectura se pide también a otra réplica si la primera tarda más que HEDGE_DELAY_FACTOR veces
+# su latencia media (y al menos HEDGE_MIN_DELAY segundos)
+HEDGE_DELAY_FACTOR = 3
+HEDGE_MIN_DELAY = 0.05
+logger.info(f"Lecturas de cobertura: {HEDGE_DELAY_FACTOR}x la latencia media, mínimo {HEDGE_MIN_DELAY} segundos")
+
+# Intervalos recordados y desviación mínima (en segundos) del nivel de sospecha phi-accrual
+PHI_WINDOW = 100
+PHI_MIN_STD = 0.5
+logger.info(f"Phi-accrual: ventana de {PHI_WINDOW} intervalos, desviación mínima {PHI_MIN_STD} segundos")
 
 # Tiempo de espera para operaciones de red (en segundos)
 NETWORK_TIMEOUT = 10
@@ -173,6 +272,145 @@ logger.info(f"Timeout de red: {NETWORK_TIMEOUT} segundos")
 MAX_RETRIES = 3
 logger.info(f"Máximo de reintentos: {MAX_RETRIES}")
 
-# Tamaño máximo de archivo para transferencia directa (en bytes)
-MAX_DIRECT_TRANSFER_SIZE = 10 * 1024 * 1024  # 10MB
-logger.info(f"Tamaño máximo de transferencia directa: {MAX_DIRECT_TRANSFER_SIZE} bytes")
\ No newline at end of file
+# Tamaño de bloque para transferencias de archivos en streaming (en bytes)
+STREAM_CHUNK_SIZE = 1024 * 1024  # 1MB
+logger.info(f"Tamaño de bloque de transferencia: {STREAM_CHUNK_SIZE} bytes")
+
+# Códecs de compresión aceptados entre nodos, en orden de preferencia (zstd solo si está instalado);
+# con la lista vacía no se comprime nada
+COMPRESSION_CODECS = [codec for codec in os.environ.get("SISTEMA_COMPRESSION", "zstd,zlib,lzma").split(",") if codec]
+logger.info(f"Códecs de compresión: {COMPRESSION_CODECS}")
+
+# Tamaño mínimo de un mensaje o bloque para intentar comprimirlo (bytes)
+COMPRESSION_MIN_SIZE = 4 * 1024
+logger.info(f"Tamaño mínimo para comprimir: {COMPRESSION_MIN_SIZE} bytes")
+
+# Entropía (bits por byte) de la muestra de un archivo a partir de la cual se envía sin comprimir
+COMPRESSION_MAX_ENTROPY = 7.5
+logger.info(f"Entropía máxima para comprimir: {COMPRESSION_MAX_ENTROPY} bits por byte")
+
+# Tamaño de la muestra de un archivo con la que se decide si comprimirlo (bytes)
+COMPRESSION_SAMPLE_SIZE = 64 * 1024
+logger.info(f"Muestra para decidir la compresión: {COMPRESSION_SAMPLE_SIZE} bytes")
+
+# Tamaño de bloque para transferencias por delta (sumas de comprobación por bloque)
+DELTA_BLOCK_SIZE = 16 * 1024  # 16KB
+logger.info(f"Tamaño de bloque de delta: {DELTA_BLOCK_SIZE} bytes")
+
+# Tamaño mínimo de archivo para intentar una transferencia por delta
+DELTA_MIN_FILE_SIZE = 1024 * 1024  # 1MB
+logger.info(f"Tamaño mínimo para delta: {DELTA_MIN_FILE_SIZE} bytes")
+
+# Si el delta supera esta fracción del archivo, se envía el archivo completo
+DELTA_MAX_RATIO = 0.8
+logger.info(f"Proporción máxima de delta: {DELTA_MAX_RATIO}")
+
+# Almacén de chunks direccionados por contenido (deduplicación entre archivos y transferencias)
+CHUNK_STORE_ENABLED = False
+CHUNK_STORE_DIR = os.path.join(SHARED_DIR, ".chunk_store")
+logger.info(f"Almacén de chunks habilitado: {CHUNK_STORE_ENABLED} ({CHUNK_STORE_DIR})")
+
+# Límites de tamaño de los chunks y longitud del ancla de corte (tamaño medio ~ 2^(longitud+1) bytes)
+CHUNK_MIN_SIZE = 16 * 1024  # 16KB
+CHUNK_MAX_SIZE = 256 * 1024  # 256KB
+CHUNK_ANCHOR_LENGTH = 15
+logger.info(f"Chunks: mínimo {CHUNK_MIN_SIZE} bytes, máximo {CHUNK_MAX_SIZE} bytes, ancla {CHUNK_ANCHOR_LENGTH}")
+
+# Conexiones persistentes por nodo en el pool de red
+POOL_CONNECTIONS_PER_PEER = 2
+logger.info(f"Conexiones persistentes por nodo: {POOL_CONNECTIONS_PER_PEER}")
+
+# Hilos para procesar peticiones recibidas de otros nodos
+NETWORK_WORKERS = 16
+logger.info(f"Hilos de procesamiento de red: {NETWORK_WORKERS}")
+
+# Envíos simultáneos como máximo al difundir un mensaje a todos los nodos
+FANOUT_CONCURRENCY = 8
+logger.info(f"Envíos simultáneos en difusión: {FANOUT_CONCURRENCY}")
+
+# Tiempo máximo para que un nodo confirme un mensaje difundido, incluidos los reintentos (segundos)
+PEER_DEADLINE = 15
+logger.info(f"Plazo por nodo en difusión: {PEER_DEADLINE} segundos")
+
+# Confirmaciones de otros nodos necesarias antes de dar por completada una eliminación
+# (el resto de los nodos se sigue notificando en segundo plano)
+DELETE_QUORUM = 1
+logger.info(f"Quórum de eliminación: {DELETE_QUORUM}")
+
+# Nodos con los que se sincroniza en paralelo
+SYNC_WORKERS = 4
+logger.info(f"Sincronizaciones simultáneas: {SYNC_WORKERS}")
+
+# Intervalo entre reconciliaciones completas del índice de archivos con el disco (en segundos)
+FILE_INDEX_RECONCILE_INTERVAL = 300
+logger.info(f"Intervalo de reconciliación del índice de archivos: {FILE_INDEX_RECONCILE_INTERVAL} segundos")
+
+# Eventos pendientes como máximo por cliente web antes de pedirle que recargue todo
+EVENT_QUEUE_SIZE = 1000
+logger.info(f"Eventos en cola por cliente web: {EVENT_QUEUE_SIZE}")
+
+# Intervalo entre consultas de los listados de nodos remotos mientras haya clientes web (en segundos)
+REMOTE_POLL_INTERVAL = 5
+logger.info(f"Intervalo de consulta de listados remotos: {REMOTE_POLL_INTERVAL} segundos")
+
+# Intervalo entre comentarios keep-alive en las conexiones de eventos (en segundos)
+EVENTS_KEEPALIVE_INTERVAL = 15
+logger.info(f"Keep-alive de eventos: {EVENTS_KEEPALIVE_INTERVAL} segundos")
+
+# Cambios recientes del índice de archivos que se conservan para responder listados diferenciales
+FILE_INDEX_JOURNAL_SIZE = 10000
+logger.info(f"Historial de cambios del índice de archivos: {FILE_INDEX_JOURNAL_SIZE}")
+
+# Tiempo durante el que un listado remoto en caché se sirve sin consultar al nodo (en segundos)
+REMOTE_LISTING_TTL = 2
+logger.info(f"TTL de listados remotos: {REMOTE_LISTING_TTL} segundos")
+
+# Tiempo durante el que un listado remoto vencido aún se sirve mientras se revalida en segundo plano (en segundos)
+REMOTE_LISTING_STALE = 60
+logger.info(f"Listados remotos vencidos servibles durante: {REMOTE_LISTING_STALE} segundos")
+
+# Intervalo entre intercambios completos de la tabla de miembros con un nodo al azar (en segundos)
+MEMBERSHIP_SYNC_INTERVAL = 30
+logger.info(f"Intervalo de sincronización de miembros: {MEMBERSHIP_SYNC_INTERVAL} segundos")
+
+# Intervalo entre reintentos de unión mientras ningún nodo semilla responda (en segundos)
+JOIN_RETRY_INTERVAL = 10
+logger.info(f"Reintento de unión al clúster: {JOIN_RETRY_INTERVAL} segundos")
+
+# Directorio de la cola offline (segmentos de solo agregado y contenido de los archivos por hash)
+OFFLINE_QUEUE_DIR = "offline_queue"
+logger.info(f"Directorio de la cola offline: {OFFLINE_QUEUE_DIR}")
+
+# Registros por segmento de la cola offline antes de compactarla
+OFFLINE_SEGMENT_MAX_RECORDS = 1000
+logger.info(f"Registros por segmento de la cola offline: {OFFLINE_SEGMENT_MAX_RECORDS}")
+
+# Operaciones offline reenviadas en paralelo al reconectarse
+OFFLINE_REPLAY_WORKERS = 4
+logger.info(f"Reenvíos offline simultáneos: {OFFLINE_REPLAY_WORKERS}")
+
+# Caudal máximo del reenvío de la cola offline (bytes por segundo, 0 sin límite)
+OFFLINE_REPLAY_RATE = 5 * 1024 * 1024  # 5MB/s
+logger.info(f"Caudal de reenvío offline: {OFFLINE_REPLAY_RATE} bytes/s")
+
+# Intervalo entre reintentos del reenvío de la cola offline aunque no cambie el estado de los nodos (en segundos)
+OFFLINE_REPLAY_INTERVAL = 60
+logger.info(f"Reintento de reenvío offline: {OFFLINE_REPLAY_INTERVAL} segundos")
+
+# Réplicas de cada archivo en el anillo de hashing consistente (0 desactiva la ubicación automática).
+# Desactivada por defecto: al activarla, cada nodo migra y libera las copias de las que no es dueño,
+# también las que se ubicaron a mano con una transferencia
+REPLICATION_FACTOR = int(os.environ.get("SISTEMA_REPLICATION", "0"))
+logger.info(f"Factor de replicación: {REPLICATION_FACTOR}")
+
+# Nodos virtuales por nodo en el anillo (más nodos virtuales reparten la carga de forma más pareja)
+RING_VNODES = 64
+logger.info(f"Nodos virtuales por nodo: {RING_VNODES}")
+
+# Caudal máximo de la migración de réplicas en segundo plano (bytes por segundo, 0 sin límite)
+MIGRATION_RATE = 10 * 1024 * 1024  # 10MB/s
+logger.info(f"Caudal de migración: {MIGRATION_RATE} bytes/s")
+
+# Espera tras un cambio de miembros antes de rebalancear, para no mover datos por nodos inestables (en segundos)
+REBALANCE_DELAY = 30
+logger.info(f"Espera antes de rebalancear: {REBALANCE_DELAY} segundos")
@@ -0,0 +1,233 @@
+import asyncio
+import itertools
+import json
+import struct
+import logging
+import compressor
+from config import NETWORK_TIMEOUT, POOL_CONNECTIONS_PER_PEER
+
+logger = logging.getLogger('sistema.pool')
+
+# Los 4 bits altos de la longitud indican el códec del bloque (0 = sin comprimir), así que
+# los bloques de versiones anteriores, siempre sin comprimir, se leen igual
+CODEC_SHIFT = 28
+LENGTH_MASK = (1 << CODEC_SHIFT) - 1
+
+
+def pack_block(data, codec=None):
+    """Antepone a un bloque su longitud (4 bytes, '!I'), comprimiéndolo con `codec` si vale la pena"""
+    codec_id, data = compressor.compress(data, codec)
+    if len(data) > LENGTH_MASK:
+        raise ValueError(f"Bloque demasiado grande: {len(data)} bytes")
+    return struct.pack('!I', (codec_id << CODEC_SHIFT) | len(data)) + data
+
+
+def encode_frame(message, codec=None):
+    """Serializa un mensaje JSON precedido de su longitud"""
+    return pack_block(json.dumps(message).encode('utf-8'), codec)
+
+
+async def read_raw_block(reader):
+    """Lee un bloque precedido de su longitud; devuelve (códec, datos sin descomprimir) o None si la conexión se cerró"""
+    try:
+        length_data = await reader.readexactly(4)
+    except asyncio.IncompleteReadError as e:
+        if not e.partial:
+            return None
+        raise ConnectionError("Conexión cerrada a mitad de un mensaje")
+
+    header = struct.unpack('!I', length_data)[0]
+    data = await reader.readexactly(header & LENGTH_MASK)
+    return header >> CODEC_SHIFT, data
+
+
+async def read_frame(reader):
+    """Lee un mensaje JSON precedido de su longitud; devuelve None si la conexión se cerró"""
+    block = await read_raw_block(reader)
+    if block is None:
+        return None
+    return json.loads(compressor.decompress(*block).decode('utf-8'))
+
+
+async def write_frame(writer, message, codec=None):
+    """Escribe un mensaje en el stream respetando el control de flujo"""
+    writer.write(encode_frame(message, codec))
+    await writer.drain()
+
+
+class PeerConnection:
+    """Conexión persistente con un nodo que multiplexa peticiones por request_id"""
+
+    def __init__(self, node, reader, writer):
+        self.node = node
+        self.reader = reader
+        self.writer = writer
+        self.write_lock = asyncio.Lock()
+        self.pending = {}  # request_id -> Future
+        self.request_ids = itertools.count(1)
+        self.alive = True
+        self.codec = None  # Códec acordado para los mensajes de esta conexión
+        self.reader_task = asyncio.ensure_future(self._read_loop())
+
+    @classmethod
+    async def open(cls, node, address, timeout=NETWORK_TIMEOUT):
+        """Abre una conexión con un nodo"""
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(*address), timeout)
+        connection = cls(node, reader, writer)
+        try:
+            await connection._negotiate(timeout)
+        except BaseException:
+            connection.close()
+            raise
+        return connection
+
+    async def _negotiate(self, timeout):
+        """Acuerda con el nodo el códec de compresión (ninguno si no entiende el saludo)"""
+        codecs = compressor.available_codecs()
+        if not codecs:
+            return
+        try:
+            response = await self.request({"type": "hello", "codecs": codecs}, timeout)
+        except asyncio.TimeoutError:
+            return
+        if isinstance(response, dict) and response.get("codec") in codecs:
+            self.codec = response["codec"]
+
+    def in_flight(self):
+        """Número de peticiones pendientes de respuesta"""
+        return len(self.pending)
+
+    async def request(self, message, timeout=NETWORK_TIMEOUT):
+        """Envía una petición y espera su respuesta"""
+        if not self.alive:
+            raise ConnectionError(f"Conexión con {self.node} cerrada")
+
+        request_id = next(self.request_ids)
+        future = asyncio.get_running_loop().create_future()
+        self.pending[request_id] = future
+
+        try:
+            async with self.write_lock:
+                await write_frame(self.writer, dict(message, request_id=request_id), self.codec)
+            return await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            raise
+        except OSError:
+            self.close()
+            raise
+        finally:
+            self.pending.pop(request_id, None)
+
+    async def _read_loop(self):
+        """Lee respuestas y las entrega a la petición correspondiente"""
+        error = ConnectionError(f"Conexión con {self.node} cerrada")
+        try:
+            while self.alive:
+                response = await read_frame(self.reader)
+                if response is None:
+                    break
+
+                request_id = response.pop("request_id", None)
+                future = self.pending.pop(request_id, None)
+                if future is None:
+                    logger.warning(f"Respuesta de {self.node} sin petición asociada: {request_id}")
+                    continue
+
+                if not future.done():
+                    future.set_result(response)
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            if self.alive:
+                logger.debug(f"Lector de conexión con {self.node} terminado: {e}")
+                error = ConnectionError(f"Conexión con {self.node} perdida: {e}")
+        finally:
+            self._fail_pending(error)
+            self.close()
+
+    def _fail_pending(self, error):
+        """Despierta todas las peticiones pendientes con un error"""
+        pending = list(self.pending.values())
+        self.pending.clear()
+        for future in pending:
+            if not future.done():
+                future.set_exception(error)
+
+    def close(self):
+        """Cierra la conexión"""
+        if not self.alive:
+            return
+        self.alive = False
+        self.writer.close()
+        if not self.reader_task.done() and self.reader_task is not asyncio.current_task():
+            self.reader_task.cancel()
+
+
+class ConnectionPool:
+    """Pool de conexiones persistentes por nodo (debe usarse desde el event loop de red)"""
+
+    def __init__(self, connections_per_peer=POOL_CONNECTIONS_PER_PEER, timeout=NETWORK_TIMEOUT):
+        self.connections_per_peer = connections_per_peer
+        self.timeout = timeout
+        self.connections = {}  # nodo -> [PeerConnection]
+        self.opening = {}  # nodo -> conexiones en proceso de apertura
+
+    async def request(self, node, address, message, timeout=None):
+        """Envía una petición a un nodo reutilizando una conexión del pool"""
+        if timeout is None:
+            timeout = self.timeout
+
+        connection = await self._get_connection(node, address)
+        try:
+            return await connection.request(message, timeout)
+        except asyncio.TimeoutError:
+            raise
+        except (OSError, ConnectionError):
+            self._discard(node, connection)
+            raise
+
+    async def _get_connection(self, node, address):
+        """Devuelve la conexión menos cargada o abre una nueva si hace falta"""
+        connections = [c for c in self.connections.get(node, []) if c.alive]
+        self.connections[node] = connections
+        opening = self.opening.get(node, 0)
+
+        if connections:
+            connection = min(connections, key=lambda c: c.in_flight())
+            if connection.in_flight() == 0 or len(connections) + opening >= self.connections_per_peer:
+                return connection
+
+        self.opening[node] = opening + 1
+        try:
+            logger.debug(f"Abriendo conexión persistente con {node} ({address[0]}:{address[1]})")
+            connection = await PeerConnection.open(node, address, self.timeout)
+            self.connections.setdefault(node, []).append(connection)
+            return connection
+        finally:
+            self.opening[node] -= 1
+
+    def codec(self, node):
+        """Códec acordado con un nodo en las conexiones del pool (None si no hay conexión o no comprime)"""
+        for connection in self.connections.get(node, []):
+            if connection.alive and connection.codec:
+                return connection.codec
+        return None
+
+    def _discard(self, node, connection):
+        """Elimina una conexión rota del pool"""
+        connection.close()
+        connections = self.connections.get(node, [])
+        if connection in connections:
+            connections.remove(connection)
+
+    def close_node(self, node):
+        """Cierra todas las conexiones con un nodo"""
+        for connection in self.connections.pop(node, []):
+            connection.close()
+
+    def close_all(self):
+        """Cierra todas las conexiones del pool"""
+        for connections in self.connections.values():
+            for connection in connections:
+                connection.close()
+        self.connections.clear()
@@ -0,0 +1,132 @@
+import hashlib
+import mmap
+import os
+import struct
+import zlib
+
+# Módulo de adler32; la suma débil se puede desplazar byte a byte
+ADLER_MOD = 65521
+
+# Registros del formato de delta
+RECORD_COPY = b'C'  # Seguido de '!I' con el índice de bloque del archivo base
+RECORD_DATA = b'D'  # Seguido de '!I' con la longitud y los bytes literales
+
+# Tamaño máximo de un registro literal
+MAX_LITERAL_SIZE = 1024 * 1024
+
+def strong_hash(data):
+    """Hash fuerte de un bloque"""
+    return hashlib.blake2b(data, digest_size=16).hexdigest()
+
+def compute_signatures(path, block_size):
+    """Calcula las firmas (suma débil adler32 y hash fuerte) de cada bloque completo de un archivo"""
+    signatures = []
+    with open(path, 'rb') as f:
+        while True:
+            block = f.read(block_size)
+            if len(block) < block_size:
+                break
+            signatures.append([zlib.adler32(block), strong_hash(block)])
+    return signatures
+
+def _roll(weak, byte_out, byte_in, block_size):
+    """Desplaza una suma adler32 un byte hacia adelante"""
+    a = weak & 0xffff
+    b = weak >> 16
+    a = (a - byte_out + byte_in) % ADLER_MOD
+    b = (b - block_size * byte_out + a - 1) % ADLER_MOD
+    return (b << 16) | a
+
+def write_delta(path, signatures, block_size, out, max_literal=None):
+    """Escribe en `out` el delta de `path` respecto a un archivo con las firmas dadas; devuelve el sha256 del archivo,
+    o None si los bytes literales superan `max_literal` (conviene enviar el archivo completo)"""
+    weak_index = {}
+    for index, (weak, strong) in enumerate(signatures):
+        weak_index.setdefault(weak, []).append((index, strong))
+
+    def write_literal(data):
+        for start in range(0, len(data), MAX_LITERAL_SIZE):
+            piece = data[start:start + MAX_LITERAL_SIZE]
+            out.write(RECORD_DATA + struct.pack('!I', len(piece)))
+            out.write(piece)
+
+    with open(path, 'rb') as f:
+        size = os.fstat(f.fileno()).st_size
+        if size == 0:
+            return hashlib.sha256().hexdigest()
+
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            position = 0
+            literal_start = 0
+            literal_size = 0  # Bytes literales ya escritos
+            weak = None
+
+            while position + block_size <= size:
+                if weak is None:
+                    weak = zlib.adler32(data[position:position + block_size])
+
+                candidates = weak_index.get(weak)
+                if candidates:
+                    strong = strong_hash(data[position:position + block_size])
+                    match = next((index for index, s in candidates if s == strong), None)
+                    if match is not None:
+                        if literal_start < position:
+                            literal_size += position - literal_start
+                            write_literal(data[literal_start:position])
+                        out.write(RECORD_COPY + struct.pack('!I', match))
+                        position += block_size
+                        literal_start = position
+                        weak = None
+                        continue
+
+                # Sin coincidencia: avanzar la ventana un byte
+                if position + block_size < size:
+                    weak = _roll(weak, data[position], data[position + block_size], block_size)
+                position += 1
+
+                if max_literal is not None and literal_size + position - literal_start > max_literal:
+                    # El delta ya no compensa: no seguir recorriendo el archivo
+                    return None
+
+                if position - literal_start >= MAX_LITERAL_SIZE:
+                    literal_size += position - literal_start
+                    write_literal(data[literal_start:position])
+                    literal_start = position
+
+            if max_literal is not None and literal_size + size - literal_start > max_literal:
+                return None
+            if literal_start < size:
+                write_literal(data[literal_start:size])
+
+            return hashlib.sha256(data).hexdigest()
+
+def apply_delta(base_path, delta_file, block_size, out):
+    """Reconstruye un archivo a partir de su versión base y un delta; devuelve el sha256 del resultado"""
+    digest = hashlib.sha256()
+    with open(base_path, 'rb') as base:
+        while True:
+            record = delta_file.read(5)
+            if not record:
+                break
+            if len(record) < 5:
+                raise ValueError("Delta truncado")
+
+            kind = record[:1]
+            value = struct.unpack('!I', record[1:])[0]
+
+            if kind == RECORD_COPY:
+                base.seek(value * block_size)
+                block = base.read(block_size)
+                if len(block) < block_size:
+                    raise ValueError(f"Bloque {value} fuera del archivo base")
+            elif kind == RECORD_DATA:
+                block = delta_file.read(value)
+                if len(block) < value:
+                    raise ValueError("Delta truncado")
+            else:
+                raise ValueError(f"Registro de delta desconocido: {kind!r}")
+
+            out.write(block)
+            digest.update(block)
+
+    return digest.hexdigest()
@@ -0,0 +1,139 @@
+import json
+import queue
+import threading
+import logging
+
+logger = logging.getLogger('sistema.events')
+
+class EventBus:
+    """Difunde eventos a los clientes conectados, con una cola acotada por cliente"""
+
+    def __init__(self, queue_size):
+        self.queue_size = queue_size
+        self.lock = threading.Lock()
+        self.subscribers = set()
+        self.has_subscribers = threading.Event()
+
+    def subscribe(self):
+        """Registra un cliente y devuelve la cola de la que leerá sus eventos"""
+        subscriber = queue.Queue(maxsize=self.queue_size)
+        with self.lock:
+            self.subscribers.add(subscriber)
+            self.has_subscribers.set()
+        return subscriber
+
+    def unsubscribe(self, subscriber):
+        """Da de baja a un cliente"""
+        with self.lock:
+            self.subscribers.discard(subscriber)
+            if not self.subscribers:
+                self.has_subscribers.clear()
+
+    def publish(self, event_type, data):
+        """Encola un evento para todos los clientes sin bloquear a quien lo publica"""
+        with self.lock:
+            subscribers = list(self.subscribers)
+
+        for subscriber in subscribers:
+            try:
+                subscriber.put_nowait((event_type, data))
+            except queue.Full:
+                # Cliente demasiado lento: descartar lo acumulado y pedirle que recargue todo
+                self._drain(subscriber)
+                try:
+                    subscriber.put_nowait(("resync", {}))
+                except queue.Full:
+                    pass
+
+    def _drain(self, subscriber):
+        """Vacía la cola de un cliente"""
+        try:
+            while True:
+                subscriber.get_nowait()
+        except queue.Empty:
+            pass
+
+def format_sse(event_type, data):
+    """Serializa un evento en el formato de Server-Sent Events"""
+    return f"event: {event_type}\ndata: {json.dumps(data)}\n\n"
+
+class RemoteFilesPoller:
+    """Consulta los listados remotos una sola vez para todos los clientes, solo mientras haya alguno conectado"""
+
+    def __init__(self, node, bus, interval):
+        self.node = node
+        self.bus = bus
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.listings = {}  # nodo -> {nombre: archivo} del último listado recibido
+        self.wake_event = threading.Event()
+        self.running = True
+
+        self.thread = threading.Thread(target=self._poll_loop)
+        self.thread.daemon = True
+
+    def start(self):
+        """Inicia el thread de consulta"""
+        self.thread.start()
+
+    def stop(self):
+        """Detiene el thread de consulta"""
+        self.running = False
+        self.bus.has_subscribers.set()
+        self.wake_event.set()
+
+    def wake(self):
+        """Adelanta la próxima consulta (por ejemplo, cuando un nodo vuelve a estar activo)"""
+        self.wake_event.set()
+
+    def snapshot(self):
+        """Último listado conocido de cada nodo remoto"""
+        with self.lock:
+            return {node: list(files.values()) for node, files in self.listings.items()}
+
+    def _poll_loop(self):
+        """Consulta los nodos remotos periódicamente mientras haya clientes"""
+        while self.running:
+            if not self.bus.has_subscribers.is_set():
+                # Sin clientes los listados quedan obsoletos: descartarlos y esperar al próximo
+                with self.lock:
+                    self.listings = {}
+                self.bus.has_subscribers.wait()
+                continue
+
+            try:
+                self._poll()
+            except Exception as e:
+                logger.error(f"Error al consultar listados remotos: {e}")
+
+            self.wake_event.wait(self.interval)
+            self.wake_event.clear()
+
+    def _poll(self):
+        """Consulta cada nodo remoto activo y publica lo que cambió desde la consulta anterior"""
+        for node, alive in self.node.get_node_status().items():
+            if node == self.node.node_name:
+                continue
+
+            if not alive:
+                with self.lock:
+                    self.listings.pop(node, None)
+                continue
+
+            files = self.node.refresh_remote_files(node)
+            if files is None:
+                continue
+
+            current = {file['name']: file for file in files}
+            with self.lock:
+                previous = self.listings.get(node)
+                self.listings[node] = current
+
+            if previous is None:
+                self.bus.publish("files", {"node": node, "files": files})
+                continue
+
+            upserts = [file for name, file in current.items() if previous.get(name) != file]
+            removes = [name for name in previous if name not in current]
+            if upserts or removes:
+                self.bus.publish("file_changes", {"node": node, "upserts": upserts, "removes": removes})
@@ -0,0 +1,283 @@
+import os
+import bisect
+import uuid
+import threading
+import time
+import logging
+from collections import deque
+
+try:
+    from watchdog.observers import Observer
+    from watchdog.events import FileSystemEventHandler
+except ImportError:  # El watcher es opcional: sin él basta con las actualizaciones explícitas y la reconciliación
+    Observer = None
+    FileSystemEventHandler = object
+
+logger = logging.getLogger('sistema.index')
+
+class FileIndex:
+    """Índice en memoria del directorio compartido, mantenido de forma incremental"""
+
+    def __init__(self, root, ignore, reconcile_interval, journal_size):
+        self.root = root
+        self.ignore = ignore  # ignore(nombre_relativo, ruta_completa, es_directorio) -> bool
+        self.reconcile_interval = reconcile_interval
+        self.lock = threading.Lock()
+        self.entries = {}  # nombre relativo -> información del archivo o directorio
+        self.names = []  # Nombres ordenados para paginar y filtrar por prefijo
+        self.changed_during_scan = None  # Nombres actualizados mientras corre una reconciliación
+        self.observer = None
+        self.running = True
+
+        # Cambios aún no avisados (nombre -> entrada, o None si se eliminó) y funciones a avisar
+        self.pending_changes = {}
+        self.listeners = []
+        self.notify_lock = threading.Lock()  # Mantiene el orden de los avisos entre threads
+
+        # Versión del listado: crece con cada cambio; la época distingue cada arranque del índice
+        self.epoch = uuid.uuid4().hex
+        self.version = 0
+        self.journal = deque(maxlen=journal_size)  # (versión, nombre) de los cambios recientes
+
+        self.scan()
+
+        self.reconcile_thread = threading.Thread(target=self._reconcile_loop)
+        self.reconcile_thread.daemon = True
+        self.reconcile_thread.start()
+
+    def start_watcher(self):
+        """Inicia el watcher del sistema de archivos si watchdog está disponible"""
+        if Observer is None:
+            logger.info("watchdog no está instalado; el índice se reconcilia periódicamente")
+            return
+
+        self.observer = Observer()
+        self.observer.schedule(_IndexEventHandler(self), self.root, recursive=True)
+        self.observer.daemon = True
+        self.observer.start()
+
+    def stop(self):
+        """Detiene el watcher y la reconciliación periódica"""
+        self.running = False
+        if self.observer:
+            self.observer.stop()
+
+    def _relative(self, path):
+        """Nombre relativo al directorio compartido de una ruta completa"""
+        return os.path.relpath(path, self.root)
+
+    def _make_entry(self, name, path, stat, is_dir):
+        """Información de un archivo o directorio tal como la devuelve list_files"""
+        return {
+            'name': name,
+            'path': path,
+            'size': 0 if is_dir else stat.st_size,
+            'modified': stat.st_mtime,
+            'is_dir': is_dir
+        }
+
+    def _walk(self, top):
+        """Recorre un directorio y devuelve las entradas que contiene"""
+        entries = {}
+        for root, dirs, filenames in os.walk(top):
+            dirs[:] = [d for d in dirs
+                       if not self.ignore(self._relative(os.path.join(root, d)), os.path.join(root, d), True)]
+
+            for name, is_dir in [(f, False) for f in filenames] + [(d, True) for d in dirs]:
+                path = os.path.join(root, name)
+                relative = self._relative(path)
+                if not is_dir and self.ignore(relative, path, False):
+                    continue
+                try:
+                    entries[relative] = self._make_entry(relative, path, os.stat(path), is_dir)
+                except FileNotFoundError:
+                    continue
+        return entries
+
+    def scan(self):
+        """Reconstruye el índice recorriendo todo el directorio (reconciliación)"""
+        with self.lock:
+            self.changed_during_scan = set()
+
+        entries = self._walk(self.root)
+
+        with self.lock:
+            changed = self.changed_during_scan
+            self.changed_during_scan = None
+            for name, entry in entries.items():
+                if self.entries.get(name) != entry:
+                    self._record_change(name, entry)
+            for name in self.entries.keys() - entries.keys():
+                self._record_change(name, None)
+            self.entries = entries
+            self.names = sorted(entries)
+        self._notify()
+
+        # Lo que cambió durante el recorrido puede haber quedado desactualizado en el resultado
+        for name in changed:
+            self.refresh(name)
+
+    def _reconcile_loop(self):
+        """Reconcilia el índice con el disco periódicamente"""
+        while self.running:
+            time.sleep(self.reconcile_interval)
+            if not self.running:
+                return
+            try:
+                self.scan()
+            except Exception as e:
+                logger.error(f"Error al reconciliar el índice de archivos: {e}")
+
+    def _set(self, name, entry):
+        """Agrega o reemplaza una entrada; debe llamarse con el lock tomado"""
+        previous = self.entries.get(name)
+        if previous is None:
+            bisect.insort(self.names, name)
+        if previous != entry:
+            self._record_change(name, entry)
+        self.entries[name] = entry
+
+    def _remove_tree(self, name):
+        """Elimina una entrada y todo lo que contiene; debe llamarse con el lock tomado"""
+        if self.entries.pop(name, None) is not None:
+            del self.names[bisect.bisect_left(self.names, name)]
+            self._record_change(name, None)
+
+        # Los nombres con el mismo prefijo son contiguos en la lista ordenada
+        prefix = name + os.sep
+        start = end = bisect.bisect_left(self.names, prefix)
+        while end < len(self.names) and self.names[end].startswith(prefix):
+            self.entries.pop(self.names[end], None)
+            self._record_change(self.names[end], None)
+            end += 1
+        del self.names[start:end]
+
+    def _record_change(self, name, entry):
+        """Registra un cambio para los listeners y el historial de versiones; debe llamarse con el lock tomado"""
+        self.pending_changes[name] = entry
+        self.version += 1
+        self.journal.append((self.version, name))
+
+    def refresh(self, name):
+        """Actualiza la entrada de un archivo o directorio a partir de su estado en disco"""
+        name = os.path.normpath(name)
+        if name == '.' or name == '..' or name.startswith('..' + os.sep):
+            return
+
+        path = os.path.join(self.root, name)
+        is_dir = os.path.isdir(path)
+        try:
+            stat = os.stat(path)
+        except FileNotFoundError:
+            stat = None
+
+        if stat is not None and not self.ignore(name, path, is_dir):
+            # Un directorio nuevo (creado o movido) se recorre completo; uno conocido solo se actualiza
+            with self.lock:
+                known = name in self.entries
+            subtree = self._walk(path) if is_dir and not known else {}
+            with self.lock:
+                if self.changed_during_scan is not None:
+                    self.changed_during_scan.add(name)
+                self._set(name, self._make_entry(name, path, stat, is_dir))
+                for child, entry in subtree.items():
+                    self._set(child, entry)
+                self._add_parents(name)
+            self._notify()
+            return
+
+        with self.lock:
+            if self.changed_during_scan is not None:
+                self.changed_during_scan.add(name)
+            self._remove_tree(name)
+        self._notify()
+
+    def _add_parents(self, name):
+        """Asegura que los directorios que contienen una entrada estén indexados; debe llamarse con el lock tomado"""
+        parent = os.path.dirname(name)
+        while parent and parent not in self.entries:
+            path = os.path.join(self.root, parent)
+            try:
+                self._set(parent, self._make_entry(parent, path, os.stat(path), True))
+            except FileNotFoundError:
+                return
+            parent = os.path.dirname(parent)
+
+    def remove(self, name):
+        """Elimina del índice un archivo o directorio borrado"""
+        with self.lock:
+            if self.changed_during_scan is not None:
+                self.changed_during_scan.add(os.path.normpath(name))
+            self._remove_tree(os.path.normpath(name))
+        self._notify()
+
+    def add_listener(self, callback):
+        """Registra una función que recibe los cambios del índice: callback(entradas_nuevas_o_modificadas, nombres_eliminados)"""
+        self.listeners.append(callback)
+
+    def _notify(self):
+        """Avisa a los listeners de los cambios acumulados"""
+        with self.notify_lock:
+            with self.lock:
+                changes = self.pending_changes
+                self.pending_changes = {}
+            if not changes or not self.listeners:
+                return
+
+            upserts = [dict(entry) for entry in changes.values() if entry is not None]
+            removes = [name for name, entry in changes.items() if entry is None]
+            for callback in self.listeners:
+                try:
+                    callback(upserts, removes)
+                except Exception as e:
+                    logger.error(f"Error al notificar cambios del índice: {e}")
+
+    def list(self, prefix='', offset=0, limit=None):
+        """Devuelve copias de las entradas cuyo nombre empieza por `prefix`, paginadas"""
+        with self.lock:
+            position = bisect.bisect_left(self.names, prefix) + offset
+            result = []
+            while position < len(self.names) and (limit is None or len(result) < limit):
+                name = self.names[position]
+                if not name.startswith(prefix):
+                    break
+                result.append(dict(self.entries[name]))
+                position += 1
+            return result
+
+    def get_version(self):
+        """Época y versión actuales del listado"""
+        with self.lock:
+            return self.epoch, self.version
+
+    def changes_since(self, version):
+        """Cambios desde una versión como (versión actual, entradas nuevas o modificadas, nombres eliminados); None si el historial ya no la cubre"""
+        with self.lock:
+            oldest = self.journal[0][0] - 1 if self.journal else self.version
+            if version < oldest or version > self.version:
+                return None
+
+            names = set()
+            for change_version, name in reversed(self.journal):
+                if change_version <= version:
+                    break
+                names.add(name)
+
+            upserts = [dict(self.entries[name]) for name in sorted(names) if name in self.entries]
+            removes = sorted(name for name in names if name not in self.entries)
+            return self.version, upserts, removes
+
+    def __len__(self):
+        with self.lock:
+            return len(self.names)
+
+class _IndexEventHandler(FileSystemEventHandler):
+    """Traslada los eventos del sistema de archivos al índice"""
+
+    def __init__(self, index):
+        self.index = index
+
+    def on_any_event(self, event):
+        for path in (event.src_path, getattr(event, 'dest_path', None)):
+            if path and path != self.index.root:
+                self.index.refresh(self.index._relative(path))
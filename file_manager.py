@@ -1,8 +1,33 @@
 import os
+import hashlib
 import shutil
 import threading
 import base64
-from config import SHARED_DIR
+import tempfile
+import delta
+from chunk_store import ChunkStore
+from file_index import FileIndex
+from config import SHARED_DIR, STREAM_CHUNK_SIZE, CHUNK_STORE_ENABLED, CHUNK_STORE_DIR, FILE_INDEX_RECONCILE_INTERVAL, FILE_INDEX_JOURNAL_SIZE
+
+# Prefijo de los archivos temporales usados durante las transferencias
+TEMP_FILE_PREFIX = '.sistema_tmp_'
+
+# Archivos internos del sistema que no se listan
+INTERNAL_FILES = {'operations.log', 'operations.log.tmp', 'offline_queue.json', 'sync_status.json',
+                  'sync_cursors.json', 'sync_cursors.json.tmp', 'sync_retry.json', 'sync_retry.json.tmp'}
+
+def _without_paths(files):
+    """Quita las rutas locales de un listado destinado a otro nodo"""
+    for file_info in files:
+        file_info.pop('path', None)
+    return files
+
+def clamp_range(size, offset=0, length=None):
+    """Ajusta un rango de bytes pedido al tamaño del archivo; devuelve (offset, longitud)"""
+    offset = min(max(0, offset or 0), size)
+    if length is None:
+        return offset, size - offset
+    return offset, min(size - offset, max(0, length))
 
 class FileManager:
     def __init__(self, operation_log):
@@ -10,63 +35,70 @@ class FileManager:
         self.lock = threading.Lock()
         self.operation_log = operation_log
         self.offline_manager = None  # Se establecerá después de la inicialización
+        self.digests = {}  # nombre -> (tamaño, mtime_ns, sha256) para no releer archivos sin cambios
         
         # Asegurar que el directorio compartido existe
         os.makedirs(self.shared_dir, exist_ok=True)
+        
+        # Almacén opcional de chunks direccionados por contenido
+        self.chunk_store = ChunkStore(CHUNK_STORE_DIR) if CHUNK_STORE_ENABLED else None
+        
+        # Índice en memoria del directorio compartido para no recorrer el disco en cada listado
+        self.index = FileIndex(self.shared_dir, self._is_internal, FILE_INDEX_RECONCILE_INTERVAL, FILE_INDEX_JOURNAL_SIZE)
+        self.index.start_watcher()
     
     def set_offline_manager(self, offline_manager):
         """Establece el manager offline"""
         self.offline_manager = offline_manager
     
-    def list_files(self):
-        """Lista todos los archivos en el directorio compartido"""
-        files = []
-        with self.lock:
-            for root, dirs, filenames in os.walk(self.shared_dir):
-                relative_root = os.path.relpath(root, self.shared_dir)
-                if relative_root == '.':
-                    relative_root = ''
-                
-                for filename in filenames:
-                    if filename in ['operations.log', 'offline_queue.json', 'sync_status.json']:
-                        continue
-                    
-                    full_path = os.path.join(root, filename)
-                    relative_path = os.path.join(relative_root, filename)
-                    
-                    # Obtener información del archivo
-                    stat = os.stat(full_path)
-                    file_info = {
-                        'name': relative_path,
-                        'path': full_path,
-                        'size': stat.st_size,
-                        'modified': stat.st_mtime,
-                        'is_dir': False
-                    }
-                    
-                    # Agregar estado de sincronización si está disponible
-                    if self.offline_manager:
-                        sync_status = self.offline_manager.get_sync_status(relative_path)
-                        file_info['sync_status'] = sync_status
-                    
-                    files.append(file_info)
-                
-                for dirname in dirs:
-                    full_path = os.path.join(root, dirname)
-                    relative_path = os.path.join(relative_root, dirname)
-                    
-                    # Obtener información del directorio
-                    stat = os.stat(full_path)
-                    files.append({
-                        'name': relative_path,
-                        'path': full_path,
-                        'size': 0,
-                        'modified': stat.st_mtime,
-                        'is_dir': True
+    def _is_internal(self, name, path, is_dir):
+        """Indica si una ruta del directorio compartido pertenece al sistema y no debe listarse"""
+        if path == CHUNK_STORE_DIR or path.startswith(CHUNK_STORE_DIR + os.sep):
+            return True
+        if is_dir:
+            return False
+        basename = os.path.basename(name)
+        return basename in INTERNAL_FILES or basename.startswith(TEMP_FILE_PREFIX)
+    
+    def list_files(self, prefix='', offset=0, limit=None):
+        """Lista los archivos del directorio compartido cuyo nombre empieza por `prefix`, paginados"""
+        return self._add_sync_status(self.index.list(prefix, offset, limit))
+    
+    def _add_sync_status(self, files):
+        """Agrega a cada archivo su estado de sincronización (una sola consulta para todo el listado)"""
+        if self.offline_manager:
+            sync_status = self.offline_manager.get_sync_status()
+            for file_info in files:
+                if not file_info['is_dir']:
+                    file_info['sync_status'] = sync_status.get(file_info['name'], {
+                        "synced": True,
+                        "last_modified": 0,
+                        "pending_operations": False
                     })
-            
+        
         return files
     
+    def get_listing(self, prefix='', offset=0, limit=None, if_epoch=None, if_version=None):
+        """Listado para otros nodos sin rutas locales; con una versión conocida responde "not_modified" o solo los cambios"""
+        epoch, version = self.index.get_version()
+        listing = {"status": "ok", "epoch": epoch, "version": version}
+        
+        conditional = not prefix and not offset and limit is None
+        if conditional and if_epoch == epoch and if_version is not None:
+            if if_version == version:
+                listing["status"] = "not_modified"
+                return listing
+            
+            changes = self.index.changes_since(if_version)
+            if changes is not None:
+                listing["version"], upserts, listing["removes"] = changes
+                listing["delta"] = True
+                listing["upserts"] = _without_paths(self._add_sync_status(upserts))
+                return listing
+        
+        listing["files"] = _without_paths(self.list_files(prefix, offset, limit))
+        return listing
+    
     def get_file_data(self, filename):
         """Obtiene los datos de un archivo"""
         file_path = os.path.join(self.shared_dir, filename)
@@ -82,8 +114,218 @@ class FileManager:
         
         return base64.b64encode(file_data).decode('utf-8')
     
+    def is_valid_name(self, filename):
+        """Indica si un nombre relativo queda dentro del directorio compartido y no es un archivo interno"""
+        name = os.path.normpath(filename or '')
+        if os.path.isabs(name) or name in ('.', '..') or name.startswith('..' + os.sep):
+            return False
+        return not self._is_internal(name, os.path.join(self.shared_dir, name), False)
+    
+    def get_file_path(self, filename):
+        """Obtiene la ruta completa de un archivo existente"""
+        if not self.is_valid_name(filename):
+            return None
+        
+        file_path = os.path.join(self.shared_dir, filename)
+        
+        if not os.path.isfile(file_path):
+            return None
+        
+        return file_path
+    
+    def get_file_info(self, filename):
+        """Tamaño, fecha de modificación y sha256 de un archivo, o None si no existe"""
+        file_path = self.get_file_path(filename)
+        if not file_path:
+            return None
+        
+        try:
+            stat = os.stat(file_path)
+            cached = self.digests.get(filename)
+            if cached and cached[0] == stat.st_size and cached[1] == stat.st_mtime_ns:
+                sha256 = cached[2]
+            else:
+                digest = hashlib.sha256()
+                with open(file_path, 'rb') as f:
+                    for block in iter(lambda: f.read(1024 * 1024), b''):
+                        digest.update(block)
+                sha256 = digest.hexdigest()
+                self.digests[filename] = (stat.st_size, stat.st_mtime_ns, sha256)
+        except FileNotFoundError:
+            return None
+        
+        return {'size': stat.st_size, 'modified': stat.st_mtime, 'sha256': sha256}
+    
+    def read_range(self, filename, offset=0, length=None):
+        """Abre un rango de un archivo local; devuelve (cabecera con tamaño, sha256 y rango, iterador de bloques) o None"""
+        info = self.get_file_info(filename)
+        file_path = self.get_file_path(filename)
+        if info is None or file_path is None:
+            return None
+        
+        offset, length = clamp_range(info['size'], offset, length)
+        return dict(info, offset=offset, length=length), self._iter_range(file_path, offset, length)
+    
+    def _iter_range(self, file_path, offset, length):
+        """Lee en bloques un rango de un archivo"""
+        with open(file_path, 'rb') as f:
+            f.seek(offset)
+            remaining = length
+            while remaining > 0:
+                chunk = f.read(min(remaining, STREAM_CHUNK_SIZE))
+                if not chunk:
+                    return
+                remaining -= len(chunk)
+                yield chunk
+    
+    def create_temp_file(self, filename):
+        """Crea un archivo temporal junto al destino para recibir datos de forma incremental"""
+        if not self.is_valid_name(filename):
+            raise ValueError(f"Nombre de archivo no válido: {filename}")
+        
+        file_path = os.path.join(self.shared_dir, filename)
+        directory = os.path.dirname(file_path)
+        os.makedirs(directory, exist_ok=True)
+        
+        fd, temp_path = tempfile.mkstemp(prefix=TEMP_FILE_PREFIX, dir=directory)
+        return os.fdopen(fd, 'wb'), temp_path
+    
+    def save_stream(self, filename, stream, expected_size=None):
+        """Guarda un archivo leyendo un flujo por bloques en un temporal que se publica de forma atómica; devuelve su tamaño y sha256"""
+        temp_file, temp_path = self.create_temp_file(filename)
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with temp_file:
+                for chunk in iter(lambda: stream.read(STREAM_CHUNK_SIZE), b''):
+                    temp_file.write(chunk)
+                    digest.update(chunk)
+                    size += len(chunk)
+                temp_file.flush()
+                os.fsync(temp_file.fileno())
+            
+            if expected_size is not None and size != expected_size:
+                raise ConnectionError(f"Subida de {filename} incompleta ({size} de {expected_size} bytes)")
+        except Exception:
+            self.discard_temp_file(temp_path)
+            raise
+        
+        self.commit_temp_file(temp_path, filename)
+        
+        # El contenido ya se leyó una vez: guardar su sha256 para no releerlo
+        stat = os.stat(os.path.join(self.shared_dir, filename))
+        self.digests[filename] = (stat.st_size, stat.st_mtime_ns, digest.hexdigest())
+        return {'size': size, 'sha256': digest.hexdigest()}
+    
+    def commit_temp_file(self, temp_path, filename, index_chunks=True):
+        """Reemplaza de forma atómica un archivo con el contenido de un temporal"""
+        file_path = os.path.join(self.shared_dir, filename)
+        
+        with self.lock:
+            os.replace(temp_path, file_path)
+        self.index.refresh(filename)
+        
+        if index_chunks:
+            self._store_chunks(filename, file_path)
+        
+        return True
+    
+    def _store_chunks(self, filename, file_path):
+        """Incorpora un archivo al almacén de chunks si está habilitado"""
+        if self.chunk_store:
+            self.chunk_store.store_file(filename, file_path)
+    
+    def get_manifest(self, filename):
+        """Obtiene la lista de chunks de un archivo (None si el almacén está deshabilitado)"""
+        file_path = self.get_file_path(filename)
+        if not self.chunk_store or not file_path:
+            return None
+        
+        return self.chunk_store.get_manifest(filename, file_path)
+    
+    def missing_chunks(self, chunks):
+        """Devuelve los chunks que no están en el almacén local"""
+        return self.chunk_store.missing_chunks(chunks)
+    
+    def get_chunk_paths(self, chunks):
+        """Rutas de los archivos que contienen los chunks dados"""
+        return [self.chunk_store.chunk_path(chunk) for chunk, _ in chunks]
+    
+    def save_chunked_file(self, filename, spool_path, received_chunks, chunks):
+        """Guarda los chunks recibidos y ensambla el archivo completo a partir del almacén"""
+        with self.chunk_store.lock:
+            with open(spool_path, 'rb') as spool:
+                self.chunk_store.ingest_chunks(spool, received_chunks)
+            
+            temp_file, temp_path = self.create_temp_file(filename)
+            try:
+                with temp_file:
+                    self.chunk_store.assemble(chunks, temp_file)
+                self.commit_temp_file(temp_path, filename, index_chunks=False)
+            except Exception:
+                self.discard_temp_file(temp_path)
+                raise
+            
+            self.chunk_store.record_file(filename, os.path.join(self.shared_dir, filename), chunks)
+        
+        return True
+    
+    def discard_temp_file(self, temp_path):
+        """Elimina un archivo temporal de una transferencia fallida"""
+        try:
+            os.remove(temp_path)
+        except FileNotFoundError:
+            pass
+    
+    def get_signatures(self, filename, block_size):
+        """Calcula las firmas de bloques de un archivo para una transferencia por delta"""
+        file_path = self.get_file_path(filename)
+        if not file_path:
+            return None
+        
+        return delta.compute_signatures(file_path, block_size)
+    
+    def create_delta(self, filename, signatures, block_size, max_literal=None):
+        """Escribe en un temporal el delta de un archivo respecto a las firmas de otra copia (None si supera max_literal bytes literales)"""
+        file_path = self.get_file_path(filename)
+        
+        fd, delta_path = tempfile.mkstemp(prefix=TEMP_FILE_PREFIX)
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                sha256 = delta.write_delta(file_path, signatures, block_size, f, max_literal)
+        except Exception:
+            os.remove(delta_path)
+            raise
+        
+        if sha256 is None:
+            os.remove(delta_path)
+            return None
+        return delta_path, sha256
+    
+    def apply_delta(self, filename, delta_path, block_size, expected_sha256):
+        """Reconstruye un archivo a partir de su copia local y un delta, y lo reemplaza de forma atómica"""
+        base_path = self.get_file_path(filename)
+        if not base_path:
+            raise FileNotFoundError(f"No existe la copia base de {filename}")
+        
+        temp_file, temp_path = self.create_temp_file(filename)
+        try:
+            with temp_file, open(delta_path, 'rb') as delta_file:
+                sha256 = delta.apply_delta(base_path, delta_file, block_size, temp_file)
+            
+            if sha256 != expected_sha256:
+                raise ValueError(f"El archivo reconstruido {filename} no coincide con el original")
+            
+            return self.commit_temp_file(temp_path, filename)
+        except Exception:
+            self.discard_temp_file(temp_path)
+            raise
+    
     def save_file(self, filename, file_data, is_base64=True, is_offline=False):
         """Guarda un archivo en el sistema"""
+        if not self.is_valid_name(filename):
+            return False
+        
         file_path = os.path.join(self.shared_dir, filename)
         
         # Crear los directorios necesarios
@@ -96,14 +338,20 @@ class FileManager:
             with open(file_path, 'wb') as f:
                 f.write(file_data)
             
+            self._store_chunks(filename, file_path)
+            self.index.refresh(filename)
+            
             # Si es una operación offline, agregar a la cola
             if is_offline and self.offline_manager:
-                self.offline_manager.add_to_offline_queue("save", filename, base64.b64encode(file_data).decode('utf-8'))
+                self.offline_manager.add_to_offline_queue("save", filename, path=file_path)
         
         return True
     
     def delete_file(self, filename, node_name, log_operation=True, is_offline=False):
         """Elimina un archivo o directorio del sistema"""
+        if not self.is_valid_name(filename):
+            return False
+        
         file_path = os.path.join(self.shared_dir, filename)
         
         if not os.path.exists(file_path):
@@ -111,16 +359,25 @@ class FileManager:
         
         with self.lock:
             if os.path.isdir(file_path):
+                removed = [os.path.relpath(os.path.join(root, name), self.shared_dir)
+                           for root, _, names in os.walk(file_path) for name in names]
                 shutil.rmtree(file_path)
             else:
+                removed = [filename]
                 os.remove(file_path)
+            self.index.remove(filename)
+            
+            if self.chunk_store:
+                for name in removed:
+                    self.chunk_store.remove_file(name)
             
+            operation = None
             if log_operation:
-                self.operation_log.add_operation("delete", node_name, filename=filename)
+                operation = self.operation_log.add_operation("delete", node_name, filename=filename)
             
             # Si es una operación offline, agregar a la cola
             if is_offline and self.offline_manager:
-                self.offline_manager.add_to_offline_queue("delete", filename)
+                self.offline_manager.add_to_offline_queue("delete", filename, logged=operation)
         
         return True
     
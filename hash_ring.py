@@ -0,0 +1,43 @@
+import bisect
+import hashlib
+
+def ring_hash(value):
+    """Posición en el anillo: los primeros 64 bits del sha256"""
+    return int.from_bytes(hashlib.sha256(value.encode('utf-8')).digest()[:8], 'big')
+
+class HashRing:
+    """Anillo de hashing consistente con nodos virtuales"""
+
+    def __init__(self, vnodes):
+        self.vnodes = vnodes
+        self.nodes = set()
+        self.points = []  # Posiciones ordenadas de los nodos virtuales
+        self.owners_at = []  # Nodo dueño de cada posición
+
+    def set_nodes(self, nodes):
+        """Reemplaza los nodos del anillo; devuelve True si cambiaron"""
+        nodes = set(nodes)
+        if nodes == self.nodes:
+            return False
+
+        points = sorted((ring_hash(f"{node}#{i}"), node) for node in nodes for i in range(self.vnodes))
+        self.nodes = nodes
+        self.points = [point for point, _ in points]
+        self.owners_at = [node for _, node in points]
+        return True
+
+    def owners(self, key, count):
+        """Los `count` nodos distintos que siguen a la clave en el anillo (el primero es el principal)"""
+        if not self.points:
+            return []
+
+        count = min(count, len(self.nodes))
+        position = bisect.bisect(self.points, ring_hash(key))
+        owners = []
+        for i in range(len(self.points)):
+            node = self.owners_at[(position + i) % len(self.points)]
+            if node not in owners:
+                owners.append(node)
+                if len(owners) == count:
+                    break
+        return owners
@@ -0,0 +1,58 @@
+import threading
+import time
+
+# Marca = milisegundos del reloj de pared (11 dígitos hex) + contador lógico (4 dígitos hex);
+# con ancho fijo, el orden de las cadenas coincide con el orden de las marcas
+WALL_DIGITS = 11
+LOGICAL_DIGITS = 4
+MAX_LOGICAL = 16 ** LOGICAL_DIGITS - 1
+
+def encode(wall, logical):
+    """Codifica una marca como cadena compacta y ordenable"""
+    return f"{wall:0{WALL_DIGITS}x}{logical:0{LOGICAL_DIGITS}x}"
+
+def decode(stamp):
+    """Separa una marca en milisegundos y contador lógico"""
+    return int(stamp[:WALL_DIGITS], 16), int(stamp[WALL_DIGITS:], 16)
+
+def from_timestamp(timestamp):
+    """Marca equivalente a un timestamp de pared, para ordenar operaciones sin marca"""
+    return encode(int(timestamp * 1000), 0)
+
+class HybridClock:
+    """Reloj lógico híbrido: marcas únicas y crecientes aunque el reloj de pared se repita o retroceda"""
+
+    def __init__(self):
+        self.wall = 0
+        self.logical = 0
+        self.lock = threading.Lock()
+
+    def now(self):
+        """Nueva marca para un evento local"""
+        with self.lock:
+            self._advance(int(time.time() * 1000), 0, -1)
+            return encode(self.wall, self.logical)
+
+    def update(self, stamp):
+        """Avanza el reloj para que las marcas siguientes sucedan a una marca recibida"""
+        wall, logical = decode(stamp)
+        with self.lock:
+            self._advance(int(time.time() * 1000), wall, logical)
+
+    def _advance(self, physical, wall, logical):
+        """Toma el mayor de los relojes y desempata con el contador; debe llamarse con el lock tomado"""
+        latest = max(physical, self.wall, wall)
+        if latest == self.wall and latest == wall:
+            self.logical = max(self.logical, logical) + 1
+        elif latest == self.wall:
+            self.logical += 1
+        elif latest == wall:
+            self.logical = logical + 1
+        else:
+            self.logical = 0
+        self.wall = latest
+
+        # El contador tiene ancho fijo: si se agota, se adelanta un milisegundo
+        if self.logical > MAX_LOGICAL:
+            self.wall += 1
+            self.logical = 0
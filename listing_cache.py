@@ -0,0 +1,105 @@
+import threading
+import time
+import logging
+
+logger = logging.getLogger('sistema.listings')
+
+class RemoteListingCache:
+    """Caché por nodo de los listados remotos con TTL, stale-while-revalidate y consultas condicionales"""
+
+    def __init__(self, fetch, ttl, stale_ttl):
+        self.fetch = fetch  # fetch(nodo, época, versión) -> respuesta de list_files o None
+        self.ttl = ttl
+        self.stale_ttl = stale_ttl
+        self.lock = threading.Lock()
+        self.entries = {}  # nodo -> {"files": {nombre: archivo}, "epoch", "version", "fetched_at"}
+        self.refreshing = set()  # Nodos con una revalidación en segundo plano en curso
+
+    def get(self, node):
+        """Listado de un nodo: de la caché si está vigente, o consultándolo si no"""
+        with self.lock:
+            entry = self.entries.get(node)
+            age = time.time() - entry["fetched_at"] if entry else None
+
+            if entry and age < self.ttl:
+                return self._files(entry)
+
+            if entry and age < self.stale_ttl:
+                # Servir el listado vencido y revalidarlo en segundo plano (una vez por nodo)
+                if node not in self.refreshing:
+                    self.refreshing.add(node)
+                    thread = threading.Thread(target=self._background_refresh, args=(node,))
+                    thread.daemon = True
+                    thread.start()
+                return self._files(entry)
+
+        return self.refresh(node)
+
+    def _background_refresh(self, node):
+        """Revalida el listado de un nodo en segundo plano"""
+        try:
+            self.refresh(node)
+        finally:
+            with self.lock:
+                self.refreshing.discard(node)
+
+    def refresh(self, node):
+        """Consulta el listado de un nodo enviando la versión en caché; devuelve None si no responde"""
+        with self.lock:
+            entry = self.entries.get(node)
+            epoch, version = (entry["epoch"], entry["version"]) if entry else (None, None)
+
+        response = self.fetch(node, epoch, version)
+        if not isinstance(response, dict) or response.get("status") not in ("ok", "not_modified"):
+            return None
+
+        with self.lock:
+            entry = self.entries.get(node)
+            current = entry is not None and entry["epoch"] == response.get("epoch")
+
+            if response["status"] == "not_modified" and current:
+                entry["fetched_at"] = time.time()
+                return self._files(entry)
+
+            if response.get("delta") and current:
+                # Otra consulta concurrente pudo haber aplicado ya estos cambios
+                if entry["version"] == version:
+                    for name in response.get("removes", []):
+                        entry["files"].pop(name, None)
+                    for file_info in response.get("upserts", []):
+                        entry["files"][file_info["name"]] = file_info
+                    entry["version"] = response["version"]
+                entry["fetched_at"] = time.time()
+                return self._files(entry)
+
+            if "files" in response:
+                return self._store(node, response)
+
+        # La respuesta no corresponde a la caché (por ejemplo, el nodo se reinició): pedir el listado completo
+        logger.debug(f"Listado de {node} desincronizado, solicitando listado completo")
+        self.invalidate(node)
+        response = self.fetch(node, None, None)
+        if not isinstance(response, dict) or "files" not in response:
+            return None
+        with self.lock:
+            return self._store(node, response)
+
+    def _store(self, node, response):
+        """Guarda un listado completo en la caché; debe llamarse con el lock tomado"""
+        entry = {
+            "files": {file_info["name"]: file_info for file_info in response["files"]},
+            "epoch": response.get("epoch"),
+            "version": response.get("version"),
+            "fetched_at": time.time()
+        }
+        self.entries[node] = entry
+        return self._files(entry)
+
+    def invalidate(self, node):
+        """Descarta el listado en caché de un nodo"""
+        with self.lock:
+            self.entries.pop(node, None)
+
+    def _files(self, entry):
+        """Archivos de una entrada de la caché, ordenados por nombre"""
+        return [dict(entry["files"][name]) for name in sorted(entry["files"])]
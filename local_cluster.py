@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""Lanza un clúster de prueba con varios nodos en esta máquina (127.0.0.1, puertos distintos)"""
+import argparse
+import os
+import signal
+import subprocess
+import sys
+import time
+
+APP_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "app.py")
+
+def main():
+    parser = argparse.ArgumentParser(description="Clúster local del sistema tolerante a fallas")
+    parser.add_argument("--nodes", type=int, default=5, help="Número de nodos a lanzar")
+    parser.add_argument("--web-port", type=int, default=8100, help="Puerto web del primer nodo")
+    parser.add_argument("--network-port", type=int, default=9100, help="Puerto de red del primer nodo")
+    parser.add_argument("--dir", default=os.path.join(os.path.expanduser("~"), "sistema_cluster_local"),
+                        help="Directorio con el estado de cada nodo")
+    parser.add_argument("--seeds", type=int, default=1, help="Cuántos de los primeros nodos hacen de semilla")
+    args = parser.parse_args()
+
+    seeds = ",".join(f"127.0.0.1:{args.network_port + i}" for i in range(min(args.seeds, args.nodes)))
+    processes = []
+
+    for i in range(args.nodes):
+        name = f"Nodo{i + 1}"
+        # Cada nodo tiene su propio directorio de trabajo (log, cola offline) y directorio compartido
+        node_dir = os.path.join(args.dir, name)
+        os.makedirs(node_dir, exist_ok=True)
+
+        env = dict(os.environ)
+        env.update({
+            "SISTEMA_NODE": name,
+            "SISTEMA_LOCAL_MODE": "1",
+            "SISTEMA_WEB_PORT": str(args.web_port + i),
+            "SISTEMA_NETWORK_PORT": str(args.network_port + i),
+            "SISTEMA_SEEDS": seeds,
+            "SISTEMA_SHARED_DIR": os.path.join(node_dir, "files"),
+        })
+        with open(os.path.join(node_dir, "salida.log"), "a") as output:
+            processes.append(subprocess.Popen([sys.executable, APP_PATH], cwd=node_dir, env=env,
+                                              stdout=output, stderr=subprocess.STDOUT))
+        print(f"{name}: http://127.0.0.1:{args.web_port + i} (red {args.network_port + i}, estado en {node_dir})")
+
+        # Dar tiempo a las semillas a escuchar antes de que los demás se unan
+        if i < args.seeds:
+            time.sleep(1)
+
+    print("Clúster iniciado. Ctrl+C para detenerlo.")
+    try:
+        while any(process.poll() is None for process in processes):
+            time.sleep(1)
+    except KeyboardInterrupt:
+        pass
+    finally:
+        # SIGINT permite a cada nodo anunciar su salida antes de terminar
+        for process in processes:
+            if process.poll() is None:
+                process.send_signal(signal.SIGINT)
+        for process in processes:
+            try:
+                process.wait(timeout=15)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,297 @@
+import math
+import random
+import threading
+import time
+from collections import deque
+
+# Estados de un miembro según SWIM
+ALIVE = "alive"
+SUSPECT = "suspect"
+DEAD = "dead"
+LEFT = "left"  # Salida voluntaria anunciada por el propio nodo
+
+# Valor máximo de phi (evita infinitos al serializar el estado)
+MAX_PHI = 300.0
+
+class PhiAccrualDetector:
+    """Nivel de sospecha phi-accrual a partir de los intervalos entre señales de vida de un nodo"""
+
+    def __init__(self, window_size, min_std, first_interval):
+        self.intervals = deque(maxlen=window_size)
+        self.min_std = min_std
+        self.first_interval = first_interval
+        self.last_heartbeat = None
+
+    def heartbeat(self, now):
+        """Registra una señal de vida"""
+        if self.last_heartbeat is None:
+            # Sin historial, suponer el intervalo esperado para que phi esté definido desde el inicio
+            self.intervals.append(self.first_interval)
+        elif now > self.last_heartbeat:
+            self.intervals.append(now - self.last_heartbeat)
+        self.last_heartbeat = now
+
+    def phi(self, now):
+        """Nivel de sospecha: -log10 de la probabilidad de que la señal aún llegue"""
+        if self.last_heartbeat is None:
+            return 0.0
+
+        mean = sum(self.intervals) / len(self.intervals)
+        variance = sum((i - mean) ** 2 for i in self.intervals) / len(self.intervals)
+        std = max(math.sqrt(variance), self.min_std)
+
+        # Aproximación logística de la distribución normal acumulada
+        elapsed = now - self.last_heartbeat
+        y = max((elapsed - mean) / std, -30.0)
+        e = math.exp(-y * (1.5976 + 0.070566 * y * y))
+        if elapsed > mean:
+            probability = e / (1.0 + e)
+        else:
+            probability = 1.0 - 1.0 / (1.0 + e)
+        return min(-math.log10(max(probability, 10 ** -MAX_PHI)), MAX_PHI)
+
+class Membership:
+    """Tabla de miembros del clúster con sospecha, encarnaciones y difusión por gossip (SWIM)"""
+
+    def __init__(self, local_node, nodes, suspicion_timeout, retransmit_mult, phi_window, phi_min_std,
+                 probe_interval, on_change=None):
+        self.local_node = local_node
+        self.suspicion_timeout = suspicion_timeout
+        self.retransmit_mult = retransmit_mult
+        self.phi_window = phi_window
+        self.phi_min_std = phi_min_std
+        self.probe_interval = probe_interval
+        self.on_change = on_change  # on_change(nodo, estado_anterior, estado_nuevo)
+        self.lock = threading.Lock()
+
+        # Encarnación propia: crece al refutar una sospecha; parte de la hora de arranque para que
+        # un nodo reiniciado prevalezca sobre lo que se difundió de su ejecución anterior
+        self.incarnation = int(time.time())
+        self.local_address = nodes[local_node]  # {"ip", "port" (web), "network_port"}
+        self.left = False
+        self.members = {}  # nodo -> {"state", "incarnation", "state_since", "last_seen", "address"}
+        self.detectors = {}  # nodo -> PhiAccrualDetector
+        self.updates = {local_node: [ALIVE, self.incarnation, 0]}  # nodo -> [estado, encarnación, envíos realizados] pendientes de difundir
+        self.version = 0  # Crece con cada cambio de la tabla de miembros
+        self.probe_order = []
+
+        # Los nodos conocidos de antemano empiezan activos con encarnación desconocida (0)
+        for node, address in nodes.items():
+            if node != local_node:
+                self._add_member(node, ALIVE, 0, address)
+
+    def _add_member(self, node, state, incarnation, address):
+        """Agrega un miembro a la tabla; debe llamarse con el lock tomado"""
+        now = time.time()
+        self.members[node] = {"state": state, "incarnation": incarnation, "state_since": now,
+                              "last_seen": now, "address": dict(address)}
+        self.detectors[node] = PhiAccrualDetector(self.phi_window, self.phi_min_std,
+                                                  self.probe_interval * (len(self.members) + 1))
+        self.version += 1
+
+    def _notify(self, changes):
+        """Avisa de los cambios de estado; debe llamarse sin el lock tomado"""
+        if self.on_change:
+            for node, previous, state in changes:
+                self.on_change(node, previous, state)
+
+    def _set_state(self, node, state, incarnation, changes, disseminate=True):
+        """Cambia el estado de un miembro; debe llamarse con el lock tomado"""
+        member = self.members[node]
+        previous = member["state"]
+        if member["incarnation"] != incarnation:
+            member["incarnation"] = incarnation
+            self.version += 1
+        if previous != state:
+            member["state"] = state
+            member["state_since"] = time.time()
+            self.version += 1
+            changes.append((node, previous, state))
+        if disseminate:
+            self.updates[node] = [state, incarnation, 0]
+
+    def _retransmit_limit(self):
+        """Veces que se reenvía cada actualización: proporcional a log(n)"""
+        return self.retransmit_mult * max(1, math.ceil(math.log2(len(self.members) + 2)))
+
+    def updates_to_send(self, limit):
+        """Actualizaciones a adjuntar a un mensaje saliente, priorizando las menos difundidas"""
+        with self.lock:
+            selected = sorted(self.updates.items(), key=lambda item: item[1][2])[:limit]
+            max_transmissions = self._retransmit_limit()
+            gossip = []
+            for node, update in selected:
+                gossip.append([node, update[0], update[1], self._address_of(node)])
+                update[2] += 1
+                if update[2] >= max_transmissions:
+                    del self.updates[node]
+            return gossip
+
+    def apply_updates(self, gossip):
+        """Incorpora las actualizaciones recibidas de otro nodo"""
+        changes = []
+        with self.lock:
+            for update in gossip or []:
+                self._apply(*update[:4], changes=changes)
+        self._notify(changes)
+
+    def _apply(self, node, state, incarnation, address=None, changes=None):
+        """Aplica una actualización según las reglas de precedencia de SWIM; debe llamarse con el lock tomado"""
+        if node == self.local_node:
+            # Refutar cualquier sospecha sobre este nodo, con una encarnación mayor si hace falta
+            if state != ALIVE and not self.left:
+                if incarnation >= self.incarnation:
+                    self.incarnation = incarnation + 1
+                self.updates[node] = [ALIVE, self.incarnation, 0]
+            return
+
+        member = self.members.get(node)
+        if member is None:
+            # Miembro nuevo (se unió a través de otro nodo): agregarlo y seguir difundiéndolo
+            if address is not None:
+                self._add_member(node, state, incarnation, address)
+                self.updates[node] = [state, incarnation, 0]
+                changes.append((node, None, state))
+            return
+
+        if state == ALIVE:
+            accept = incarnation > member["incarnation"]
+        elif state == SUSPECT:
+            accept = (member["state"] == ALIVE and incarnation >= member["incarnation"]) or \
+                     (member["state"] == SUSPECT and incarnation > member["incarnation"])
+        elif state == DEAD:
+            accept = member["state"] not in (DEAD, LEFT) or incarnation > member["incarnation"]
+        else:
+            accept = member["state"] != LEFT or incarnation > member["incarnation"]
+
+        if accept:
+            if address is not None and member["address"] != address:
+                member["address"] = dict(address)
+                self.version += 1
+            self._set_state(node, state, incarnation, changes)
+
+    def _address_of(self, node):
+        """Dirección de un miembro o del propio nodo; debe llamarse con el lock tomado"""
+        if node == self.local_node:
+            return self.local_address
+        return self.members[node]["address"]
+
+    def local_entry(self):
+        """Entrada de este nodo en la tabla de miembros"""
+        with self.lock:
+            return [self.local_node, LEFT if self.left else ALIVE, self.incarnation, self.local_address]
+
+    def table(self):
+        """Tabla completa de miembros (incluido este nodo) con su versión, para unirse o reconciliar"""
+        members = [self.local_entry()]
+        with self.lock:
+            for node, member in self.members.items():
+                members.append([node, member["state"], member["incarnation"], member["address"]])
+            return {"version": self.version, "members": members}
+
+    def merge_table(self, members):
+        """Incorpora la tabla de miembros de otro nodo"""
+        self.apply_updates(members)
+
+    def leave(self):
+        """Anuncia la salida voluntaria de este nodo (se difunde con los próximos mensajes)"""
+        with self.lock:
+            self.left = True
+            self.incarnation += 1
+            self.updates[self.local_node] = [LEFT, self.incarnation, 0]
+
+    def record_alive(self, node):
+        """Registra contacto directo con un nodo (mensaje o respuesta recibidos)"""
+        changes = []
+        with self.lock:
+            member = self.members.get(node)
+            if member is None or member["state"] == LEFT:
+                return
+            now = time.time()
+            member["last_seen"] = now
+            self.detectors[node].heartbeat(now)
+            if member["state"] != ALIVE:
+                # La evidencia directa basta para la vista local; el propio nodo refutará la sospecha ajena
+                self._set_state(node, ALIVE, member["incarnation"], changes, disseminate=False)
+        self._notify(changes)
+
+    def suspect(self, node):
+        """Marca un nodo como sospechoso tras fallar su sondeo directo e indirecto"""
+        changes = []
+        with self.lock:
+            member = self.members.get(node)
+            if member is None or member["state"] != ALIVE:
+                return
+            self._set_state(node, SUSPECT, member["incarnation"], changes)
+        self._notify(changes)
+
+    def expire_suspects(self):
+        """Declara caídos los nodos que siguen sospechosos tras el plazo de sospecha"""
+        changes = []
+        now = time.time()
+        with self.lock:
+            for node, member in self.members.items():
+                if member["state"] == SUSPECT and now - member["state_since"] > self.suspicion_timeout:
+                    self._set_state(node, DEAD, member["incarnation"], changes)
+        self._notify(changes)
+
+    def address(self, node):
+        """Dirección de red (ip, puerto) de un miembro, o None si no se conoce"""
+        with self.lock:
+            if node != self.local_node and node not in self.members:
+                return None
+            address = self._address_of(node)
+            return address["ip"], address["network_port"]
+
+    def next_probe_target(self):
+        """Siguiente nodo a sondear: recorrido circular en orden aleatorio (todos se sondean en n rondas)"""
+        with self.lock:
+            if not self.probe_order:
+                self.probe_order = [node for node, member in self.members.items() if member["state"] != LEFT]
+                random.shuffle(self.probe_order)
+            return self.probe_order.pop() if self.probe_order else None
+
+    def indirect_helpers(self, target, count):
+        """Nodos activos elegidos al azar para sondear indirectamente a `target`"""
+        with self.lock:
+            candidates = [node for node, member in self.members.items()
+                          if node != target and member["state"] == ALIVE]
+        return random.sample(candidates, min(count, len(candidates)))
+
+    def random_members(self, count):
+        """Hasta `count` nodos activos elegidos al azar"""
+        return self.indirect_helpers(None, count)
+
+    def is_alive(self, node):
+        """Indica si un nodo se considera activo (los sospechosos siguen siéndolo hasta confirmarse)"""
+        with self.lock:
+            member = self.members.get(node)
+            return member is not None and member["state"] not in (DEAD, LEFT)
+
+    def status(self):
+        """Estado de todos los nodos que no dejaron el clúster: activo o no"""
+        with self.lock:
+            return {node: member["state"] != DEAD for node, member in self.members.items()
+                    if member["state"] != LEFT}
+
+    def known_nodes(self):
+        """Todos los nodos que alguna vez formaron parte del clúster, también los caídos y los retirados"""
+        with self.lock:
+            return [node for node in self.members if node != self.local_node]
+
+    def detailed_status(self):
+        """Estado de todos los nodos con su estado SWIM, encarnación y nivel de sospecha phi"""
+        now = time.time()
+        with self.lock:
+            return {
+                node: {
+                    "alive": member["state"] != DEAD,
+                    "state": member["state"],
+                    "incarnation": member["incarnation"],
+                    "phi": round(self.detectors[node].phi(now), 3),
+                    "last_seen": member["last_seen"],
+                    "address": dict(member["address"])
+                }
+                for node, member in self.members.items()
+                if member["state"] != LEFT
+            }
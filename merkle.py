@@ -0,0 +1,62 @@
+import hashlib
+
+# Cada nivel del árbol corresponde a un dígito hexadecimal del hash de la clave
+FANOUT = 16
+HEX_DIGITS = '0123456789abcdef'
+EMPTY_HASH = format(0, '016x')
+
+class MerkleTree:
+    """Resumen por rangos de hash de un conjunto de claves, actualizable de forma incremental"""
+
+    def __init__(self, depth):
+        self.depth = depth
+        self.leaves = {}  # prefijo de hoja -> {clave: valor}
+        self.hashes = {}  # prefijo (de 0 a depth dígitos) -> XOR de los valores que contiene
+
+    def _locate(self, key):
+        """Calcula el prefijo de hoja y el valor (64 bits) de una clave"""
+        digest = hashlib.sha256(key.encode('utf-8')).hexdigest()
+        return digest[:self.depth], int(digest[:16], 16)
+
+    def _toggle(self, prefix, value):
+        """Aplica un valor por XOR a la hoja y a todos sus ancestros"""
+        for length in range(self.depth + 1):
+            node = prefix[:length]
+            self.hashes[node] = self.hashes.get(node, 0) ^ value
+
+    def add(self, key):
+        """Agrega una clave al árbol"""
+        prefix, value = self._locate(key)
+        leaf = self.leaves.setdefault(prefix, {})
+        if key in leaf:
+            return
+        leaf[key] = value
+        self._toggle(prefix, value)
+
+    def remove(self, key):
+        """Elimina una clave del árbol"""
+        prefix, value = self._locate(key)
+        leaf = self.leaves.get(prefix)
+        if not leaf or key not in leaf:
+            return
+        del leaf[key]
+        if not leaf:
+            del self.leaves[prefix]
+        self._toggle(prefix, value)
+
+    def clear(self):
+        """Vacía el árbol"""
+        self.leaves = {}
+        self.hashes = {}
+
+    def node_hash(self, prefix):
+        """Hash de un nodo del árbol"""
+        return format(self.hashes.get(prefix, 0), '016x')
+
+    def children(self, prefix):
+        """Hashes de los hijos de un nodo interno"""
+        return [self.node_hash(prefix + digit) for digit in HEX_DIGITS]
+
+    def keys(self, prefix):
+        """Claves contenidas en una hoja"""
+        return list(self.leaves.get(prefix, {}))
@@ -1,203 +1,549 @@
-import socket
+import asyncio
+import hashlib
+import os
+import random
 import threading
-import json
 import time
-import base64
-import struct
 import logging
 import atexit
-from config import NODES, NODE_NAME, NETWORK_PORT, HEARTBEAT_INTERVAL, NODE_TIMEOUT, NETWORK_TIMEOUT, MAX_RETRIES, MAX_DIRECT_TRANSFER_SIZE
+from concurrent.futures import ThreadPoolExecutor
+from config import NODES, NODE_NAME, NETWORK_PORT, SEEDS, MEMBERSHIP_SYNC_INTERVAL, JOIN_RETRY_INTERVAL, PROBE_INTERVAL, PROBE_TIMEOUT, INDIRECT_PROBES, SUSPICION_TIMEOUT, GOSSIP_MAX_UPDATES, GOSSIP_RETRANSMIT_MULT, PHI_WINDOW, PHI_MIN_STD, NETWORK_TIMEOUT, MAX_RETRIES, NETWORK_WORKERS, FANOUT_CONCURRENCY, PEER_DEADLINE, DELETE_QUORUM, LATENCY_EWMA_ALPHA, HEDGE_DELAY_FACTOR, HEDGE_MIN_DELAY, STREAM_CHUNK_SIZE, DELTA_BLOCK_SIZE, DELTA_MIN_FILE_SIZE, DELTA_MAX_RATIO, COMPRESSION_SAMPLE_SIZE, SYNC_BATCH_SIZE
+from connection_pool import ConnectionPool, read_frame, write_frame, read_raw_block, pack_block
+from file_manager import clamp_range
+from membership import Membership, DEAD, LEFT
+from operation_log import make_operation_id
+import vector_clock
+import compressor
 
 logger = logging.getLogger('sistema.network')
 
+# Mensajes baratos que se atienden directamente en el event loop sin pasar por el executor
+INLINE_MESSAGE_TYPES = {"heartbeat", "ping", "join", "leave", "members"}
+
+# Mensajes cuya cabecera JSON va seguida de datos binarios en la misma conexión
+STREAM_MESSAGE_TYPES = {"transfer_file_stream", "transfer_delta_stream", "transfer_chunks_stream"}
+
+def _close_file_stream(task):
+    """Cierra la conexión de una lectura remota que ya no se usará"""
+    if task.cancelled() or task.exception() or not task.result():
+        return
+    task.result()[2].close()
+
 class NetworkManager:
     def __init__(self, file_manager, operation_log, sync_manager):
-        self.nodes = NODES
         self.node_name = NODE_NAME
         self.port = NETWORK_PORT
         self.file_manager = file_manager
         self.operation_log = operation_log
         self.sync_manager = sync_manager
         
-        # Estado de los nodos
-        self.node_status = {node: {"alive": True, "last_seen": time.time()} 
-                            for node in self.nodes if node != self.node_name}
+        # Miembros del clúster: parten de los nodos conocidos y crecen con las uniones difundidas por gossip;
+        # su estado lo mantiene el detector de fallos SWIM (sondeos aleatorios, sondeos indirectos y gossip)
+        self.membership = Membership(
+            self.node_name, NODES, SUSPICION_TIMEOUT, GOSSIP_RETRANSMIT_MULT,
+            PHI_WINDOW, PHI_MIN_STD, PROBE_INTERVAL, on_change=self._on_member_change
+        )
         
-        # Lock para acceso seguro al estado de los nodos
-        self.status_lock = threading.Lock()
+        # Toda la red corre sobre un único event loop en su propio thread
+        self.loop = asyncio.new_event_loop()
+        self.loop_thread = threading.Thread(target=self._run_loop)
+        self.loop_thread.daemon = True
         
-        # Iniciar servidor y mecanismos de heartbeat
-        self.server_socket = None
+        # El trabajo bloqueante (disco, sincronización) se delega a un pool acotado
+        self.executor = ThreadPoolExecutor(max_workers=NETWORK_WORKERS)
+        
+        self.server = None
         self.running = True
         self.active_connections = set()
+        self.connection_pool = ConnectionPool()
+        
+        # Difusión a varios nodos: envíos simultáneos acotados y entregas que siguen en segundo plano
+        self.fanout_semaphore = asyncio.Semaphore(FANOUT_CONCURRENCY)
+        self.background_deliveries = set()
         
-        # Iniciar threads de servidor y heartbeat
-        self.server_thread = threading.Thread(target=self._start_server)
-        self.heartbeat_thread = threading.Thread(target=self._send_heartbeats)
-        self.status_thread = threading.Thread(target=self._check_nodes_status)
+        # Funciones a las que se avisa cuando un nodo cambia de estado
+        self.status_listeners = []
         
-        self.server_thread.daemon = True
-        self.heartbeat_thread.daemon = True
-        self.status_thread.daemon = True
+        # Latencia observada por nodo (media móvil exponencial, en segundos) para elegir réplicas
+        self.latency = {}
         
         # Registrar limpieza al cerrar
         atexit.register(self.stop)
         
         logger.info(f"Inicializando NetworkManager para nodo {self.node_name}")
         logger.info(f"Puerto de red: {self.port}")
-        logger.info(f"Nodos configurados: {list(self.nodes.keys())}")
+        logger.info(f"Nodos conocidos: {list(NODES.keys())}")
+        logger.info(f"Nodos semilla: {SEEDS}")
     
     def start(self):
-        """Inicia los threads de red"""
-        logger.info("Iniciando threads de red...")
-        self.server_thread.start()
-        self.heartbeat_thread.start()
-        self.status_thread.start()
-        logger.info("Threads de red iniciados")
-    
-    def _start_server(self):
+        """Inicia el event loop de red con el servidor y el detector de fallos"""
+        logger.info("Iniciando event loop de red...")
+        self.loop_thread.start()
+        
+        # Esperar a que el servidor esté escuchando para propagar errores de arranque
+        asyncio.run_coroutine_threadsafe(self._start_server(), self.loop).result()
+        self.loop.call_soon_threadsafe(self._start_background_tasks)
+        logger.info("Event loop de red iniciado")
+    
+    def _run_loop(self):
+        """Ejecuta el event loop de red hasta que se detenga"""
+        asyncio.set_event_loop(self.loop)
+        self.loop.set_default_executor(self.executor)
+        self.loop.run_forever()
+    
+    def _start_background_tasks(self):
+        """Programa las tareas periódicas en el event loop"""
+        self.loop.create_task(self._join_cluster())
+        self.loop.create_task(self._probe_members())
+        self.loop.create_task(self._check_nodes_status())
+        self.loop.create_task(self._sync_membership())
+    
+    async def _start_server(self):
         """Inicia el servidor para escuchar mensajes de otros nodos"""
         try:
-            self.server_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            self.server_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            self.server_socket.bind(('0.0.0.0', self.port))
-            self.server_socket.listen(10)
-            
+            self.server = await asyncio.start_server(
+                self._handle_client, '0.0.0.0', self.port, reuse_address=True, backlog=128
+            )
             logger.info(f"Servidor iniciado en el puerto {self.port}")
-            
-            while self.running:
-                try:
-                    client_socket, address = self.server_socket.accept()
-                    logger.debug(f"Conexión aceptada de {address}")
-                    client_thread = threading.Thread(target=self._handle_client, args=(client_socket, address))
-                    client_thread.daemon = True
-                    client_thread.start()
-                except Exception as e:
-                    if self.running:
-                        logger.error(f"Error al aceptar conexión: {e}")
         except Exception as e:
             logger.error(f"Error al iniciar servidor: {e}")
             raise
     
-    def _cleanup_connection(self, sock):
-        """Limpia una conexión de socket"""
-        try:
-            if sock in self.active_connections:
-                self.active_connections.remove(sock)
-            sock.shutdown(socket.SHUT_RDWR)
-        except:
-            pass
-        finally:
-            sock.close()
-    
     def _send_message(self, node, message, retry_count=0):
+        """Envía un mensaje a otro nodo con reintentos (llamada bloqueante desde otros threads)"""
+        if node == self.node_name:
+            logger.debug("Ignorando envío de mensaje a nosotros mismos")
+            return True
+        
+        return self._run_coroutine(self._send_message_async(node, message, retry_count))
+    
+    def _run_coroutine(self, coroutine):
+        """Ejecuta una corrutina en el event loop de red y espera su resultado"""
+        if not self.loop.is_running():
+            coroutine.close()
+            logger.error("Event loop de red detenido, no se puede completar la operación")
+            return None
+        
+        return asyncio.run_coroutine_threadsafe(coroutine, self.loop).result()
+    
+    async def _send_message_async(self, node, message, retry_count=0):
         """Envía un mensaje a otro nodo con reintentos"""
-        client_socket = None
         try:
             if node == self.node_name:
                 logger.debug("Ignorando envío de mensaje a nosotros mismos")
                 return True
             
-            ip = self.nodes[node]["ip"]
-            port = NETWORK_PORT
-            
-            logger.debug(f"Conectando a {node} ({ip}:{port})")
-            client_socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            client_socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
-            client_socket.settimeout(NETWORK_TIMEOUT)
-            client_socket.connect((ip, port))
-            
-            # Serializar el mensaje
-            message_data = json.dumps(message).encode('utf-8')
-            
-            # Enviar longitud del mensaje primero (4 bytes)
-            message_length = len(message_data)
-            client_socket.sendall(struct.pack('!I', message_length))
-            
-            # Enviar el mensaje
-            client_socket.sendall(message_data)
-            
-            # Recibir respuesta
-            response_length = struct.unpack('!I', client_socket.recv(4))[0]
-            response_data = client_socket.recv(response_length)
-            response = json.loads(response_data.decode('utf-8'))
+            logger.debug(f"Enviando {message.get('type')} a {node}")
+            response = await self._request(node, message, NETWORK_TIMEOUT)
             
             logger.debug(f"Respuesta recibida de {node}: {response}")
             return response
-        except socket.timeout:
+        except asyncio.TimeoutError:
             logger.error(f"Timeout al conectar con {node}")
-            if retry_count < MAX_RETRIES:
-                logger.info(f"Reintentando conexión con {node} (intento {retry_count + 1})")
-                time.sleep(1)  # Esperar antes de reintentar
-                return self._send_message(node, message, retry_count + 1)
-            with self.status_lock:
-                self.node_status[node]["alive"] = False
-            return None
         except ConnectionRefusedError:
             logger.error(f"Conexión rechazada por {node}")
-            if retry_count < MAX_RETRIES:
-                logger.info(f"Reintentando conexión con {node} (intento {retry_count + 1})")
-                time.sleep(1)
-                return self._send_message(node, message, retry_count + 1)
-            with self.status_lock:
-                self.node_status[node]["alive"] = False
-            return None
         except Exception as e:
             logger.error(f"Error al enviar mensaje a {node}: {e}")
-            if retry_count < MAX_RETRIES:
-                logger.info(f"Reintentando conexión con {node} (intento {retry_count + 1})")
-                time.sleep(1)
-                return self._send_message(node, message, retry_count + 1)
-            with self.status_lock:
-                self.node_status[node]["alive"] = False
-            return None
-        finally:
-            if client_socket:
-                self._cleanup_connection(client_socket)
+        
+        if retry_count < MAX_RETRIES and self.running:
+            logger.info(f"Reintentando conexión con {node} (intento {retry_count + 1})")
+            await asyncio.sleep(1)  # Esperar antes de reintentar
+            return await self._send_message_async(node, message, retry_count + 1)
+        
+        # Sin respuesta tras los reintentos: el nodo pasa a sospechoso hasta confirmarse o refutarse
+        self.membership.suspect(node)
+        return None
+    
+    async def _request(self, node, message, timeout):
+        """Envía una petición por el pool, adjuntando y recogiendo las actualizaciones de pertenencia"""
+        address = self.membership.address(node)
+        if address is None:
+            raise ConnectionError(f"Nodo desconocido: {node}")
+        message = dict(message, gossip=self.membership.updates_to_send(GOSSIP_MAX_UPDATES))
+        start = time.monotonic()
+        try:
+            response = await self.connection_pool.request(node, address, message, timeout)
+        except Exception:
+            # Un fallo cuenta como la peor latencia posible para esa petición
+            self._record_latency(node, timeout)
+            raise
+        
+        self._record_latency(node, time.monotonic() - start)
+        self.membership.record_alive(node)
+        if isinstance(response, dict):
+            self.membership.apply_updates(response.pop("gossip", None))
+        return response
+    
+    def _record_latency(self, node, seconds):
+        """Actualiza la media móvil exponencial de la latencia de un nodo"""
+        previous = self.latency.get(node)
+        if previous is None:
+            self.latency[node] = seconds
+        else:
+            self.latency[node] = LATENCY_EWMA_ALPHA * seconds + (1 - LATENCY_EWMA_ALPHA) * previous
+    
+    def rank_replicas(self, nodes):
+        """Nodos activos de `nodes` ordenados de menor a mayor latencia observada"""
+        alive = [node for node in nodes if node != self.node_name and self.membership.is_alive(node)]
+        return sorted(alive, key=lambda node: self.latency.get(node, PROBE_TIMEOUT))
+    
+    def broadcast(self, message, nodes=None, quorum=None, deadline=PEER_DEADLINE):
+        """Envía un mensaje a varios nodos en paralelo y espera `quorum` confirmaciones (todas por defecto)"""
+        # Resultado por nodo: "ok", "error", "timeout" o "pending" si la entrega sigue en segundo plano
+        if nodes is None:
+            nodes = list(self.membership.status())
+        results = self._run_coroutine(self._broadcast_async(message, nodes, quorum, deadline))
+        return results if results is not None else {node: "error" for node in nodes}
+    
+    async def _broadcast_async(self, message, nodes, quorum, deadline):
+        """Difunde un mensaje y retorna al alcanzar el quórum; el resto de envíos continúa"""
+        tasks = {
+            self.loop.create_task(self._deliver(node, message, deadline)): node
+            for node in nodes if node != self.node_name
+        }
+        results = {node: "pending" for node in tasks.values()}
+        needed = len(tasks) if quorum is None else min(quorum, len(tasks))
+        acks = 0
+        pending = set(tasks)
+        
+        # Esperar hasta el quórum, o hasta que ya no sea alcanzable
+        while pending and acks < needed and acks + len(pending) >= needed:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                results[tasks[task]] = task.result()
+                if task.result() == "ok":
+                    acks += 1
+        
+        for task in pending:
+            self.background_deliveries.add(task)
+            task.add_done_callback(lambda task, node=tasks[task]: self._finish_delivery(task, node, message))
+        
+        return results
+    
+    async def _deliver(self, node, message, deadline):
+        """Entrega un mensaje a un nodo con un plazo máximo y devuelve el resultado"""
+        async with self.fanout_semaphore:
+            try:
+                response = await asyncio.wait_for(self._send_message_async(node, message), deadline)
+            except asyncio.TimeoutError:
+                logger.warning(f"Plazo agotado al enviar {message.get('type')} a {node}")
+                return "timeout"
+        
+        if isinstance(response, dict) and response.get("status") == "ok":
+            return "ok"
+        return "error"
     
-    def _handle_client(self, client_socket, address):
-        """Maneja una conexión entrante de otro nodo"""
-        self.active_connections.add(client_socket)
+    def _finish_delivery(self, task, node, message):
+        """Registra el resultado de una entrega que continuó tras alcanzar el quórum"""
+        self.background_deliveries.discard(task)
+        if task.cancelled():
+            return
+        logger.info(f"Entrega en segundo plano de {message.get('type')} a {node}: {task.result()}")
+    
+    async def _handle_client(self, reader, writer):
+        """Maneja una conexión entrante de otro nodo durante toda su vida"""
+        address = writer.get_extra_info('peername')
+        write_lock = asyncio.Lock()
+        tasks = set()
+        codec = None  # Códec acordado en el saludo para las respuestas de esta conexión
+        self.active_connections.add(writer)
         try:
             logger.debug(f"Manejando conexión de {address}")
             
-            # Recibir longitud del mensaje primero
-            length_data = client_socket.recv(4)
-            if not length_data:
-                logger.warning(f"Conexión cerrada por {address} sin datos")
-                return
+            while self.running:
+                message = await read_frame(reader)
+                if message is None:
+                    logger.debug(f"Conexión cerrada por {address}")
+                    break
+                
+                request_id = message.pop("request_id", None)
+                self.membership.apply_updates(message.pop("gossip", None))
+                if message.get("type") == "hello":
+                    # Saludo de una conexión persistente: acordar el códec antes de cualquier otra petición
+                    codec = compressor.choose_codec(message.get("codecs"))
+                    response = {"status": "ok", "codec": codec}
+                    if request_id is not None:
+                        response["request_id"] = request_id
+                    async with write_lock:
+                        await write_frame(writer, response)
+                elif message.get("type") in STREAM_MESSAGE_TYPES:
+                    # Los datos binarios siguen a la cabecera en la misma conexión
+                    await self._receive_stream(reader, writer, write_lock, address, message, request_id)
+                elif message.get("type") == "get_file":
+                    # La respuesta lleva bytes en crudo: se sirve por una conexión dedicada que luego se cierra
+                    await self._serve_file(writer, message)
+                    break
+                elif request_id is None:
+                    # Cliente antiguo: una petición por conexión, respuesta inmediata
+                    await self._respond(writer, write_lock, address, message, None, codec)
+                else:
+                    # Las peticiones multiplexadas se procesan concurrentemente
+                    task = asyncio.ensure_future(
+                        self._respond(writer, write_lock, address, message, request_id, codec)
+                    )
+                    tasks.add(task)
+                    task.add_done_callback(tasks.discard)
             
-            message_length = struct.unpack('!I', length_data)[0]
-            logger.debug(f"Esperando mensaje de {message_length} bytes")
+        except asyncio.CancelledError:
+            pass
+        except Exception as e:
+            if self.running:
+                logger.error(f"Error al manejar cliente {address}: {e}")
+        finally:
+            for task in list(tasks):
+                task.cancel()
+            self.active_connections.discard(writer)
+            writer.close()
+    
+    async def _respond(self, writer, write_lock, address, message, request_id, codec=None):
+        """Procesa un mensaje y envía la respuesta por la conexión de origen"""
+        try:
+            logger.debug(f"Mensaje recibido de {address}: {message.get('type')}")
+            if message.get("type") in INLINE_MESSAGE_TYPES:
+                response = self._process_message(message)
+            elif message.get("type") == "ping_req":
+                response = await self._handle_ping_req(message)
+            else:
+                response = await self.loop.run_in_executor(self.executor, self._process_message, message)
+            logger.debug(f"Enviando respuesta a {address}: {response}")
             
-            # Recibir el mensaje completo
-            chunks = []
-            bytes_received = 0
-            while bytes_received < message_length:
-                chunk = client_socket.recv(min(message_length - bytes_received, 4096))
-                if not chunk:
-                    break
-                chunks.append(chunk)
-                bytes_received += len(chunk)
+            response = dict(response, gossip=self.membership.updates_to_send(GOSSIP_MAX_UPDATES))
+            if request_id is not None:
+                response["request_id"] = request_id
             
-            message_data = b''.join(chunks)
-            message = json.loads(message_data.decode('utf-8'))
-            logger.debug(f"Mensaje recibido de {address}: {message}")
+            async with write_lock:
+                await write_frame(writer, response, codec)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Error al responder a {address}: {e}")
+    
+    async def _receive_stream(self, reader, writer, write_lock, address, message, request_id):
+        """Recibe un archivo enviado en streaming tras una cabecera JSON"""
+        response = await self._receive_file_stream(reader, message)
+        response = dict(response, gossip=self.membership.updates_to_send(GOSSIP_MAX_UPDATES))
+        if request_id is not None:
+            response["request_id"] = request_id
+        async with write_lock:
+            await write_frame(writer, response)
+    
+    async def _serve_file(self, writer, message):
+        """Responde a get_file con una cabecera JSON seguida del rango de bytes pedido"""
+        filename = message.get("filename")
+        self._update_node_seen(message.get("source_node"))
+        gossip = self.membership.updates_to_send(GOSSIP_MAX_UPDATES)
+        
+        info = await self.loop.run_in_executor(self.executor, self.file_manager.get_file_info, filename)
+        file_path = self.file_manager.get_file_path(filename)
+        if info is None or file_path is None:
+            await write_frame(writer, {"status": "not_found", "gossip": gossip})
+            return
+        
+        offset, length = clamp_range(info["size"], message.get("offset"), message.get("length"))
+        codec = None
+        if length:
+            codec = await self.loop.run_in_executor(
+                self.executor, self._stream_codec, compressor.choose_codec(message.get("codecs")), filename, file_path, offset
+            )
+        
+        logger.debug(f"Enviando {filename} [{offset}, {offset + length}) a {message.get('source_node')} (compresión: {codec})")
+        with open(file_path, 'rb') as f:
+            await write_frame(writer, dict(info, status="ok", offset=offset, length=length, encoding=codec, gossip=gossip))
+            if codec:
+                await self._write_blocks(writer, f, offset, length, codec)
+            elif length:
+                await self.loop.sendfile(writer.transport, f, offset=offset, count=length)
+    
+    def _stream_codec(self, codec, filename, file_path, offset=0):
+        """Códec con el que enviar un archivo: None si no hay acuerdo o una muestra indica que no se comprime"""
+        if not codec:
+            return None
+        with open(file_path, 'rb') as f:
+            f.seek(offset)
+            sample = f.read(COMPRESSION_SAMPLE_SIZE)
+        return codec if compressor.worth_compressing(filename, sample) else None
+    
+    async def _write_blocks(self, writer, f, offset, length, codec):
+        """Envía un rango de un archivo como bloques comprimidos por separado"""
+        f.seek(offset)
+        remaining = length
+        while remaining > 0:
+            size, block = await self.loop.run_in_executor(
+                self.executor, self._read_block, f, min(remaining, STREAM_CHUNK_SIZE), codec
+            )
+            if not size:
+                raise IOError(f"{f.name} cambió durante el envío")
+            remaining -= size
+            writer.write(block)
+            await writer.drain()
+    
+    def _read_block(self, f, size, codec):
+        """Lee un bloque de un archivo y lo empaqueta comprimido; devuelve (bytes leídos, bloque)"""
+        chunk = f.read(size)
+        return len(chunk), pack_block(chunk, codec)
+    
+    async def _receive_file_stream(self, reader, message):
+        """Escribe en un temporal los bytes recibidos y lo publica de forma atómica"""
+        source_node = message.get("source_node")
+        filename = message.get("filename")
+        size = message.get("size", 0)
+        
+        if not self.file_manager.is_valid_name(filename):
+            # Fuera del directorio compartido o archivo interno: se corta la conexión sin leer los datos ni tocar el disco
+            raise ConnectionError(f"Transferencia de {source_node} rechazada: nombre de archivo no válido {filename!r}")
+        
+        logger.info(f"Recibiendo archivo {filename} ({size} bytes) de {source_node}")
+        self._update_node_seen(source_node)
+        
+        temp_file, temp_path = await self.loop.run_in_executor(
+            self.executor, self.file_manager.create_temp_file, filename
+        )
+        try:
+            remaining = size
+            buffer = bytearray()
+            while remaining > 0:
+                if message.get("encoding"):
+                    # Contenido en bloques comprimidos por separado
+                    block = await read_raw_block(reader)
+                    if block is None:
+                        raise ConnectionError(f"Transferencia de {filename} interrumpida")
+                    chunk = await self.loop.run_in_executor(self.executor, compressor.decompress, *block)
+                    if len(chunk) > remaining:
+                        raise ValueError(f"Transferencia de {filename} más larga de lo anunciado")
+                else:
+                    chunk = await reader.read(min(remaining, STREAM_CHUNK_SIZE))
+                if not chunk:
+                    raise ConnectionError(f"Transferencia de {filename} interrumpida")
+                buffer += chunk
+                remaining -= len(chunk)
+                
+                # Escribir en bloques grandes para no saturar el executor
+                if len(buffer) >= STREAM_CHUNK_SIZE or remaining == 0:
+                    await self.loop.run_in_executor(self.executor, temp_file.write, bytes(buffer))
+                    buffer.clear()
             
-            # Procesar mensaje
-            response = self._process_message(message)
-            logger.debug(f"Enviando respuesta a {address}: {response}")
+            await self.loop.run_in_executor(self.executor, temp_file.close)
             
-            # Enviar respuesta
-            response_data = json.dumps(response).encode('utf-8')
-            response_length = len(response_data)
-            client_socket.sendall(struct.pack('!I', response_length))
-            client_socket.sendall(response_data)
+            relation = await self.loop.run_in_executor(self.executor, self._compare_incoming, message)
+            if relation in (vector_clock.BEFORE, vector_clock.CONCURRENT):
+                # No retroceder ni pisar la copia local: una versión concurrente queda registrada como conflicto
+                await self.loop.run_in_executor(self.executor, self.file_manager.discard_temp_file, temp_path)
+                logger.warning(f"Archivo {filename} de {source_node} descartado: versión {relation} con la local")
+                return {"status": "ok", "skipped": relation}
             
+            if message.get("type") == "transfer_delta_stream":
+                commit = self._commit_received_delta
+            elif message.get("type") == "transfer_chunks_stream":
+                commit = self._commit_received_chunks
+            else:
+                commit = self._commit_received_file
+            await self.loop.run_in_executor(self.executor, commit, temp_path, message)
+            logger.info(f"Archivo {filename} guardado exitosamente")
+            return {"status": "ok"}
         except Exception as e:
-            logger.error(f"Error al manejar cliente {address}: {e}")
+            temp_file.close()
+            await self.loop.run_in_executor(self.executor, self.file_manager.discard_temp_file, temp_path)
+            logger.error(f"Error al recibir archivo {filename}: {e}")
+            if isinstance(e, ConnectionError):
+                raise
+            return {"status": "error", "message": "Error al guardar archivo"}
+    
+    def _compare_incoming(self, message, operation_type="transfer"):
+        """Compara la versión de un archivo recibido o eliminado con la local (None si no se puede saber) y registra los conflictos"""
+        version = message.get("version")
+        if version is None:
+            return None
+        
+        filename = message.get("filename")
+        local_version, local_sha256 = self.get_file_version(filename)
+        relation = vector_clock.compare(version, local_version)
+        if relation == vector_clock.CONCURRENT:
+            if message.get("sha256") == local_sha256:
+                # Mismo contenido por caminos distintos: se aceptan y se unen las versiones
+                return vector_clock.AFTER
+            self.operation_log.add_operation(
+                operation_type, message.get("source_node"),
+                target_node=self.node_name if operation_type == "transfer" else None, filename=filename,
+                timestamp=message.get("timestamp"), hlc=message.get("hlc"), version=version, sha256=message.get("sha256"),
+                conflict=True
+            )
+        return relation
+    
+    def _commit_received_file(self, temp_path, message):
+        """Publica un archivo recibido y registra la operación"""
+        filename = message.get("filename")
+        self.file_manager.commit_temp_file(temp_path, filename)
+        self.operation_log.add_operation(
+            "transfer", message.get("source_node"), target_node=self.node_name,
+            filename=filename, timestamp=message.get("timestamp"), hlc=message.get("hlc"),
+            version=message.get("version"), sha256=message.get("sha256")
+        )
+    
+    def _commit_received_delta(self, delta_path, message):
+        """Reconstruye un archivo a partir de un delta recibido y registra la operación"""
+        filename = message.get("filename")
+        try:
+            self.file_manager.apply_delta(
+                filename, delta_path, message.get("block_size"), message.get("sha256")
+            )
         finally:
-            self._cleanup_connection(client_socket)
+            self.file_manager.discard_temp_file(delta_path)
+        
+        self.operation_log.add_operation(
+            "transfer", message.get("source_node"), target_node=self.node_name,
+            filename=filename, timestamp=message.get("timestamp"), hlc=message.get("hlc"),
+            version=message.get("version"), sha256=message.get("sha256")
+        )
+    
+    def _commit_received_chunks(self, spool_path, message):
+        """Guarda los chunks recibidos, ensambla el archivo y registra la operación"""
+        filename = message.get("filename")
+        try:
+            self.file_manager.save_chunked_file(
+                filename, spool_path, message.get("missing", []), message.get("chunks", [])
+            )
+        finally:
+            self.file_manager.discard_temp_file(spool_path)
+        
+        self.operation_log.add_operation(
+            "transfer", message.get("source_node"), target_node=self.node_name,
+            filename=filename, timestamp=message.get("timestamp"), hlc=message.get("hlc"),
+            version=message.get("version"), sha256=message.get("sha256")
+        )
+    
+    def _update_node_seen(self, source_node):
+        """Marca un nodo como activo al recibir un mensaje suyo"""
+        if source_node:
+            self.membership.record_alive(source_node)
+            logger.debug(f"Estado actualizado para nodo {source_node}")
+    
+    def _on_member_change(self, node, previous, state):
+        """Registra los cambios de estado SWIM y avisa a los listeners si un nodo se une, sale, cae o se recupera"""
+        if previous is None:
+            logger.info(f"Nodo {node} se unió al clúster ({state})")
+        elif state == LEFT:
+            logger.info(f"Nodo {node} dejó el clúster")
+            self.loop.call_soon_threadsafe(self.connection_pool.close_node, node)
+        elif state == DEAD:
+            logger.warning(f"Nodo {node} ha dejado de responder")
+        else:
+            logger.info(f"Nodo {node}: {previous} -> {state}")
+        
+        if previous is None or state == LEFT or (previous == DEAD) != (state == DEAD):
+            self._notify_status_change()
+    
+    def add_status_listener(self, callback):
+        """Registra una función que recibe el estado de todos los nodos cada vez que alguno cambia"""
+        self.status_listeners.append(callback)
+    
+    def _notify_status_change(self):
+        """Envía el estado actual de los nodos a los listeners"""
+        status = self.get_node_status()
+        for callback in self.status_listeners:
+            try:
+                callback(status)
+            except Exception as e:
+                logger.error(f"Error al notificar cambio de estado: {e}")
     
     def _process_message(self, message):
         """Procesa un mensaje recibido de otro nodo"""
@@ -207,25 +553,39 @@ class NetworkManager:
         logger.debug(f"Procesando mensaje tipo {message_type} de {source_node}")
         
         # Actualizar estado del nodo
-        if source_node and source_node in self.node_status:
-            with self.status_lock:
-                self.node_status[source_node]["alive"] = True
-                self.node_status[source_node]["last_seen"] = time.time()
-                logger.debug(f"Estado actualizado para nodo {source_node}")
+        self._update_node_seen(source_node)
+        
+        if message_type in ("heartbeat", "ping"):
+            return {"status": "ok"}
+        
+        elif message_type == "join":
+            # El nodo nuevo recibe la tabla completa; su llegada se difunde al resto por gossip
+            self.membership.apply_updates([message.get("member")])
+            logger.info(f"Nodo {source_node} solicita unirse al clúster")
+            return dict(self.membership.table(), status="ok", node=self.node_name)
         
-        if message_type == "heartbeat":
+        elif message_type == "leave":
+            self.membership.apply_updates([message.get("member")])
             return {"status": "ok"}
         
+        elif message_type == "members":
+            self.membership.merge_table(message.get("members", []))
+            return dict(self.membership.table(), status="ok")
+        
         elif message_type == "transfer_file":
             filename = message.get("filename")
             file_data = message.get("file_data")
+            if not self.file_manager.is_valid_name(filename):
+                logger.warning(f"Transferencia de {source_node} rechazada: nombre de archivo no válido {filename!r}")
+                return {"status": "error", "message": "Nombre de archivo no válido"}
             
             logger.info(f"Recibiendo archivo {filename} de {source_node}")
             if self.file_manager.save_file(filename, file_data):
                 # Registrar operación en el log
                 self.operation_log.add_operation(
                     "transfer", source_node, target_node=self.node_name, 
-                    filename=filename, timestamp=message.get("timestamp")
+                    filename=filename, timestamp=message.get("timestamp"), hlc=message.get("hlc"),
+                    version=message.get("version"), sha256=message.get("sha256")
                 )
                 logger.info(f"Archivo {filename} guardado exitosamente")
                 return {"status": "ok"}
@@ -235,13 +595,24 @@ class NetworkManager:
         
         elif message_type == "delete_file":
             filename = message.get("filename")
+            if not self.file_manager.is_valid_name(filename):
+                logger.warning(f"Eliminación de {source_node} rechazada: nombre de archivo no válido {filename!r}")
+                return {"status": "error", "message": "Nombre de archivo no válido"}
+            
+            relation = self._compare_incoming(message, "delete")
+            if relation in (vector_clock.BEFORE, vector_clock.CONCURRENT):
+                # La copia local tiene escrituras que la eliminación no incluye: se conserva
+                logger.warning(f"Eliminación de {filename} de {source_node} descartada: versión {relation} con la local")
+                return {"status": "ok", "skipped": relation}
             
             logger.info(f"Eliminando archivo {filename} por solicitud de {source_node}")
-            if self.file_manager.delete_file(filename, source_node, log_operation=False):
+            deleted = self.file_manager.delete_file(filename, source_node, log_operation=False)
+            # La eliminación es idempotente: si el archivo ya no existe también se confirma
+            if deleted or not os.path.exists(os.path.join(self.file_manager.shared_dir, filename)):
                 # Registrar operación en el log
                 self.operation_log.add_operation(
                     "delete", source_node, filename=filename,
-                    timestamp=message.get("timestamp")
+                    timestamp=message.get("timestamp"), hlc=message.get("hlc"), version=message.get("version")
                 )
                 logger.info(f"Archivo {filename} eliminado exitosamente")
                 return {"status": "ok"}
@@ -249,12 +620,73 @@ class NetworkManager:
                 logger.error(f"Error al eliminar archivo {filename}")
                 return {"status": "error", "message": "Error al eliminar archivo"}
         
+        elif message_type == "get_signatures":
+            filename = message.get("filename")
+            block_size = message.get("block_size", DELTA_BLOCK_SIZE)
+            signatures = self.file_manager.get_signatures(filename, block_size)
+            if signatures is None:
+                return {"status": "not_found"}
+            logger.debug(f"Enviando {len(signatures)} firmas de {filename} a {source_node}")
+            return {"status": "ok", "block_size": block_size, "signatures": signatures}
+        
+        elif message_type == "stat_file":
+            info = self.file_manager.get_file_info(message.get("filename"))
+            if info is None:
+                return {"status": "ok", "exists": False}
+            version, _ = self.get_file_version(message.get("filename"))
+            return dict(info, status="ok", exists=True, version=version)
+        
+        elif message_type == "chunk_query":
+            if not self.file_manager.chunk_store:
+                return {"status": "error", "message": "Almacén de chunks deshabilitado"}
+            missing = self.file_manager.missing_chunks(message.get("chunks", []))
+            logger.debug(f"Faltan {len(missing)} chunks solicitados por {source_node}")
+            return {"status": "ok", "missing": missing}
+        
+        elif message_type == "sync_request" and "cursor" in message:
+            # El cursor del nodo dice hasta dónde aplicó este log: las lápidas anteriores ya no le hacen falta
+            self.operation_log.acknowledge(source_node, message["cursor"])
+            if self.operation_log.cursor_expired(message["cursor"]):
+                # Se descartaron lápidas que el nodo no leyó: debe partir de una instantánea
+                return {"status": "ok", "reset": True, "cursor_expired": True, "operations": [],
+                        "cursor": self.operation_log.get_cursor(), "has_more": False}
+            
+            # Una página por petición: el nodo pide la siguiente con el cursor devuelto mientras haya más
+            limit = min(message.get("limit") or SYNC_BATCH_SIZE, SYNC_BATCH_SIZE)
+            result = self.operation_log.get_operations_after(message["cursor"], limit)
+            if result is None:
+                # Cursor desconocido o de otro log: el nodo debe reconciliar y continuar desde el final actual
+                return {"status": "ok", "reset": True, "operations": [], "cursor": self.operation_log.get_cursor(),
+                        "has_more": False}
+            operations, cursor, has_more = result
+            logger.debug(f"Enviando {len(operations)} operaciones nuevas a {source_node}")
+            return {"status": "ok", "operations": operations, "cursor": cursor, "has_more": has_more}
+        
+        elif message_type == "snapshot":
+            limit = min(message.get("limit") or SYNC_BATCH_SIZE, SYNC_BATCH_SIZE)
+            operations, files, cursor, after = self.operation_log.get_snapshot(message.get("after"), limit)
+            logger.debug(f"Enviando instantánea de {len(operations)} operaciones a {source_node}")
+            return {"status": "ok", "operations": operations, "files": files, "cursor": cursor, "after": after}
+        
         elif message_type == "sync_request":
             last_timestamp = message.get("last_timestamp", 0)
             operations = self.operation_log.get_operations_since(last_timestamp)
             logger.debug(f"Enviando {len(operations)} operaciones a {source_node}")
             return {"status": "ok", "operations": operations}
         
+        elif message_type == "merkle_nodes":
+            nodes = self.operation_log.get_merkle_children(message.get("prefixes", []))
+            return {"status": "ok", "nodes": nodes}
+        
+        elif message_type == "merkle_leaves":
+            leaves = self.operation_log.get_merkle_leaves(message.get("prefixes", []))
+            return {"status": "ok", "leaves": leaves}
+        
+        elif message_type == "get_operations":
+            operations = self.operation_log.get_operations(message.get("operation_ids", []))
+            logger.debug(f"Enviando {len(operations)} operaciones a {source_node}")
+            return {"status": "ok", "operations": operations}
+        
         elif message_type == "sync_operation":
             operation = message.get("operation")
             logger.debug(f"Aplicando operación de sincronización de {source_node}")
@@ -262,74 +694,178 @@ class NetworkManager:
             return {"status": "ok"}
         
         elif message_type == "list_files":
-            files = self.file_manager.list_files()
-            logger.debug(f"Enviando lista de {len(files)} archivos a {source_node}")
-            return {"status": "ok", "files": files}
+            listing = self.file_manager.get_listing(
+                message.get("prefix", ""), message.get("offset", 0), message.get("limit"),
+                message.get("if_epoch"), message.get("if_version")
+            )
+            logger.debug(f"Enviando listado (versión {listing['version']}) a {source_node}")
+            return listing
         
         else:
             logger.warning(f"Tipo de mensaje desconocido: {message_type}")
             return {"status": "error", "message": "Tipo de mensaje desconocido"}
     
-    def _send_heartbeats(self):
-        """Envía mensajes de heartbeat periódicamente a todos los nodos"""
+    async def _probe_members(self):
+        """Sondea un nodo por periodo de protocolo (SWIM): el coste por ronda no crece con el número de nodos"""
+        probes = set()
         while self.running:
-            for node in self.nodes:
-                if node != self.node_name:
-                    message = {
-                        "type": "heartbeat",
-                        "source_node": self.node_name,
-                        "timestamp": time.time()
-                    }
-                    
-                    logger.debug(f"Enviando heartbeat a {node}")
-                    threading.Thread(target=self._send_message, args=(node, message)).start()
-            
-            time.sleep(HEARTBEAT_INTERVAL)
-    
-    def _check_nodes_status(self):
-        """Verifica el estado de los nodos periódicamente"""
-        while self.running:
-            current_time = time.time()
+            target = self.membership.next_probe_target()
+            if target:
+                task = self.loop.create_task(self._probe(target))
+                probes.add(task)
+                task.add_done_callback(probes.discard)
             
-            with self.status_lock:
-                for node, status in self.node_status.items():
-                    if status["alive"] and current_time - status["last_seen"] > NODE_TIMEOUT:
-                        status["alive"] = False
-                        logger.warning(f"Nodo {node} ha dejado de responder")
+            await asyncio.sleep(PROBE_INTERVAL)
+    
+    async def _probe(self, target):
+        """Sondea un nodo directamente y, si no responde, a través de otros nodos"""
+        if await self._ping(target):
+            return
+        
+        helpers = self.membership.indirect_helpers(target, INDIRECT_PROBES)
+        if helpers:
+            acks = await asyncio.gather(*(self._ping_req(helper, target) for helper in helpers))
+            if any(acks):
+                logger.debug(f"Nodo {target} alcanzable solo de forma indirecta")
+                return
+        
+        logger.debug(f"Nodo {target} no respondió al sondeo")
+        self.membership.suspect(target)
+    
+    async def _ping(self, node):
+        """Envía un ping sin reintentos; devuelve True si el nodo respondió a tiempo"""
+        message = {"type": "ping", "source_node": self.node_name}
+        try:
+            response = await self._request(node, message, PROBE_TIMEOUT)
+        except Exception:
+            return False
+        return isinstance(response, dict) and response.get("status") == "ok"
+    
+    async def _ping_req(self, helper, target):
+        """Pide a otro nodo que sondee a `target`; devuelve True si este respondió"""
+        message = {"type": "ping_req", "source_node": self.node_name, "target": target}
+        try:
+            response = await self._request(helper, message, PROBE_TIMEOUT * 2)
+        except Exception:
+            return False
+        return isinstance(response, dict) and response.get("ack") is True
+    
+    async def _handle_ping_req(self, message):
+        """Sondea un nodo en nombre de otro"""
+        self._update_node_seen(message.get("source_node"))
+        target = message.get("target")
+        if self.membership.address(target) is None or target == self.node_name:
+            return {"status": "ok", "ack": target == self.node_name}
+        return {"status": "ok", "ack": await self._ping(target)}
+    
+    async def _join_cluster(self):
+        """Se une al clúster a través de los nodos semilla, reintentando mientras ninguno responda"""
+        own_address = self.membership.address(self.node_name)
+        seeds = [tuple(seed) for seed in SEEDS if tuple(seed) != own_address]
+        if not seeds:
+            logger.info("Sin nodos semilla: este nodo inicia el clúster")
+            return
+        
+        while self.running:
+            random.shuffle(seeds)
+            for seed in seeds:
+                if await self._join_via(seed):
+                    return
             
-            time.sleep(HEARTBEAT_INTERVAL)
+            # Otro nodo pudo habernos encontrado mientras tanto (se unió a través de este)
+            if self.membership.random_members(1):
+                logger.info("Ningún nodo semilla respondió, pero ya hay miembros activos conocidos")
+                return
+            logger.warning(f"Ningún nodo semilla respondió, reintentando en {JOIN_RETRY_INTERVAL} segundos")
+            await asyncio.sleep(JOIN_RETRY_INTERVAL)
+    
+    async def _join_via(self, seed):
+        """Pide unirse al clúster a un nodo semilla y adopta su tabla de miembros"""
+        # La semilla se conoce solo por su dirección: se usa una conexión propia que se cierra al terminar
+        key = f"seed:{seed[0]}:{seed[1]}"
+        message = {"type": "join", "source_node": self.node_name, "member": self.membership.local_entry()}
+        try:
+            response = await self.connection_pool.request(key, seed, message, NETWORK_TIMEOUT)
+        except Exception as e:
+            logger.debug(f"Nodo semilla {seed[0]}:{seed[1]} no disponible: {e}")
+            return False
+        finally:
+            self.connection_pool.close_node(key)
+        
+        if not isinstance(response, dict) or response.get("status") != "ok" or response.get("node") == self.node_name:
+            return False
+        
+        self.membership.merge_table(response.get("members", []))
+        self.membership.apply_updates(response.get("gossip"))
+        logger.info(f"Unido al clúster a través de {response['node']} ({len(response.get('members', []))} miembros)")
+        return True
+    
+    async def _sync_membership(self):
+        """Intercambia periódicamente la tabla de miembros completa con un nodo al azar"""
+        # El gossip difunde cada cambio un número limitado de veces; este intercambio repara lo que se perdió
+        while self.running:
+            await asyncio.sleep(MEMBERSHIP_SYNC_INTERVAL)
+            for node in self.membership.random_members(1):
+                message = {"type": "members", "source_node": self.node_name,
+                           "members": self.membership.table()["members"]}
+                try:
+                    response = await self._request(node, message, NETWORK_TIMEOUT)
+                except Exception as e:
+                    logger.debug(f"No se pudo intercambiar la tabla de miembros con {node}: {e}")
+                    continue
+                if isinstance(response, dict) and response.get("status") == "ok":
+                    self.membership.merge_table(response.get("members", []))
+    
+    async def _announce_leave(self):
+        """Anuncia la salida de este nodo a algunos miembros; el gossip la difunde al resto"""
+        self.membership.leave()
+        message = {"type": "leave", "source_node": self.node_name, "member": self.membership.local_entry()}
+        nodes = self.membership.random_members(INDIRECT_PROBES)
+        await asyncio.gather(*(self._request(node, message, PROBE_TIMEOUT) for node in nodes),
+                             return_exceptions=True)
+    
+    async def _check_nodes_status(self):
+        """Confirma como caídos los nodos que siguen sospechosos tras el plazo de sospecha"""
+        while self.running:
+            self.membership.expire_suspects()
+            await asyncio.sleep(PROBE_INTERVAL)
     
     def send_file(self, filename, target_node, is_offline=False):
         """Envía un archivo a otro nodo"""
         try:
-            # Obtener datos del archivo
-            file_data = self.file_manager.get_file_data(filename)
-            if not file_data:
-                return False
-            
             # Si es una operación offline, guardar localmente y agregar a la cola
             if is_offline:
-                self.file_manager.save_file(filename, file_data, is_offline=True)
+                file_path = self.file_manager.get_file_path(filename)
+                if not file_path or not self.file_manager.offline_manager:
+                    return False
+                self.file_manager.offline_manager.add_to_offline_queue("save", filename, path=file_path,
+                                                                      target_node=target_node)
                 return True
             
-            # Verificar tamaño del archivo
-            file_size = len(base64.b64decode(file_data))
-            if file_size > MAX_DIRECT_TRANSFER_SIZE:
-                logger.warning(f"Archivo {filename} demasiado grande para transferencia directa")
+            if not self.file_manager.get_file_path(filename):
                 return False
             
-            # Enviar archivo a través de la red
-            message = {
-                "type": "transfer_file",
-                "source_node": self.node_name,
-                "target_node": target_node,
-                "filename": filename,
-                "file_data": file_data,
-                "timestamp": time.time()
-            }
+            version, sha256 = self.get_file_version(filename)
             
-            response = self._send_message(target_node, message)
+            # Una sola marca por transferencia, la misma con que el destino la registra, sea cual sea el camino
+            stamp = self._new_stamp(version=version, sha256=sha256)
+            
+            # Con almacén de chunks, enviar solo los chunks que el destino no tiene
+            response = self._run_coroutine(self._send_file_chunks(target_node, filename, stamp))
+            
+            # Si el destino ya tiene una versión del archivo, enviar solo las diferencias
+            if not response or response.get("status") != "ok":
+                response = self._run_coroutine(self._send_file_delta(target_node, filename, stamp))
+            
+            # Si no, enviar el archivo completo a través de la red sin cargarlo en memoria
+            if not response or response.get("status") != "ok":
+                response = self._run_coroutine(self._send_file_stream(target_node, filename, stamp))
             if response and response.get("status") == "ok":
+                # Registrar la transferencia con el mismo operation_id que el destino
+                self.operation_log.add_operation(
+                    "transfer", self.node_name, target_node=target_node, filename=filename,
+                    timestamp=stamp["timestamp"], hlc=stamp["hlc"], version=version, sha256=sha256, sync=False
+                )
                 # Marcar archivo como sincronizado
                 if hasattr(self.file_manager, 'offline_manager'):
                     self.file_manager.offline_manager.mark_as_synced(filename)
@@ -339,55 +875,396 @@ class NetworkManager:
             logger.error(f"Error al enviar archivo: {e}")
             return False
     
+    def _new_stamp(self, **fields):
+        """Marca, identificador y timestamp de una operación de este nodo que se envía a otros"""
+        hlc = self.operation_log.clock.now()
+        return dict(fields, hlc=hlc, operation_id=make_operation_id(hlc, self.node_name), timestamp=time.time())
+    
+    def get_file_version(self, filename):
+        """Vector de versiones y sha256 de la copia local; un cambio hecho fuera del sistema se registra antes como escritura de este nodo"""
+        version, sha256 = self.operation_log.get_file_version(filename)
+        info = self.file_manager.get_file_info(filename)
+        if info and info["sha256"] != sha256:
+            operation = self.operation_log.add_operation(
+                "write", self.node_name, filename=filename, sha256=info["sha256"], sync=False
+            )
+            version, sha256 = operation["version"], info["sha256"]
+        return version, sha256
+    
+    async def _send_file_stream(self, node, filename, stamp):
+        """Envía un archivo completo como cabecera JSON seguida de sus bytes en crudo"""
+        file_path = self.file_manager.get_file_path(filename)
+        if not file_path:
+            return None
+        
+        header = {
+            "type": "transfer_file_stream",
+            "source_node": self.node_name,
+            "target_node": node,
+            "filename": filename,
+            **stamp
+        }
+        return await self._send_stream(node, header, [file_path])
+    
+    async def _send_file_chunks(self, node, filename, stamp):
+        """Negocia con el destino qué chunks le faltan y envía solo esos"""
+        if not self.file_manager.chunk_store:
+            return None
+        
+        manifest = await self.loop.run_in_executor(self.executor, self.file_manager.get_manifest, filename)
+        if not manifest:
+            return None
+        
+        try:
+            address = self.membership.address(node)
+            message = {
+                "type": "chunk_query",
+                "source_node": self.node_name,
+                "chunks": [chunk for chunk, _ in manifest["chunks"]]
+            }
+            response = await self.connection_pool.request(node, address, message, NETWORK_TIMEOUT)
+        except Exception as e:
+            logger.debug(f"No se pudo negociar chunks de {filename} con {node}: {e}")
+            return None
+        
+        if not isinstance(response, dict) or response.get("status") != "ok":
+            return None
+        
+        missing = set(response.get("missing", []))
+        sizes = dict((chunk, size) for chunk, size in manifest["chunks"])
+        missing_chunks = [[chunk, sizes[chunk]] for chunk in dict.fromkeys(sizes) if chunk in missing]
+        
+        header = {
+            "type": "transfer_chunks_stream",
+            "source_node": self.node_name,
+            "target_node": node,
+            "filename": filename,
+            "file_size": manifest["size"],
+            "chunks": manifest["chunks"],
+            "missing": missing_chunks,
+            **stamp
+        }
+        logger.info(f"Enviando {len(missing_chunks)} de {len(sizes)} chunks de {filename} a {node}")
+        return await self._send_stream(node, header, self.file_manager.get_chunk_paths(missing_chunks))
+    
+    async def _send_file_delta(self, node, filename, stamp):
+        """Envía solo los bloques que difieren de la copia que ya tiene el destino"""
+        file_path = self.file_manager.get_file_path(filename)
+        if not file_path:
+            return None
+        
+        file_size = os.path.getsize(file_path)
+        if file_size < DELTA_MIN_FILE_SIZE:
+            return None
+        
+        # Pedir al destino las firmas de los bloques de su copia
+        try:
+            address = self.membership.address(node)
+            message = {
+                "type": "get_signatures",
+                "source_node": self.node_name,
+                "filename": filename,
+                "block_size": DELTA_BLOCK_SIZE
+            }
+            response = await self.connection_pool.request(node, address, message, NETWORK_TIMEOUT)
+        except Exception as e:
+            logger.debug(f"No se pudieron obtener firmas de {filename} en {node}: {e}")
+            return None
+        
+        if not isinstance(response, dict) or response.get("status") != "ok" or not response.get("signatures"):
+            return None
+        
+        block_size = response["block_size"]
+        # El delta se abandona en cuanto sus bytes literales pasan del límite, sin recorrer el resto del archivo
+        created = await self.loop.run_in_executor(
+            self.executor, self.file_manager.create_delta, filename, response["signatures"], block_size,
+            int(file_size * DELTA_MAX_RATIO)
+        )
+        if created is None:
+            logger.debug(f"{filename} cambió demasiado respecto a la copia de {node}, se envía completo")
+            return None
+        
+        delta_path, sha256 = created
+        try:
+            delta_size = os.path.getsize(delta_path)
+            if delta_size >= file_size * DELTA_MAX_RATIO:
+                logger.debug(f"Delta de {filename} demasiado grande ({delta_size} bytes), se envía completo")
+                return None
+            
+            header = {
+                "type": "transfer_delta_stream",
+                "source_node": self.node_name,
+                "target_node": node,
+                "filename": filename,
+                "block_size": block_size,
+                "file_size": file_size,
+                **stamp,
+                "sha256": sha256
+            }
+            logger.info(f"Enviando delta de {filename} a {node} ({delta_size} de {file_size} bytes)")
+            return await self._send_stream(node, header, [delta_path])
+        finally:
+            os.remove(delta_path)
+    
+    async def _send_stream(self, node, header, file_paths, retry_count=0):
+        """Envía una cabecera JSON seguida del contenido de uno o más archivos por una conexión dedicada"""
+        writer = None
+        filename = header.get("filename")
+        try:
+            address = self.membership.address(node)
+            
+            # Conexión dedicada: los bytes en crudo no pueden multiplexarse con otras peticiones
+            reader, writer = await asyncio.wait_for(asyncio.open_connection(*address), NETWORK_TIMEOUT)
+            
+            sizes = [os.path.getsize(path) for path in file_paths]
+            
+            # Comprimir solo si el destino acordó un códec en el pool y una muestra indica que vale la pena
+            codec = None
+            if file_paths:
+                codec = await self.loop.run_in_executor(
+                    self.executor, self._stream_codec, self.connection_pool.codec(node), filename, file_paths[0]
+                )
+            header = dict(header, size=sum(sizes), encoding=codec)
+            
+            logger.info(f"Enviando {header['type']} de {filename} ({header['size']} bytes) a {node} (compresión: {codec})")
+            await write_frame(writer, header)
+            
+            for path, size in zip(file_paths, sizes):
+                with open(path, 'rb') as f:
+                    if codec:
+                        await self._write_blocks(writer, f, 0, size, codec)
+                        continue
+                    # sendfile usa copia cero (os.sendfile) cuando el sistema lo permite
+                    sent = await self.loop.sendfile(writer.transport, f, count=size)
+                if sent != size:
+                    raise IOError(f"{path} cambió durante el envío")
+            
+            response = await asyncio.wait_for(read_frame(reader), NETWORK_TIMEOUT)
+            logger.debug(f"Respuesta recibida de {node}: {response}")
+            return response
+        except asyncio.TimeoutError:
+            logger.error(f"Timeout al enviar archivo {filename} a {node}")
+        except ConnectionRefusedError:
+            logger.error(f"Conexión rechazada por {node}")
+        except Exception as e:
+            logger.error(f"Error al enviar archivo {filename} a {node}: {e}")
+        finally:
+            if writer:
+                writer.close()
+        
+        if retry_count < MAX_RETRIES and self.running:
+            logger.info(f"Reintentando envío de {filename} a {node} (intento {retry_count + 1})")
+            await asyncio.sleep(1)
+            return await self._send_stream(node, header, file_paths, retry_count + 1)
+        return None
+    
+    def open_file(self, filename, nodes, offset=0, length=None):
+        """Abre la lectura de un archivo en la réplica más rápida de `nodes`; devuelve (nodo, cabecera, iterador de bloques) o None"""
+        opened = self._run_coroutine(self._open_hedged(filename, self.rank_replicas(nodes), offset, length))
+        if not opened:
+            return None
+        node, (header, reader, writer) = opened
+        return node, header, self._iter_stream(reader, writer, header["length"], header.get("encoding"))
+    
+    def fetch_file(self, filename, nodes, sha256=None):
+        """Descarga un archivo completo de la réplica más rápida de `nodes` y lo guarda localmente; con `sha256`, solo si es ese contenido"""
+        if not self.file_manager.is_valid_name(filename):
+            logger.warning(f"No se descarga {filename!r}: nombre de archivo no válido")
+            return False
+        
+        opened = self._run_coroutine(self._open_hedged(filename, self.rank_replicas(nodes), 0, None))
+        if not opened:
+            return False
+        node, (header, reader, writer) = opened
+        
+        if sha256 and header.get("sha256") != sha256:
+            # El nodo ya tiene otro contenido: registrarlo con la versión pedida falsearía la copia local
+            self.loop.call_soon_threadsafe(writer.close)
+            logger.info(f"{node} ya no tiene la versión esperada de {filename}; se aplicará con la operación que la reemplazó")
+            return False
+        chunks = self._iter_stream(reader, writer, header["length"], header.get("encoding"))
+        
+        temp_file, temp_path = self.file_manager.create_temp_file(filename)
+        try:
+            digest = hashlib.sha256()
+            with temp_file:
+                for chunk in chunks:
+                    digest.update(chunk)
+                    temp_file.write(chunk)
+            if digest.hexdigest() != header.get("sha256"):
+                raise ValueError(f"El archivo {filename} recibido de {node} no coincide con el original")
+            self.file_manager.commit_temp_file(temp_path, filename)
+            logger.info(f"Archivo {filename} descargado de {node}")
+            return True
+        except Exception as e:
+            self.file_manager.discard_temp_file(temp_path)
+            logger.error(f"Error al descargar {filename} de {node}: {e}")
+            return False
+    
+    async def _open_hedged(self, filename, nodes, offset, length):
+        """Pide el archivo a la réplica más rápida y, si tarda, también a la siguiente; gana la primera que responde"""
+        candidates = list(nodes)
+        tasks = {}
+        try:
+            while candidates or tasks:
+                delay = None
+                if candidates:
+                    node = candidates.pop(0)
+                    tasks[self.loop.create_task(self._open_file_stream(node, filename, offset, length))] = node
+                    delay = max(HEDGE_MIN_DELAY, self.latency.get(node, PROBE_TIMEOUT) * HEDGE_DELAY_FACTOR)
+                
+                # Sin respuesta dentro del plazo, la siguiente vuelta lanza una petición de cobertura
+                done, _ = await asyncio.wait(tasks, timeout=delay, return_when=asyncio.FIRST_COMPLETED)
+                for task in done:
+                    node = tasks.pop(task)
+                    if task.exception():
+                        logger.debug(f"No se pudo leer {filename} de {node}: {task.exception()}")
+                    elif task.result():
+                        return node, task.result()
+            return None
+        finally:
+            # Descartar las peticiones perdedoras, incluidas las que respondan después
+            for task in tasks:
+                task.cancel()
+                task.add_done_callback(_close_file_stream)
+    
+    async def _open_file_stream(self, node, filename, offset, length):
+        """Abre una conexión dedicada y pide un rango de un archivo; devuelve (cabecera, reader, writer) o None"""
+        address = self.membership.address(node)
+        start = time.monotonic()
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(*address), NETWORK_TIMEOUT)
+        try:
+            await write_frame(writer, {
+                "type": "get_file",
+                "source_node": self.node_name,
+                "filename": filename,
+                "offset": offset,
+                "length": length,
+                "codecs": compressor.available_codecs()
+            })
+            header = await asyncio.wait_for(read_frame(reader), NETWORK_TIMEOUT)
+        except BaseException:
+            writer.close()
+            raise
+        
+        self._record_latency(node, time.monotonic() - start)
+        self.membership.record_alive(node)
+        if isinstance(header, dict):
+            self.membership.apply_updates(header.pop("gossip", None))
+        if not isinstance(header, dict) or header.get("status") != "ok":
+            writer.close()
+            return None
+        return header, reader, writer
+    
+    def _iter_stream(self, reader, writer, length, encoding=None):
+        """Entrega en bloques los bytes de una lectura remota (llamada bloqueante desde otros threads)"""
+        try:
+            remaining = length
+            while remaining > 0:
+                if encoding:
+                    # La descompresión corre en el thread que lee, no en el event loop
+                    block = self._run_coroutine(asyncio.wait_for(read_raw_block(reader), NETWORK_TIMEOUT))
+                    chunk = compressor.decompress(*block) if block else b''
+                else:
+                    chunk = self._run_coroutine(
+                        asyncio.wait_for(reader.read(min(remaining, STREAM_CHUNK_SIZE)), NETWORK_TIMEOUT)
+                    )
+                if not chunk:
+                    raise ConnectionError("Lectura remota interrumpida")
+                remaining -= len(chunk)
+                yield chunk
+        finally:
+            self.loop.call_soon_threadsafe(writer.close)
+    
     def delete_file(self, filename, is_offline=False):
-        """Elimina un archivo del sistema"""
+        """Elimina un archivo del sistema; devuelve el resultado por nodo, o False si falla localmente"""
         try:
             # Si es una operación offline, eliminar localmente y agregar a la cola
             if is_offline:
                 return self.file_manager.delete_file(filename, self.node_name, is_offline=True)
             
+            # La eliminación debe suceder a la versión del contenido que se borra
+            if os.path.isfile(os.path.join(self.file_manager.shared_dir, filename)):
+                self.get_file_version(filename)
+            
             # Eliminar archivo localmente
-            success = self.file_manager.delete_file(filename, self.node_name)
+            success = self.file_manager.delete_file(filename, self.node_name, log_operation=False)
             if not success:
                 return False
+            operation = self.operation_log.add_operation("delete", self.node_name, filename=filename)
             
-            # Notificar a otros nodos
+            # Notificar a otros nodos con la marca de la eliminación registrada: la registran con el mismo operation_id
             message = {
                 "type": "delete_file",
                 "source_node": self.node_name,
                 "filename": filename,
-                "timestamp": time.time()
+                "operation_id": operation["operation_id"],
+                "version": operation["version"],
+                "hlc": operation["hlc"],
+                "timestamp": operation["timestamp"]
             }
             
-            for node in self.nodes:
-                if node != self.node_name:
-                    try:
-                        self._send_message(node, message)
-                    except:
-                        pass  # Ignorar errores de nodos no disponibles
+            results = self.broadcast(message, quorum=DELETE_QUORUM)
+            for node, result in results.items():
+                logger.info(f"Eliminación de {filename} en {node}: {result}")
             
-            return True
+            results[self.node_name] = "ok"
+            return results
         except Exception as e:
             print(f"Error al eliminar archivo: {e}")
             return False
     
-    def get_node_status(self):
-        """Obtiene el estado de conexión de todos los nodos"""
-        with self.status_lock:
-            status = {node: info["alive"] for node, info in self.node_status.items()}
-            status[self.node_name] = True  # Este nodo siempre está activo
+    def get_known_nodes(self):
+        """Nodos conocidos por la pertenencia, incluidos los caídos y los que dejaron el clúster"""
+        return self.membership.known_nodes()
+    
+    def get_node_status(self, detailed=False):
+        """Obtiene el estado de conexión de todos los nodos (con detailed, también estado SWIM y nivel phi)"""
+        if detailed:
+            status = self.membership.detailed_status()
+            for node, node_status in status.items():
+                node_status["latency"] = self.latency.get(node)
+            status[self.node_name] = {
+                "alive": True, "state": "alive", "incarnation": self.membership.incarnation,
+                "phi": 0.0, "last_seen": time.time(), "address": dict(self.membership.local_address)
+            }
             return status
+        
+        status = self.membership.status()
+        status[self.node_name] = True  # Este nodo siempre está activo
+        return status
     
     def stop(self):
         """Detiene todos los servicios del nodo"""
+        if not self.running:
+            return
         logger.info("Deteniendo NetworkManager...")
         self.running = False
         
-        # Limpiar todas las conexiones activas
-        for sock in list(self.active_connections):
-            self._cleanup_connection(sock)
+        if self.loop.is_running():
+            try:
+                asyncio.run_coroutine_threadsafe(self._shutdown(), self.loop).result(NETWORK_TIMEOUT)
+            except Exception as e:
+                logger.error(f"Error al detener el event loop de red: {e}")
+            self.loop.call_soon_threadsafe(self.loop.stop)
+        
+        self.executor.shutdown(wait=False)
+        logger.info("NetworkManager detenido")
+    
+    async def _shutdown(self):
+        """Cierra el servidor y todas las conexiones desde el event loop"""
+        try:
+            await self._announce_leave()
+        except Exception as e:
+            logger.error(f"Error al anunciar la salida del clúster: {e}")
         
-        if self.server_socket:
-            self._cleanup_connection(self.server_socket)
+        # Cerrar conexiones persistentes salientes
+        self.connection_pool.close_all()
+        
+        # Limpiar todas las conexiones activas
+        for writer in list(self.active_connections):
+            writer.close()
         
-        logger.info("NetworkManager detenido")
\ No newline at end of file
+        if self.server:
+            self.server.close()
+            await self.server.wait_closed()
@@ -5,7 +5,9 @@ from operation_log import OperationLog
 from network import NetworkManager
 from sync import SyncManager
 from offline_manager import OfflineManager
-from config import NODE_NAME
+from listing_cache import RemoteListingCache
+from replication import ReplicationManager
+from config import NODE_NAME, REMOTE_LISTING_TTL, REMOTE_LISTING_STALE, REPLICATION_FACTOR, RING_VNODES, MIGRATION_RATE, REBALANCE_DELAY
 
 class Node:
     
@@ -20,9 +22,27 @@ class Node:
         self.network_manager = NetworkManager(self.file_manager, self.operation_log, self.sync_manager)
         
         # Establecer referencias circulares
-        self.sync_manager.set_network_manager(self.network_manager)
+        self.sync_manager.set_network_manager(self.network_manager, self.get_file_owners)
         self.file_manager.set_offline_manager(self.offline_manager)
         
+        # Ubicación de los archivos en réplicas según un anillo de hashing consistente
+        self.replication_manager = None
+        if REPLICATION_FACTOR > 0:
+            self.replication_manager = ReplicationManager(
+                self.node_name, self.file_manager, self.network_manager, REPLICATION_FACTOR,
+                RING_VNODES, MIGRATION_RATE, REBALANCE_DELAY
+            )
+        
+        # Las lápidas del log se conservan hasta que las aplican todos los nodos conocidos
+        self._update_log_peers(self.network_manager.get_node_status())
+        self.network_manager.add_status_listener(self._update_log_peers)
+        
+        # La cola offline se reenvía a las réplicas de cada archivo al reconectarse
+        self.offline_manager.set_network_manager(self.network_manager, self.get_file_owners)
+        
+        # Listados de otros nodos en caché, revalidados con consultas condicionales por versión
+        self.remote_listings = RemoteListingCache(self._fetch_listing, REMOTE_LISTING_TTL, REMOTE_LISTING_STALE)
+        
         # Iniciar sincronización periódica
         self.sync_thread = threading.Thread(target=self._periodic_sync)
         self.sync_thread.daemon = True
@@ -38,6 +58,13 @@ class Node:
         # Iniciar sincronización periódica
         self.sync_thread.start()
         
+        # Iniciar el reenvío de la cola offline
+        self.offline_manager.start()
+        
+        # Iniciar la migración de réplicas
+        if self.replication_manager:
+            self.replication_manager.start()
+        
         print(f"Nodo {self.node_name} iniciado correctamente")
     
     def _periodic_sync(self):
@@ -47,17 +74,14 @@ class Node:
                 # Esperar un tiempo antes de sincronizar
                 time.sleep(30)  # Sincronizar cada 30 segundos
                 
-                # Procesar cola offline
-                self.offline_manager.process_offline_queue()
-                
                 # Iniciar sincronización
                 self.sync_manager.start_sync()
             except Exception as e:
                 print(f"Error durante la sincronización periódica: {e}")
     
-    def list_files(self):
+    def list_files(self, prefix='', offset=0, limit=None):
         """Lista los archivos en el sistema"""
-        return self.file_manager.list_files()
+        return self.file_manager.list_files(prefix, offset, limit)
     
     def transfer_file(self, filename, target_node, is_offline=False):
         """Transfiere un archivo a otro nodo"""
@@ -67,29 +91,98 @@ class Node:
         """Elimina un archivo del sistema"""
         return self.network_manager.delete_file(filename, is_offline=is_offline)
     
-    def get_node_status(self):
+    def open_file(self, filename, offset=0, length=None):
+        """Abre un archivo para leerlo: la copia local si existe o, si no, la réplica más rápida; devuelve (cabecera, iterador de bloques) o None"""
+        if not self.file_manager.is_valid_name(filename):
+            return None
+        
+        local = self.file_manager.read_range(filename, offset, length)
+        if local:
+            return local
+        
+        # Primero las réplicas según el anillo; luego el resto de los nodos (copias aún sin migrar)
+        owners = self.get_file_owners(filename)
+        others = [node for node in self.get_node_status() if node not in owners]
+        for nodes in (owners, others):
+            opened = self.network_manager.open_file(filename, nodes, offset, length)
+            if opened:
+                return opened[1], opened[2]
+        return None
+    
+    def get_file_info(self, filename):
+        """Tamaño, fecha de modificación y sha256 de un archivo local o de la réplica más rápida, sin leer su contenido"""
+        opened = self.open_file(filename, 0, 0)
+        if opened is None:
+            return None
+        
+        header, chunks = opened
+        # Consumir el iterador vacío libera la conexión de una lectura remota
+        for _ in chunks:
+            pass
+        return header
+    
+    def upload_file(self, filename, stream, size=None):
+        """Guarda un archivo subido por la web y registra la escritura de este nodo"""
+        if not self.file_manager.is_valid_name(filename):
+            raise ValueError(f"Nombre de archivo no válido: {filename}")
+        
+        info = self.file_manager.save_stream(filename, stream, size)
+        self.operation_log.add_operation("write", self.node_name, filename=filename, sha256=info['sha256'])
+        return info
+    
+    def get_offline_progress(self):
+        """Progreso del reenvío de la cola offline"""
+        return self.offline_manager.get_replay_progress()
+    
+    def get_file_owners(self, filename):
+        """Nodos que deben guardar un archivo según el anillo de réplicas"""
+        if not self.replication_manager:
+            return []
+        return self.replication_manager.owners(filename)
+    
+    def _update_log_peers(self, status):
+        """Actualiza los nodos cuyos cursores retienen las lápidas del log"""
+        # También los caídos y los retirados: al volver deben aplicar las eliminaciones que se perdieron
+        self.operation_log.set_peers(self.network_manager.get_known_nodes())
+    
+    def get_conflicts(self):
+        """Escrituras concurrentes detectadas en la sincronización, por archivo"""
+        return self.operation_log.get_conflicts()
+    
+    def resolve_conflict(self, filename, keep):
+        """Resuelve los conflictos de un archivo conservando la copia local o la remota"""
+        return self.sync_manager.resolve_conflict(filename, keep)
+    
+    def add_file_listener(self, callback):
+        """Registra una función que recibe los cambios de los archivos locales"""
+        self.file_manager.index.add_listener(callback)
+    
+    def add_status_listener(self, callback):
+        """Registra una función que recibe el estado de los nodos cuando alguno cambia"""
+        self.network_manager.add_status_listener(callback)
+    
+    def get_node_status(self, detailed=False):
         """Obtiene el estado de conexión de todos los nodos"""
-        status = self.network_manager.get_node_status()
-        status[self.node_name] = True  # Este nodo siempre está activo
-        return status
+        return self.network_manager.get_node_status(detailed=detailed)
     
     def stop(self):
         """Detiene todos los servicios del nodo"""
         self.running = False
+        self.offline_manager.stop()
+        if self.replication_manager:
+            self.replication_manager.stop()
+        self.file_manager.index.stop()
         self.network_manager.stop()
         print(f"Nodo {self.node_name} detenido")
 
-    def get_remote_files(self, target_node):
+    def get_remote_files(self, target_node, prefix='', offset=0, limit=None):
         """Obtiene la lista de archivos de un nodo remoto"""
         try:
-            message = {
-                "type": "list_files",
-                "source_node": self.node_name,
-                "timestamp": time.time()
-            }
-            
-            response = self.network_manager._send_message(target_node, message)
+            # Los listados completos se sirven desde la caché; los parciales se consultan directamente
+            if not prefix and not offset and limit is None:
+                return self.remote_listings.get(target_node)
             
+            response = self._fetch_listing(target_node, prefix=prefix, offset=offset, limit=limit)
             if isinstance(response, dict) and response.get("status") == "ok":
                 return response.get("files", [])
             return None
@@ -97,4 +190,25 @@ class Node:
             print(f"Error al obtener archivos remotos: {e}")
             return None
     
-    
\ No newline at end of file
+    def refresh_remote_files(self, target_node):
+        """Revalida el listado en caché de un nodo remoto y lo devuelve"""
+        try:
+            return self.remote_listings.refresh(target_node)
+        except Exception as e:
+            print(f"Error al obtener archivos remotos: {e}")
+            return None
+    
+    def _fetch_listing(self, target_node, if_epoch=None, if_version=None, prefix='', offset=0, limit=None):
+        """Solicita el listado de archivos a un nodo remoto"""
+        message = {
+            "type": "list_files",
+            "source_node": self.node_name,
+            "timestamp": time.time(),
+            "prefix": prefix,
+            "offset": offset,
+            "limit": limit,
+            "if_epoch": if_epoch,
+            "if_version": if_version
+        }
+        
+        return self.network_manager._send_message(target_node, message)
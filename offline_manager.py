@@ -1,100 +1,415 @@
 import json
 import os
 import time
+import base64
+import hashlib
+import shutil
+import tempfile
 import threading
-from datetime import datetime
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from throttle import TokenBucket
+from operation_log import order_key
+from hlc import from_timestamp
+from config import OFFLINE_QUEUE_DIR, OFFLINE_SEGMENT_MAX_RECORDS, OFFLINE_REPLAY_WORKERS, OFFLINE_REPLAY_RATE, OFFLINE_REPLAY_INTERVAL
+
+logger = logging.getLogger('sistema.offline')
 
 class OfflineManager:
     def __init__(self, file_manager, operation_log):
         self.file_manager = file_manager
         self.operation_log = operation_log
         self.lock = threading.Lock()
-        self.offline_queue = []
+        self.offline_queue = {}  # nombre de archivo -> última operación pendiente (las anteriores se descartan)
         self.sync_status = {}  # Estado de sincronización de cada archivo
+        
+        # La cola se guarda en segmentos de solo agregado; el contenido de los archivos, aparte y por hash
+        self.queue_dir = OFFLINE_QUEUE_DIR
+        self.segments_dir = os.path.join(self.queue_dir, "segments")
+        self.blobs_dir = os.path.join(self.queue_dir, "blobs")
+        os.makedirs(self.segments_dir, exist_ok=True)
+        os.makedirs(self.blobs_dir, exist_ok=True)
+        self.segment = None
+        self.segment_records = 0
+        
+        # Archivos de versiones anteriores (cola y estado completos en JSON)
         self.offline_queue_file = "offline_queue.json"
         self.sync_status_file = "sync_status.json"
         
+        # Reenvío de la cola a los demás nodos al reconectarse, con concurrencia y caudal acotados
+        self.network_manager = None
+        self.locate = None  # locate(nombre) -> nodos que deben guardar el archivo
+        self.replay_event = threading.Event()
+        self.replay_bucket = TokenBucket(OFFLINE_REPLAY_RATE)
+        self.replay_executor = ThreadPoolExecutor(max_workers=OFFLINE_REPLAY_WORKERS)
+        self.replay_thread = threading.Thread(target=self._replay_loop)
+        self.replay_thread.daemon = True
+        self.running = True
+        self.known_alive = set()
+        self.progress = {"running": False, "total": 0, "completed": 0, "failed": 0,
+                         "bytes_total": 0, "bytes_sent": 0, "started_at": None, "finished_at": None}
+        
         # Cargar estado guardado
         self.load_state()
     
+    def set_network_manager(self, network_manager, locate=None):
+        """Establece el manager de red (y cómo ubicar las réplicas) para reenviar la cola"""
+        self.network_manager = network_manager
+        self.locate = locate
+        network_manager.add_status_listener(self._on_status_change)
+    
+    def start(self):
+        """Inicia el reenvío de la cola en segundo plano"""
+        self.replay_thread.start()
+        self.replay_event.set()
+    
+    def stop(self):
+        """Detiene el reenvío de la cola"""
+        self.running = False
+        self.replay_event.set()
+        self.replay_executor.shutdown(wait=False)
+    
+    def _on_status_change(self, status):
+        """Lanza el reenvío cuando un nodo vuelve a estar activo (o este nodo recupera la conexión)"""
+        alive = {node for node, active in status.items() if active and node != self.network_manager.node_name}
+        recovered = alive - self.known_alive
+        self.known_alive = alive
+        if recovered and self.offline_queue:
+            logger.info(f"Nodos disponibles de nuevo: {sorted(recovered)}, reenviando la cola offline")
+            self.replay_event.set()
+    
+    def _replay_loop(self):
+        """Reenvía la cola al reconectarse y, por si algo falló, cada OFFLINE_REPLAY_INTERVAL segundos"""
+        while self.running:
+            self.replay_event.wait(OFFLINE_REPLAY_INTERVAL)
+            self.replay_event.clear()
+            if not self.running:
+                return
+            try:
+                self.process_offline_queue()
+            except Exception as e:
+                logger.error(f"Error al reenviar la cola offline: {e}")
+    
     def load_state(self):
-        """Carga el estado guardado de la cola offline y estado de sincronización"""
+        """Reconstruye la cola offline y el estado de sincronización a partir de los segmentos"""
+        for name in self._segment_names():
+            with open(os.path.join(self.segments_dir, name), 'r') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except json.JSONDecodeError:
+                        # Registro incompleto por una caída a mitad de escritura
+                        continue
+                    self._apply_record(record)
+        
+        self._import_legacy_state()
+        
+        # Empezar con un segmento compacto que contiene solo lo vigente
+        self._compact()
+    
+    def _import_legacy_state(self):
+        """Incorpora la cola y el estado guardados en JSON por versiones anteriores"""
         if os.path.exists(self.offline_queue_file):
             try:
                 with open(self.offline_queue_file, 'r') as f:
-                    self.offline_queue = json.load(f)
+                    for operation in json.load(f):
+                        data = operation.pop("data", None)
+                        if data is not None:
+                            operation["blob"], operation["size"] = self._store_blob(data=base64.b64decode(data))
+                        self._apply_record({"op": "put", "operation": operation})
             except json.JSONDecodeError:
-                self.offline_queue = []
+                pass
         
         if os.path.exists(self.sync_status_file):
             try:
                 with open(self.sync_status_file, 'r') as f:
-                    self.sync_status = json.load(f)
+                    for filename, status in json.load(f).items():
+                        self.sync_status.setdefault(filename, status)
             except json.JSONDecodeError:
-                self.sync_status = {}
-    
-    def save_state(self):
-        """Guarda el estado actual de la cola offline y estado de sincronización"""
-        with open(self.offline_queue_file, 'w') as f:
-            json.dump(self.offline_queue, f, indent=2)
-        
-        with open(self.sync_status_file, 'w') as f:
-            json.dump(self.sync_status, f, indent=2)
-    
-    def add_to_offline_queue(self, operation_type, filename, data=None):
-        """Agrega una operación a la cola offline"""
-        operation = {
-            "type": operation_type,
-            "filename": filename,
-            "timestamp": time.time(),
-            "operation_id": f"{operation_type}_{filename}_{time.time()}",
-            "data": data
-        }
-        
-        with self.lock:
-            self.offline_queue.append(operation)
-            self.sync_status[filename] = {
+                pass
+    
+    def _segment_names(self):
+        """Segmentos existentes en orden de creación"""
+        return sorted(name for name in os.listdir(self.segments_dir) if name.endswith(".jsonl"))
+    
+    def _apply_record(self, record):
+        """Aplica un registro de un segmento al estado en memoria"""
+        if record.get("op") == "put":
+            operation = record["operation"]
+            self.offline_queue.pop(operation["filename"], None)
+            self.offline_queue[operation["filename"]] = operation
+            self.sync_status[operation["filename"]] = {
                 "synced": False,
-                "last_modified": time.time(),
+                "last_modified": operation["timestamp"],
                 "pending_operations": True
             }
-            self.save_state()
+        elif record.get("op") == "done":
+            current = self.offline_queue.get(record["filename"])
+            if current and current["operation_id"] == record["operation_id"]:
+                del self.offline_queue[record["filename"]]
+        elif record.get("op") == "synced":
+            self.sync_status[record["filename"]] = {
+                "synced": True,
+                "last_modified": record["timestamp"],
+                "pending_operations": False
+            }
+    
+    def _append(self, record):
+        """Agrega un registro al segmento actual y lo lleva a disco; debe llamarse con el lock tomado"""
+        self._apply_record(record)
+        self.segment.write(json.dumps(record, separators=(',', ':')) + "\n")
+        self.segment.flush()
+        os.fsync(self.segment.fileno())
+        self.segment_records += 1
+        
+        if self.segment_records >= OFFLINE_SEGMENT_MAX_RECORDS:
+            self._compact()
+    
+    def _compact(self):
+        """Escribe un segmento nuevo con solo las operaciones vigentes y borra los anteriores; debe llamarse con el lock tomado"""
+        previous = self._segment_names()
+        if self.segment:
+            self.segment.close()
+        
+        name = f"{time.time_ns():020d}.jsonl"
+        self.segment = open(os.path.join(self.segments_dir, name), 'a')
+        self.segment_records = 0
+        for operation in self.offline_queue.values():
+            self.segment.write(json.dumps({"op": "put", "operation": operation}, separators=(',', ':')) + "\n")
+        for filename, status in self.sync_status.items():
+            if status["synced"]:
+                self.segment.write(json.dumps({"op": "synced", "filename": filename,
+                                               "timestamp": status["last_modified"]}, separators=(',', ':')) + "\n")
+        self.segment.flush()
+        os.fsync(self.segment.fileno())
+        
+        # El segmento nuevo ya contiene todo lo vigente: los anteriores y los datos sin referencias sobran
+        for old in previous:
+            if old != name:
+                os.remove(os.path.join(self.segments_dir, old))
+        for path in (self.offline_queue_file, self.sync_status_file):
+            if os.path.exists(path):
+                os.remove(path)
+        self._remove_unreferenced_blobs()
+    
+    def _store_blob(self, data=None, path=None):
+        """Guarda un contenido en el spool por su sha256 (una sola copia por contenido); devuelve (hash, tamaño)"""
+        fd, temp_path = tempfile.mkstemp(dir=self.blobs_dir, prefix=".tmp_")
+        digest = hashlib.sha256()
+        size = 0
+        try:
+            with os.fdopen(fd, 'wb') as out:
+                if data is not None:
+                    out.write(data)
+                    digest.update(data)
+                    size = len(data)
+                else:
+                    with open(path, 'rb') as f:
+                        for block in iter(lambda: f.read(1024 * 1024), b''):
+                            out.write(block)
+                            digest.update(block)
+                            size += len(block)
+                out.flush()
+                os.fsync(out.fileno())
+            blob = digest.hexdigest()
+            os.replace(temp_path, os.path.join(self.blobs_dir, blob))
+            return blob, size
+        except Exception:
+            os.remove(temp_path)
+            raise
+    
+    def _remove_unreferenced_blobs(self):
+        """Borra del spool los contenidos que ninguna operación pendiente usa; debe llamarse con el lock tomado"""
+        referenced = {operation.get("blob") for operation in self.offline_queue.values()}
+        for name in os.listdir(self.blobs_dir):
+            if name not in referenced:
+                os.remove(os.path.join(self.blobs_dir, name))
+    
+    def get_payload_path(self, operation):
+        """Ruta del contenido guardado de una operación, o None si no tiene"""
+        if not operation.get("blob"):
+            return None
+        return os.path.join(self.blobs_dir, operation["blob"])
+    
+    def add_to_offline_queue(self, operation_type, filename, data=None, path=None, target_node=None, logged=None):
+        """Agrega una operación a la cola offline, reemplazando la pendiente del mismo archivo (`logged`: la registrada en el log)"""
+        if isinstance(data, str):
+            data = base64.b64decode(data)
+        
+        with self.lock:
+            # El contenido se guarda fuera de la cola (bajo el lock, para que una compactación no lo borre)
+            blob, size = None, 0
+            if path is not None or data is not None:
+                blob, size = self._store_blob(data=data, path=path)
+            
+            timestamp = time.time()
+            operation = {
+                "type": operation_type,
+                "filename": filename,
+                "timestamp": timestamp,
+                "operation_id": f"{operation_type}_{filename}_{timestamp}",
+                "blob": blob,
+                "size": size,
+                "target_node": target_node
+            }
+            if logged:
+                # Al reenviarla, los demás nodos la registran con la misma marca e identificador que el log local
+                operation["logged"] = {key: logged[key] for key in ("operation_id", "hlc", "timestamp", "version")
+                                       if key in logged}
+            
+            # Última escritura gana: guardar y luego eliminar deja solo la eliminación
+            superseded = self.offline_queue.get(filename)
+            self._append({"op": "put", "operation": operation})
+            if superseded and superseded.get("blob") and superseded["blob"] != blob:
+                self._release_blob(superseded["blob"])
         
         return operation
     
+    def _release_blob(self, blob):
+        """Borra un contenido del spool si ya ninguna operación pendiente lo usa; debe llamarse con el lock tomado"""
+        if any(operation.get("blob") == blob for operation in self.offline_queue.values()):
+            return
+        try:
+            os.remove(os.path.join(self.blobs_dir, blob))
+        except FileNotFoundError:
+            pass
+    
+    def get_pending_operations(self):
+        """Operaciones pendientes, una por archivo, en el orden en que se registraron"""
+        with self.lock:
+            return [dict(operation) for operation in self.offline_queue.values()]
+    
+    def complete_operation(self, operation):
+        """Quita una operación procesada de la cola (si no fue reemplazada mientras tanto)"""
+        with self.lock:
+            current = self.offline_queue.get(operation["filename"])
+            if not current or current["operation_id"] != operation["operation_id"]:
+                return
+            self._append({"op": "done", "filename": operation["filename"], "operation_id": operation["operation_id"]})
+            self._append({"op": "synced", "filename": operation["filename"], "timestamp": time.time()})
+            if operation.get("blob"):
+                self._release_blob(operation["blob"])
+    
     def process_offline_queue(self):
-        """Procesa la cola de operaciones offline"""
+        """Reenvía la cola de operaciones offline a los nodos activos"""
+        if not self.network_manager:
+            return
+        
+        # Primero las eliminaciones (solo metadatos), luego los archivos de menor a mayor
+        operations = sorted(self.get_pending_operations(),
+                            key=lambda operation: (operation["type"] != "delete", operation.get("size", 0)))
+        if not operations:
+            return
+        
         with self.lock:
-            operations_to_process = self.offline_queue.copy()
-            self.offline_queue = []
+            self.progress = {
+                "running": True, "total": len(operations), "completed": 0, "failed": 0,
+                "bytes_total": sum(operation.get("size", 0) for operation in operations), "bytes_sent": 0,
+                "started_at": time.time(), "finished_at": None
+            }
+        logger.info(f"Reenviando {len(operations)} operaciones offline")
         
-        for operation in operations_to_process:
-            try:
-                if operation["type"] == "save":
-                    self.file_manager.save_file(
-                        operation["filename"],
-                        operation["data"],
-                        is_base64=True
-                    )
-                elif operation["type"] == "delete":
-                    self.file_manager.delete_file(
-                        operation["filename"],
-                        "local",
-                        log_operation=True
-                    )
-                
-                # Marcar archivo como sincronizado
-                self.sync_status[operation["filename"]] = {
-                    "synced": True,
-                    "last_modified": time.time(),
-                    "pending_operations": False
-                }
-            except Exception as e:
-                # Si hay error, volver a poner en la cola
-                with self.lock:
-                    self.offline_queue.append(operation)
+        # El pool ejecuta en el orden de envío, así que la prioridad se respeta con concurrencia acotada
+        results = list(self.replay_executor.map(self._replay_operation, operations))
+        
+        with self.lock:
+            self.progress["running"] = False
+            self.progress["finished_at"] = time.time()
+        logger.info(f"Cola offline reenviada: {results.count(True)} completadas, {results.count(False)} pendientes")
+    
+    def _replay_operation(self, operation):
+        """Reenvía una operación a los nodos activos; devuelve True si se completó"""
+        try:
+            if operation["type"] == "delete":
+                done = self._replay_delete(operation)
+            else:
+                done = self._replay_save(operation)
+        except Exception as e:
+            logger.error(f"Error al reenviar operación offline de {operation['filename']}: {e}")
+            done = False
+        
+        with self.lock:
+            self.progress["completed" if done else "failed"] += 1
+        if done:
+            # Marcar archivo como sincronizado
+            self.complete_operation(operation)
+        return done
+    
+    def _alive_peers(self):
+        """Nodos activos distintos de este"""
+        return [node for node, active in self.network_manager.get_node_status().items()
+                if active and node != self.network_manager.node_name]
+    
+    def _replay_delete(self, operation):
+        """Propaga una eliminación a los nodos activos (los caídos la recibirán por sincronización)"""
+        nodes = self._alive_peers()
+        if not nodes:
+            return False
+        
+        message = {
+            "type": "delete_file",
+            "source_node": self.network_manager.node_name,
+            "filename": operation["filename"],
+            "version": self.operation_log.get_file_version(operation["filename"])[0],
+            "hlc": self.operation_log.clock.now(),
+            "timestamp": operation["timestamp"]
+        }
+        # Operaciones encoladas antes de guardar la registrada en el log: se conserva el formato anterior
+        message.update(operation.get("logged") or {})
+        results = self.network_manager.broadcast(message, nodes=nodes)
+        return all(result == "ok" for result in results.values())
+    
+    def _replay_save(self, operation):
+        """Envía un archivo guardado offline a su destino o a sus réplicas activas"""
+        filename = operation["filename"]
         
-        self.save_state()
+        # Si la copia local desapareció, restaurarla desde el contenido guardado, salvo que una
+        # eliminación posterior (local o recibida por sincronización) la haya borrado
+        if not self.file_manager.get_file_path(filename):
+            deletion = self.operation_log.get_deletion(filename)
+            if deletion and order_key(deletion) > from_timestamp(operation["timestamp"]):
+                logger.info(f"Guardado offline de {filename} descartado: el archivo se eliminó después")
+                return True
+            self._restore_payload(operation)
+        
+        alive = self._alive_peers()
+        if operation.get("target_node"):
+            targets = [operation["target_node"]]
+        elif self.locate:
+            targets = self.locate(filename) or alive
+        else:
+            targets = alive
+        targets = [node for node in targets if node in alive]
+        if not alive or (operation.get("target_node") and not targets):
+            return False
+        
+        for node in targets:
+            self.replay_bucket.consume(operation.get("size", 0))
+            if not self.network_manager.send_file(filename, node):
+                return False
+        with self.lock:
+            self.progress["bytes_sent"] += operation.get("size", 0)
+        return True
+    
+    def _restore_payload(self, operation):
+        """Vuelve a escribir en el directorio compartido el contenido guardado de una operación"""
+        payload_path = self.get_payload_path(operation)
+        if not payload_path or not os.path.exists(payload_path):
+            raise FileNotFoundError(f"No se encontró el contenido guardado de {operation['filename']}")
+        
+        temp_file, temp_path = self.file_manager.create_temp_file(operation["filename"])
+        try:
+            with temp_file, open(payload_path, 'rb') as f:
+                shutil.copyfileobj(f, temp_file)
+            self.file_manager.commit_temp_file(temp_path, operation["filename"])
+        except Exception:
+            self.file_manager.discard_temp_file(temp_path)
+            raise
+    
+    def get_replay_progress(self):
+        """Progreso del último reenvío de la cola y operaciones aún pendientes"""
+        with self.lock:
+            return dict(self.progress, pending=len(self.offline_queue))
     
     def get_sync_status(self, filename=None):
         """Obtiene el estado de sincronización de un archivo o todos los archivos"""
@@ -110,7 +425,5 @@ class OfflineManager:
     def mark_as_synced(self, filename):
         """Marca un archivo como sincronizado"""
         with self.lock:
-            if filename in self.sync_status:
-                self.sync_status[filename]["synced"] = True
-                self.sync_status[filename]["pending_operations"] = False
-                self.save_state() 
\ No newline at end of file
+            if filename in self.sync_status and not self.sync_status[filename]["synced"]:
+                self._append({"op": "synced", "filename": filename, "timestamp": time.time()})
@@ -1,70 +1,577 @@
 import json
 import time
 import os
+import bisect
 import threading
-from config import LOG_FILE
+import atexit
+import logging
+from config import LOG_FILE, LOG_COMPACTION_INTERVAL, TOMBSTONE_RETENTION, LOG_GROUP_COMMIT_DELAY, LOG_WRITE_RETRY_DELAY, LOG_SYNC_COMMIT, MERKLE_DEPTH
+from merkle import MerkleTree
+import vector_clock
+from hlc import HybridClock, from_timestamp
+
+logger = logging.getLogger('sistema.operation_log')
+
+def order_key(operation):
+    """Clave de orden de una operación: su marca del reloj híbrido, o su timestamp si es del formato anterior"""
+    return operation.get("hlc") or from_timestamp(operation["timestamp"])
+
+def make_operation_id(hlc, source_node):
+    """Identificador de una operación: el mismo en todos los logs que la registran con la marca de su origen"""
+    return f"{hlc}_{source_node}"
+
+def is_removal(operation):
+    """Indica si una operación deja el archivo eliminado"""
+    return operation["type"] == "delete" or (operation["type"] == "resolve" and not operation.get("sha256"))
 
 class OperationLog:
-    def __init__(self):
-        self.log_file = LOG_FILE
+    def __init__(self, log_file=None):
+        self.log_file = log_file or LOG_FILE
         self.lock = threading.Lock()
-        self.operations = []
+        self.operations = []  # En orden de inserción
+        self.positions = []  # Posición de cada operación en el log; la compactación deja huecos pero no la cambia
+        self.next_position = 0
+        self.log_id = None  # Primera operación del log: identifica al log en los cursores aunque se compacte
+        self.operations_by_id = {}  # operation_id -> operación
+        self.sorted_timestamps = []  # Timestamps ordenados para búsquedas por bisect
+        self.sorted_operations = []  # Operaciones en el mismo orden que sorted_timestamps
+        self.last_timestamp = 0
+        self.appends_since_compaction = 0
+        self.merkle = MerkleTree(MERKLE_DEPTH)  # Resumen de los operation_id para la sincronización
+        self.clock = HybridClock()  # Marca de cada operación: identificadores únicos y ordenados
+        self.file_versions = {}  # filename -> {"version": vector de versiones, "sha256": contenido de esa versión, "deleted", "timestamp"}
+        self.conflicts = {}  # filename -> operaciones remotas concurrentes con la versión local
+        self.file_states = {}  # filename -> {tipo:destino -> última operación efectiva}, o {"delete": lápida}
+        self.peers = None  # Nodos conocidos que deben leer las lápidas antes de descartarlas (None: aún no se sabe)
+        self.acknowledged = {}  # nodo -> posición de este log hasta la que ya aplicó las operaciones
+        self.horizon = 0  # Los cursores anteriores a esta posición perdieron lápidas descartadas
+        
+        # Group commit: los escritores encolan registros y un único thread los
+        # agrega al archivo por lotes con un solo fsync
+        self.commit_condition = threading.Condition()
+        self.write_lock = threading.Lock()
+        self.pending_records = []
+        self.enqueued_sequence = 0
+        self.flushed_sequence = 0
+        self.log_handle = None
+        self.running = True
+        self.write_error = None  # Último error de escritura si el log se cerró sin poder escribir todo
+        
         self.load_log()
+        self.log_handle = open(self.log_file, 'a')
+        
+        self.flusher_thread = threading.Thread(target=self._flush_loop)
+        self.flusher_thread.daemon = True
+        self.flusher_thread.start()
+        
+        atexit.register(self.close)
     
     def load_log(self):
-        """Carga el registro de operaciones desde el archivo"""
-        if os.path.exists(self.log_file):
+        """Carga el registro de operaciones desde el archivo (JSON-lines, o JSON del formato antiguo)"""
+        self._reset_indexes()
+        if not os.path.exists(self.log_file):
+            return
+        
+        with open(self.log_file, 'r') as f:
+            content = f.read()
+        
+        if content.lstrip().startswith('['):
+            # Formato antiguo: una lista JSON reescrita completa en cada operación
             try:
-                with open(self.log_file, 'r') as f:
-                    self.operations = json.load(f)
+                operations = json.loads(content)
             except json.JSONDecodeError:
                 # Si el archivo está corrupto, lo reiniciamos
-                self.operations = []
+                operations = []
+            for operation in operations:
+                self._index_operation(operation)
+            self.compact()
+            return
+        
+        positions = iter(())
+        for line in content.splitlines():
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                # Una escritura interrumpida solo puede dañar la última línea
+                continue
+            if "checkpoint" in record:
+                positions = self._restore_checkpoint(record["checkpoint"])
+                continue
+            self._index_operation(record, next(positions, None))
+    
+    def _restore_checkpoint(self, checkpoint):
+        """Recupera el estado que la compactación guardó al principio del archivo; devuelve las posiciones de las operaciones conservadas"""
+        self.log_id = checkpoint["log_id"]
+        self.next_position = checkpoint["next_position"]
+        self.horizon = checkpoint["horizon"]
+        self.last_timestamp = checkpoint["last_timestamp"]
+        # Las versiones incluyen las de las operaciones descartadas; las conservadas ya quedan incluidas en ellas
+        self.file_versions = checkpoint["file_versions"]
+        return iter(checkpoint["positions"])
+    
+    def _reset_indexes(self):
+        """Vacía la lista de operaciones y sus índices"""
+        self.operations = []
+        self.positions = []
+        self.next_position = 0
+        self.log_id = None
+        self.horizon = 0
+        self.operations_by_id = {}
+        self.sorted_timestamps = []
+        self.sorted_operations = []
+        self.last_timestamp = 0
+        self.merkle.clear()
+        self.file_versions = {}
+        self.conflicts = {}
+        self.file_states = {}
+    
+    def _index_operation(self, operation, position=None):
+        """Agrega una operación a la lista y a los índices; devuelve False si ya existía"""
+        if operation["operation_id"] in self.operations_by_id:
+            return False
+        
+        if position is None:
+            position = self.next_position
+        # Tras un checkpoint la cabeza puede estar más allá de la última operación conservada: nunca retrocede
+        self.next_position = max(self.next_position, position + 1)
+        if self.log_id is None:
+            self.log_id = operation["operation_id"]
+        
+        self.operations.append(operation)
+        self.positions.append(position)
+        self.operations_by_id[operation["operation_id"]] = operation
+        self.merkle.add(operation["operation_id"])
+        
+        position = bisect.bisect_right(self.sorted_timestamps, operation["timestamp"])
+        self.sorted_timestamps.insert(position, operation["timestamp"])
+        self.sorted_operations.insert(position, operation)
+        
+        self.last_timestamp = max(self.last_timestamp, operation["timestamp"])
+        if operation.get("hlc"):
+            # Las marcas siguientes deben suceder a todas las conocidas, también tras reiniciar
+            self.clock.update(operation["hlc"])
+        self._track_version(operation)
+        self._track_state(operation)
+        return True
+    
+    def _track_version(self, operation):
+        """Actualiza la versión conocida del archivo de una operación y descarta los conflictos ya resueltos"""
+        filename = operation.get("filename")
+        if not filename or "version" not in operation:
+            return
+        
+        if operation.get("conflict"):
+            self.conflicts.setdefault(filename, []).append(operation)
+            return
+        if operation.get("applied") is False:
+            # Operación registrada sin aplicar: el contenido local no cambió
+            return
+        
+        current = self.file_versions.get(filename)
+        if current and vector_clock.dominates(current["version"], operation["version"]):
+            return
+        
+        version = vector_clock.merge(current["version"] if current else None, operation["version"])
+        self.file_versions[filename] = {"version": version, "sha256": operation.get("sha256"), "deleted": is_removal(operation),
+                                        "timestamp": operation["timestamp"]}
+        
+        pending = [conflict for conflict in self.conflicts.get(filename, [])
+                   if not vector_clock.dominates(version, conflict["version"])]
+        if pending:
+            self.conflicts[filename] = pending
         else:
-            self.operations = []
+            self.conflicts.pop(filename, None)
+    
+    def _track_state(self, operation):
+        """Conserva por archivo solo las operaciones que aún describen su estado: la última de cada tipo y destino desde la última eliminación"""
+        filename = operation.get("filename")
+        if not filename or operation.get("conflict"):
+            return
+        
+        state = self.file_states.setdefault(filename, {})
+        tombstone = state.get("delete")
+        if tombstone and order_key(operation) < order_key(tombstone):
+            # Anterior a la eliminación: ya no describe el archivo
+            return
+        
+        if is_removal(operation):
+            # La eliminación supera todo lo anterior; lo posterior (llegado antes) se conserva
+            for key, previous in list(state.items()):
+                if order_key(previous) < order_key(operation):
+                    del state[key]
+            state["delete"] = operation
+            return
+        
+        key = f"{operation['type']}:{operation.get('target_node') or ''}"
+        previous = state.get(key)
+        if previous is None or order_key(previous) < order_key(operation):
+            state[key] = operation
     
     def save_log(self):
-        """Guarda el registro de operaciones en el archivo"""
-        with open(self.log_file, 'w') as f:
-            json.dump(self.operations, f, indent=2)
+        """Reescribe el registro completo en el archivo (usado en la compactación)"""
+        checkpoint = {
+            "log_id": self.log_id, "next_position": self.next_position, "positions": self.positions,
+            "horizon": self.horizon, "last_timestamp": self.last_timestamp, "file_versions": self.file_versions
+        }
+        temp_file = f"{self.log_file}.tmp"
+        with open(temp_file, 'w') as f:
+            f.write(json.dumps({"checkpoint": checkpoint}) + '\n')
+            for operation in self.operations:
+                f.write(json.dumps(operation) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_file, self.log_file)
+    
+    def _enqueue_record(self, operation):
+        """Encola una operación para el próximo lote; devuelve su número de secuencia"""
+        with self.commit_condition:
+            self.pending_records.append(json.dumps(operation) + '\n')
+            self.enqueued_sequence += 1
+            self.commit_condition.notify_all()
+            return self.enqueued_sequence
+    
+    def _flush_loop(self):
+        """Agrega al archivo los registros pendientes por lotes (un write y un fsync por lote)"""
+        while True:
+            with self.commit_condition:
+                while self.running and not self.pending_records:
+                    self.commit_condition.wait()
+                if not self.pending_records:
+                    return
+            
+            # Dar tiempo a que otros escritores se sumen al lote
+            if LOG_GROUP_COMMIT_DELAY:
+                time.sleep(LOG_GROUP_COMMIT_DELAY)
+            
+            with self.write_lock:
+                with self.commit_condition:
+                    batch = self.pending_records
+                    batch_sequence = self.enqueued_sequence
+                    self.pending_records = []
+                
+                offset = None
+                try:
+                    offset = self.log_handle.tell()
+                    self.log_handle.write(''.join(batch))
+                    self.log_handle.flush()
+                    os.fsync(self.log_handle.fileno())
+                except Exception as e:
+                    logger.error(f"Error al escribir el log de operaciones: {e}")
+                    self._discard_partial_write(offset)
+                    with self.commit_condition:
+                        # El lote vuelve a la cola: quien lo espera no recibe confirmación hasta que llegue a disco
+                        self.pending_records = batch + self.pending_records
+                        if not self.running:
+                            # Al cerrar no se reintenta indefinidamente: quien aún espera recibe el error
+                            self.write_error = e
+                            self.commit_condition.notify_all()
+                            return
+                    time.sleep(LOG_WRITE_RETRY_DELAY)
+                    continue
+                
+                with self.commit_condition:
+                    self.flushed_sequence = max(self.flushed_sequence, batch_sequence)
+                    self.commit_condition.notify_all()
+            
+            with self.lock:
+                if self.appends_since_compaction >= LOG_COMPACTION_INTERVAL:
+                    self._compact()
+    
+    def _discard_partial_write(self, offset):
+        """Reabre el archivo sin lo que haya quedado escrito de un lote fallido; debe llamarse con write_lock tomado"""
+        try:
+            self.log_handle.close()
+        except Exception:
+            pass
+        try:
+            if offset is not None:
+                os.truncate(self.log_file, offset)
+            self.log_handle = open(self.log_file, 'a')
+        except OSError as e:
+            # El archivo sigue inaccesible: el próximo intento volverá a pasar por aquí
+            logger.error(f"No se pudo reabrir el log tras el error de escritura: {e}")
+    
+    def _wait_for_flush(self, sequence):
+        """Espera a que una secuencia esté escrita y sincronizada en disco (OSError si el log se cerró sin lograrlo)"""
+        with self.commit_condition:
+            while self.flushed_sequence < sequence and not self.write_error and self.flusher_thread.is_alive():
+                self.commit_condition.wait()
+            if self.flushed_sequence < sequence and self.write_error:
+                raise OSError(f"La operación no llegó al log en disco: {self.write_error}")
+    
+    def flush(self):
+        """Espera a que todas las operaciones encoladas lleguen a disco"""
+        with self.commit_condition:
+            sequence = self.enqueued_sequence
+        self._wait_for_flush(sequence)
+    
+    def close(self):
+        """Escribe lo pendiente y detiene el thread de escritura"""
+        with self.commit_condition:
+            if not self.running:
+                return
+            self.running = False
+            self.commit_condition.notify_all()
+        self.flusher_thread.join()
+        self.log_handle.close()
+    
+    def compact(self):
+        """Reescribe el archivo a partir del estado en memoria, descartando duplicados y líneas dañadas"""
+        with self.lock:
+            self._compact()
+    
+    def _compact(self):
+        """Compacta el log y su archivo; debe llamarse con el lock tomado"""
+        self._collect_garbage()
+        with self.write_lock, self.commit_condition:
+            # Los registros pendientes ya están en memoria y quedan incluidos en la reescritura
+            self.save_log()
+            self.pending_records = []
+            self.flushed_sequence = self.enqueued_sequence
+            self.appends_since_compaction = 0
+            
+            if self.log_handle:
+                self.log_handle.close()
+                self.log_handle = open(self.log_file, 'a')
+            self.commit_condition.notify_all()
+    
+    def _collect_garbage(self):
+        """Descarta las operaciones superadas y las lápidas que ya aplicaron todos los nodos conocidos; debe llamarse con el lock tomado"""
+        if self.peers is None:
+            acknowledged = 0
+        else:
+            acknowledged = min((self.acknowledged.get(node, 0) for node in self.peers), default=self.next_position)
+        position_of = {id(operation): position for operation, position in zip(self.operations, self.positions)}
+        expired = time.time() - TOMBSTONE_RETENTION
+        
+        tombstones = 0
+        for filename, state in list(self.file_states.items()):
+            tombstone = state.get("delete")
+            if tombstone is None or (position_of[id(tombstone)] >= acknowledged and tombstone["timestamp"] >= expired):
+                continue
+            # Todos los nodos ya aplicaron la eliminación, o pasó la retención máxima: la lápida ya no hace falta
+            self.horizon = max(self.horizon, position_of[id(tombstone)] + 1)
+            del state["delete"]
+            tombstones += 1
+            if not state:
+                # La versión del archivo se conserva durante la retención: si se vuelve a crear, debe suceder a la eliminación
+                del self.file_states[filename]
+        
+        # Pasada la retención, la versión de un archivo eliminado corre la misma suerte que su lápida
+        removed = [filename for filename, current in self.file_versions.items()
+                   if current.get("deleted") and filename not in self.file_states and current.get("timestamp", 0) < expired]
+        for filename in removed:
+            del self.file_versions[filename]
+        
+        # Se conservan las operaciones efectivas de cada archivo y los conflictos pendientes
+        kept = {id(operation) for state in self.file_states.values() for operation in state.values()}
+        kept.update(id(operation) for operations in self.conflicts.values() for operation in operations)
+        if len(kept) == len(self.operations):
+            return
+        
+        discarded = len(self.operations) - len(kept)
+        operations = [(operation, position) for operation, position in zip(self.operations, self.positions)
+                      if id(operation) in kept]
+        self.operations = [operation for operation, _ in operations]
+        self.positions = [position for _, position in operations]
+        self.operations_by_id = {operation["operation_id"]: operation for operation in self.operations}
+        self.sorted_operations = sorted(self.operations, key=lambda operation: operation["timestamp"])
+        self.sorted_timestamps = [operation["timestamp"] for operation in self.sorted_operations]
+        self.merkle.clear()
+        for operation in self.operations:
+            self.merkle.add(operation["operation_id"])
+        logger.info(f"Log compactado: {discarded} operaciones descartadas ({tombstones} lápidas), "
+                    f"{len(self.operations)} conservadas, {len(removed)} versiones de archivos eliminados descartadas")
     
-    def add_operation(self, operation_type, source_node, target_node=None, filename=None, timestamp=None):
-        """Agrega una nueva operación al registro"""
+    def set_peers(self, nodes):
+        """Define los nodos que deben aplicar cada eliminación antes de descartar su lápida"""
+        with self.lock:
+            self.peers = set(nodes)
+    
+    def acknowledge(self, node, cursor):
+        """Registra hasta qué posición de este log aplicó las operaciones un nodo, según el cursor con el que pide más"""
+        with self.lock:
+            if isinstance(cursor, dict) and cursor.get("log_id") == self.log_id and isinstance(cursor.get("position"), int):
+                self.acknowledged[node] = cursor["position"]
+    
+    def add_operation(self, operation_type, source_node, target_node=None, filename=None, timestamp=None, sync=None,
+                      version=None, sha256=None, conflict=False, hlc=None):
+        """Agrega una nueva operación al registro (con sync=False no espera a que llegue a disco; sin version avanza el contador de source_node)"""
+        if sync is None:
+            sync = LOG_SYNC_COMMIT
+        
+        if hlc is None and timestamp is not None:
+            # Operación de un nodo con el formato anterior: conservar su identificador
+            operation_id = f"{source_node}_{timestamp}"
+        else:
+            if hlc is None:
+                hlc = self.clock.now()
+            operation_id = make_operation_id(hlc, source_node)
+        
         if timestamp is None:
             timestamp = time.time()
         
         operation = {
-            "type": operation_type,  # "transfer" o "delete"
+            "type": operation_type,  # "transfer", "delete", "write" o "resolve"
             "source_node": source_node,
             "timestamp": timestamp,
-            "operation_id": f"{source_node}_{timestamp}"
+            "operation_id": operation_id
         }
         
+        if hlc:
+            operation["hlc"] = hlc
+        
         if target_node:
             operation["target_node"] = target_node
         
         if filename:
             operation["filename"] = filename
         
+        if sha256:
+            operation["sha256"] = sha256
+        
+        if conflict:
+            # Operación concurrente con la versión local: se guarda sin aplicar hasta que se resuelva
+            operation["conflict"] = True
+        
+        sequence = None
         with self.lock:
-            self.operations.append(operation)
-            self.save_log()
+            if filename:
+                if version is None:
+                    current = self.file_versions.get(filename)
+                    version = vector_clock.increment(current["version"] if current else None, source_node)
+                operation["version"] = version
+            
+            if self._index_operation(operation):
+                # Encolar bajo el lock para que el archivo respete el orden en memoria
+                sequence = self._enqueue_record(operation)
+                self.appends_since_compaction += 1
+        
+        if sync and sequence is not None:
+            self._wait_for_flush(sequence)
         
         return operation
     
+    def record_operation(self, operation, conflict=False):
+        """Registra una operación remota sin aplicarla: superada por la versión local, ajena a este nodo o en conflicto"""
+        operation = dict(operation)
+        operation.pop("applied", None)
+        operation.pop("conflict", None)
+        if conflict:
+            operation["conflict"] = True
+        else:
+            operation["applied"] = False
+        
+        with self.lock:
+            if self._index_operation(operation):
+                self._enqueue_record(operation)
+                self.appends_since_compaction += 1
+        return operation
+    
+    def get_file_version(self, filename):
+        """Vector de versiones local de un archivo y el sha256 de su contenido ({} y None si no tiene)"""
+        with self.lock:
+            current = self.file_versions.get(filename)
+            if not current:
+                return {}, None
+            return dict(current["version"]), current["sha256"]
+    
+    def get_deletion(self, filename):
+        """Operación que eliminó el archivo si su último estado conocido es eliminado (None si no, o si la lápida ya se descartó)"""
+        with self.lock:
+            state = self.file_states.get(filename, {})
+            tombstone = state.get("delete")
+            if tombstone is None or any(order_key(operation) > order_key(tombstone) for operation in state.values()):
+                return None
+            return tombstone
+    
+    def get_conflicts(self):
+        """Operaciones remotas concurrentes con la versión local, por archivo"""
+        with self.lock:
+            return {filename: list(operations) for filename, operations in self.conflicts.items()}
+    
+    def _cursor(self, position):
+        """Cursor a una posición del log; debe llamarse con el lock tomado"""
+        # La primera operación identifica al log: si el archivo se pierde o se rehace, los cursores dejan de valer
+        return {"log_id": self.log_id, "position": position}
+    
+    def get_cursor(self):
+        """Cursor al final del log: desde él, un nodo recibe solo las operaciones agregadas después"""
+        with self.lock:
+            return self._cursor(self.next_position)
+    
+    def cursor_expired(self, cursor):
+        """Indica si un cursor de este log es anterior a lápidas ya descartadas: quien lo tiene debe partir de una instantánea"""
+        with self.lock:
+            return (isinstance(cursor, dict) and cursor.get("log_id") == self.log_id
+                    and isinstance(cursor.get("position"), int) and cursor["position"] < self.horizon)
+    
+    def get_operations_after(self, cursor, limit=None):
+        """Hasta `limit` operaciones agregadas después de un cursor, en orden de llegada, el cursor tras ellas
+        y si quedan más (None si el cursor no corresponde a este log)"""
+        with self.lock:
+            if not isinstance(cursor, dict):
+                return None
+            position = cursor.get("position")
+            if (cursor.get("log_id") != self.log_id or not isinstance(position, int)
+                    or not 0 <= position <= self.next_position):
+                return None
+            start = bisect.bisect_left(self.positions, position)
+            end = len(self.operations) if limit is None else min(start + limit, len(self.operations))
+            next_position = self.positions[end] if end < len(self.operations) else self.next_position
+            return self.operations[start:end], self._cursor(next_position), end < len(self.operations)
+    
+    def get_snapshot(self, after=None, limit=None):
+        """Página de la instantánea del log: las operaciones efectivas de los archivos que siguen a `after` en orden alfabético,
+        el estado de esos archivos en este nodo (versión, sha256 y si está eliminado), el cursor al final del log en ese momento
+        y el último archivo de la página (None si no quedan más)"""
+        with self.lock:
+            removed = {filename for filename, current in self.file_versions.items()
+                       if current.get("deleted") and filename not in self.file_states}
+            filenames = sorted(removed.union(self.file_states))
+            start = bisect.bisect_right(filenames, after) if after is not None else 0
+            end = len(filenames) if limit is None else min(start + limit, len(filenames))
+            page = filenames[start:end]
+            operations = sorted((operation for filename in page for operation in self.file_states.get(filename, {}).values()),
+                                key=order_key)
+            files = {filename: {"version": dict(self.file_versions[filename]["version"]),
+                                "sha256": self.file_versions[filename]["sha256"],
+                                "deleted": bool(self.file_versions[filename].get("deleted"))}
+                     for filename in page if filename in self.file_versions}
+            return operations, files, self._cursor(self.next_position), page[-1] if end < len(filenames) else None
+    
     def get_operations_since(self, timestamp):
         """Obtiene todas las operaciones desde un timestamp dado"""
         with self.lock:
-            return [op for op in self.operations if op["timestamp"] > timestamp]
+            position = bisect.bisect_right(self.sorted_timestamps, timestamp)
+            return self.sorted_operations[position:]
     
     def get_last_timestamp(self):
         """Obtiene el timestamp de la última operación"""
         with self.lock:
-            if not self.operations:
-                return 0
-            return max(op["timestamp"] for op in self.operations)
+            return self.last_timestamp
     
     def operation_exists(self, operation_id):
         """Verifica si una operación ya existe en el registro"""
         with self.lock:
-            return any(op["operation_id"] == operation_id for op in self.operations)
\ No newline at end of file
+            return operation_id in self.operations_by_id
+    
+    def get_merkle_children(self, prefixes):
+        """Hashes de los hijos de cada nodo del árbol de Merkle indicado"""
+        with self.lock:
+            return {prefix: self.merkle.children(prefix) for prefix in prefixes}
+    
+    def get_merkle_leaves(self, prefixes):
+        """operation_id contenidos en cada hoja del árbol de Merkle indicada"""
+        with self.lock:
+            return {prefix: self.merkle.keys(prefix) for prefix in prefixes}
+    
+    def get_operations(self, operation_ids):
+        """Obtiene las operaciones con los identificadores dados, en orden cronológico"""
+        with self.lock:
+            operations = [self.operations_by_id[operation_id] for operation_id in operation_ids
+                          if operation_id in self.operations_by_id]
+        operations.sort(key=order_key)
+        return operations
@@ -0,0 +1,156 @@
+import threading
+import time
+import logging
+from hash_ring import HashRing
+from throttle import TokenBucket
+import vector_clock
+
+logger = logging.getLogger('sistema.replication')
+
+class ReplicationManager:
+    """Ubica cada archivo en sus réplicas del anillo de hashing consistente y migra los que cambian de dueño"""
+
+    def __init__(self, node_name, file_manager, network_manager, replication_factor, vnodes,
+                 migration_rate, rebalance_delay):
+        self.node_name = node_name
+        self.file_manager = file_manager
+        self.network_manager = network_manager
+        self.replication_factor = replication_factor
+        self.rebalance_delay = rebalance_delay
+        self.ring = HashRing(vnodes)
+        self.bucket = TokenBucket(migration_rate)  # Bytes por segundo de la migración en segundo plano
+
+        self.condition = threading.Condition()
+        self.pending = set()  # Archivos locales cuya ubicación hay que revisar
+        self.rebalance_at = None  # Momento de la próxima revisión completa tras un cambio del anillo
+        self.running = True
+
+        self._update_ring(network_manager.get_node_status())
+        network_manager.add_status_listener(self._update_ring)
+        file_manager.index.add_listener(self._on_files_changed)
+
+        self.thread = threading.Thread(target=self._worker)
+        self.thread.daemon = True
+
+    def start(self):
+        """Inicia la migración en segundo plano"""
+        self.thread.start()
+
+    def stop(self):
+        """Detiene la migración en segundo plano"""
+        with self.condition:
+            self.running = False
+            self.condition.notify_all()
+
+    def owners(self, filename):
+        """Nodos que deben guardar un archivo, empezando por el principal"""
+        with self.condition:
+            return self.ring.owners(filename, self.replication_factor)
+
+    def _update_ring(self, status):
+        """Reconstruye el anillo con los nodos activos y programa el rebalanceo si cambió"""
+        nodes = [node for node, alive in status.items() if alive]
+        with self.condition:
+            if self.ring.set_nodes(nodes):
+                logger.info(f"Anillo de réplicas actualizado: {sorted(nodes)}")
+                # Esperar a que la pertenencia se estabilice antes de mover datos
+                self.rebalance_at = time.time() + self.rebalance_delay
+                self.condition.notify_all()
+
+    def _on_files_changed(self, upserts, removes):
+        """Programa la ubicación de los archivos locales nuevos o modificados"""
+        names = [entry['name'] for entry in upserts if not entry['is_dir']]
+        if names:
+            with self.condition:
+                self.pending.update(names)
+                self.condition.notify_all()
+
+    def _worker(self):
+        """Revisa de a un archivo por vez dónde debe estar, a ritmo limitado"""
+        while True:
+            with self.condition:
+                while self.running and not self.pending and not self._rebalance_due():
+                    timeout = self.rebalance_at - time.time() if self.rebalance_at else None
+                    self.condition.wait(timeout)
+                if not self.running:
+                    return
+                if self._rebalance_due():
+                    self.rebalance_at = None
+                    rebalance = True
+                else:
+                    rebalance = False
+                    filename = self.pending.pop()
+
+            if rebalance:
+                # Solo los archivos que cambiaron de dueño generan transferencias; el resto cuesta una consulta
+                names = [entry['name'] for entry in self.file_manager.index.list() if not entry['is_dir']]
+                logger.info(f"Rebalanceando {len(names)} archivos locales")
+                with self.condition:
+                    self.pending.update(names)
+                continue
+
+            try:
+                self._place(filename)
+            except Exception as e:
+                logger.error(f"Error al ubicar {filename} en sus réplicas: {e}")
+
+    def _rebalance_due(self):
+        """Indica si toca la revisión completa; debe llamarse con el lock tomado"""
+        return self.rebalance_at is not None and time.time() >= self.rebalance_at
+
+    def _place(self, filename):
+        """Asegura que las réplicas de un archivo lo tengan y suelta la copia local si este nodo no es dueño"""
+        info = self.file_manager.get_file_info(filename)
+        if info is None:
+            return
+
+        owners = self.owners(filename)
+        confirmed = all(self._ensure_replica(owner, filename, info)
+                        for owner in owners if owner != self.node_name)
+
+        if owners and self.node_name not in owners and confirmed:
+            logger.info(f"Archivo {filename} migrado a {owners}, liberando la copia local")
+            self.file_manager.delete_file(filename, self.node_name, log_operation=False)
+
+    def _ensure_replica(self, owner, filename, info):
+        """Envía un archivo a una réplica que no lo tiene o tiene una versión anterior; devuelve True si queda al día"""
+        response = self.network_manager._send_message(owner, {
+            "type": "stat_file",
+            "source_node": self.node_name,
+            "filename": filename
+        })
+        if not isinstance(response, dict) or response.get("status") != "ok":
+            return False
+
+        if response.get("exists"):
+            if response.get("sha256") == info["sha256"]:
+                return True
+            remote_version = response.get("version")
+            if remote_version:
+                local_version, _ = self.network_manager.get_file_version(filename)
+                relation = vector_clock.compare(remote_version, local_version)
+                if relation == vector_clock.CONCURRENT:
+                    # Escrituras concurrentes: ninguna pisa a la otra y la copia local se conserva hasta resolverlo
+                    self._record_conflict(owner, filename, remote_version, response.get("sha256"))
+                    return False
+                if relation != vector_clock.BEFORE:
+                    # La réplica tiene una versión más reciente: es ella quien debe propagarla
+                    return True
+            elif response.get("modified", 0) > info["modified"]:
+                # La réplica tiene una versión más reciente: es ella quien debe propagarla
+                return True
+
+        self.bucket.consume(info["size"])
+        logger.debug(f"Replicando {filename} en {owner}")
+        return self.network_manager.send_file(filename, owner)
+
+    def _record_conflict(self, owner, filename, version, sha256):
+        """Registra la versión concurrente de una réplica como conflicto, una sola vez por versión"""
+        operation_log = self.network_manager.operation_log
+        if any(conflict["version"] == version for conflict in operation_log.get_conflicts().get(filename, [])):
+            return
+        logger.warning(f"Conflicto en {filename}: la réplica de {owner} es concurrente con la copia local")
+        operation_log.add_operation(
+            "transfer", owner, target_node=self.node_name, filename=filename,
+            version=version, sha256=sha256, conflict=True
+        )
@@ -1,16 +1,64 @@
+import json
+import os
 import threading
 import time
+import logging
+from concurrent.futures import ThreadPoolExecutor
+from config import (MERKLE_DEPTH, SYNC_BATCH_SIZE, SYNC_WORKERS, SYNC_CURSORS_FILE, SYNC_RETRY_FILE, SYNC_MAX_ATTEMPTS,
+                    SNAPSHOT_MIN_GAP, SNAPSHOT_WORKERS)
+from merkle import HEX_DIGITS
+from operation_log import order_key, is_removal
+import vector_clock
+
+logger = logging.getLogger('sistema.sync')
 
 class SyncManager:
-    def __init__(self, file_manager, operation_log):
+    def __init__(self, file_manager, operation_log, cursors_file=None, retry_file=None):
         self.file_manager = file_manager
         self.operation_log = operation_log
         self.network_manager = None  # Se establecerá después
+        self.locate = None  # filename -> nodos que deben guardarlo según el anillo ([] sin réplicas)
         self.lock = threading.Lock()
         self.syncing = False
+        self.executor = ThreadPoolExecutor(max_workers=SYNC_WORKERS)
+        self.snapshot_executor = ThreadPoolExecutor(max_workers=SNAPSHOT_WORKERS)  # Descargas paralelas de una instantánea
+        self.cursors_file = cursors_file or SYNC_CURSORS_FILE
+        self.cursors = self._load_json(self.cursors_file)  # nodo -> cursor en su log hasta donde ya se aplicó
+        self.retry_lock = threading.Lock()
+        self.retry_file = retry_file or SYNC_RETRY_FILE
+        self.attempts = {}  # operation_id -> intentos fallidos de aplicarla
+        self.deferred = self._load_json(self.retry_file)  # operation_id -> operación apartada para reintentar
+    
+    def _load_json(self, path):
+        """Carga un diccionario guardado (vacío si no existe o está dañado)"""
+        try:
+            with open(path, 'r') as f:
+                data = json.load(f)
+            return data if isinstance(data, dict) else {}
+        except (OSError, json.JSONDecodeError):
+            return {}
     
-    def set_network_manager(self, network_manager):
+    def _write_json(self, path, data):
+        """Reescribe un archivo JSON de forma atómica"""
+        temp_file = f"{path}.tmp"
+        with open(temp_file, 'w') as f:
+            json.dump(data, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_file, path)
+    
+    def _save_cursor(self, node, cursor):
+        """Guarda el cursor de un nodo de forma atómica"""
+        with self.lock:
+            if self.cursors.get(node) == cursor:
+                return
+            self.cursors[node] = cursor
+            self._write_json(self.cursors_file, self.cursors)
+    
+    def set_network_manager(self, network_manager, locate=None):
+        """Establece el manager de red (y cómo ubicar las réplicas) para sincronizar"""
         self.network_manager = network_manager
+        self.locate = locate
     
     def start_sync(self):
         """Inicia el proceso de sincronización con otros nodos"""
@@ -20,86 +68,398 @@ class SyncManager:
             self.syncing = True
         
         try:
-            # Obtener el último timestamp de operación registrado
-            last_timestamp = self.operation_log.get_last_timestamp()
+            # Reintentar antes las operaciones apartadas en sincronizaciones anteriores
+            self._retry_deferred()
             
             # Solicitar operaciones a todos los nodos activos
             node_status = self.network_manager.get_node_status()
             
-            for node, alive in node_status.items():
-                # No intentar sincronizar con uno mismo o con nodos inactivos
-                if node != self.network_manager.node_name and alive:
-                    self._sync_with_node(node, last_timestamp)
+            # No intentar sincronizar con uno mismo o con nodos inactivos
+            nodes = [node for node, alive in node_status.items()
+                     if node != self.network_manager.node_name and alive]
+            
+            # Sincronizar con los nodos en paralelo; uno lento no retrasa a los demás
+            futures = {self.executor.submit(self._sync_with_node, node): node for node in nodes}
+            for future, node in futures.items():
+                try:
+                    future.result()
+                except Exception as e:
+                    logger.error(f"Error al sincronizar con {node}: {e}")
             
         finally:
             with self.lock:
                 self.syncing = False
     
-    def _sync_with_node(self, node, last_timestamp):
+    def _sync_with_node(self, node):
         """Sincroniza operaciones con un nodo específico"""
         # No intentar sincronizar con uno mismo
         if node == self.network_manager.node_name:
             return
         
-        message = {
-            "type": "sync_request",
-            "source_node": self.network_manager.node_name,
-            "last_timestamp": last_timestamp
-        }
+        # Pedir solo lo agregado al log del nodo desde el último cursor, de a una página por petición;
+        # los nodos anteriores ignoran el cursor y responden por timestamp
+        cursor = self.cursors.get(node)
+        while True:
+            response = self._request(node, {
+                "type": "sync_request",
+                "cursor": cursor,
+                "limit": SYNC_BATCH_SIZE,
+                "last_timestamp": self.operation_log.get_last_timestamp()
+            })
+            if response is None:
+                return
+            
+            if "cursor" not in response:
+                operations = response.get("operations", [])
+                operations.sort(key=order_key)
+                self._apply_operations(operations)
+                return
+            
+            if response.get("reset"):
+                # Nodo nuevo o muy atrasado: ponerse al día con el estado actual en vez de recorrer la historia
+                # (o con un cursor anterior a lápidas que el nodo ya descartó)
+                local_position = self.operation_log.get_cursor()["position"]
+                if ((response.get("cursor_expired") or local_position == 0
+                        or response["cursor"]["position"] - local_position >= SNAPSHOT_MIN_GAP)
+                        and self._sync_from_snapshot(node)):
+                    return
+                
+                # Sin cursor válido: reconciliar con el árbol de Merkle; el cursor devuelto es anterior
+                # a la reconciliación, así que no se pierde nada agregado mientras tanto
+                operations = self._fetch_missing_operations(node)
+                if operations is None:
+                    return
+                operations.sort(key=order_key)
+                if self._apply_operations(operations) == len(operations):
+                    self._save_cursor(node, response["cursor"])
+                return
+            
+            # Operaciones en el orden en que el nodo las agregó: el cursor se guarda tras cada página
+            # y avanza hasta el primer fallo, así una conexión caída retoma desde la última página aplicada
+            operations = response.get("operations", [])
+            applied = self._apply_operations(operations)
+            if applied < len(operations):
+                # La compactación deja huecos entre posiciones: el cursor puede quedar antes, nunca después
+                cursor = dict(response["cursor"], position=cursor["position"] + applied)
+            else:
+                cursor = response["cursor"]
+            self._save_cursor(node, cursor)
+            if applied < len(operations) or not response.get("has_more"):
+                return
+            logger.debug(f"Página de {len(operations)} operaciones aplicada desde {node}, pidiendo la siguiente")
+    
+    def _sync_from_snapshot(self, node):
+        """Aplica la instantánea del nodo por páginas y sigue su log desde ese punto; devuelve False si el nodo no la soporta"""
+        after = None
+        cursor = None
+        while True:
+            response = self._request(node, {"type": "snapshot", "after": after, "limit": SYNC_BATCH_SIZE})
+            if response is None or "operations" not in response:
+                # Nodo anterior (o caído): si ya había respondido, se reintenta en la próxima sincronización
+                return cursor is not None
+            
+            # El cursor de la primera página es anterior a todas: lo que cambie mientras tanto llega después por el log
+            if cursor is None:
+                cursor = response["cursor"]
+                logger.info(f"Sincronizando desde una instantánea de {node} (posición {cursor['position']} de su log)")
+            if not self._apply_snapshot(node, response["operations"], response.get("files", {})):
+                return True
+            
+            after = response.get("after")
+            if after is None:
+                break
+        
+        self._save_cursor(node, cursor)
+        logger.info(f"Instantánea de {node} aplicada")
+        return True
+    
+    def _apply_snapshot(self, node, operations, files):
+        """Aplica una página de instantánea, un archivo por tarea; devuelve True si se aplicaron todos"""
+        by_file = {}
+        for operation in operations:
+            by_file.setdefault(operation["filename"], []).append(operation)
+        
+        futures = [self.snapshot_executor.submit(self._apply_snapshot_file, node, filename,
+                                                 by_file.get(filename, []), files.get(filename))
+                   for filename in set(by_file).union(files)]
+        return all(future.result() for future in futures)
+    
+    def _apply_snapshot_file(self, node, filename, operations, state):
+        """Lleva un archivo al estado que tiene en el nodo de la instantánea y registra su historial; devuelve False si no se pudo"""
+        # La copia local sigue al estado del archivo, no a los destinos de sus transferencias: las operaciones solo se registran
+        if state and not self._apply_file_state(node, filename, state, operations):
+            return False
+        for operation in operations:
+            if not self.operation_log.operation_exists(operation["operation_id"]):
+                self.operation_log.record_operation(operation)
+        return True
+    
+    def _apply_file_state(self, node, filename, state, operations):
+        """Descarga o elimina la copia local según el estado del archivo en el nodo; devuelve False si falló la descarga"""
+        version, sha256, deleted = state["version"], state.get("sha256"), state.get("deleted")
+        if deleted:
+            if not self.file_manager.get_file_path(filename):
+                return True
+        elif not sha256 or not self._should_hold(filename):
+            return True
+        
+        local_version, local_sha256 = self.network_manager.get_file_version(filename)
+        relation = vector_clock.compare(version, local_version)
+        if relation in (vector_clock.EQUAL, vector_clock.BEFORE):
+            return True
+        
+        # Operaciones del nodo que dejaron el archivo así y que este log aún no tiene; la última es la del estado
+        candidates = sorted((operation for operation in operations
+                             if is_removal(operation) == bool(deleted)
+                             and (deleted or operation.get("sha256") == sha256)
+                             and not self.operation_log.operation_exists(operation["operation_id"])), key=order_key)
+        operation = next((operation for operation in reversed(candidates) if operation.get("version") == version), None)
+        
+        node_name = self.network_manager.node_name
+        if relation == vector_clock.CONCURRENT:
+            if not deleted and sha256 == local_sha256:
+                # Escrituras concurrentes con el mismo contenido: basta con unir las versiones
+                self.operation_log.add_operation(
+                    "write", node_name, filename=filename,
+                    version=vector_clock.merge(local_version, version), sha256=sha256
+                )
+            elif not candidates:
+                logger.warning(f"Conflicto en {filename}: la copia de {node} es concurrente con la versión local "
+                               f"{local_version}, pero su operación ya no está en la instantánea")
+            elif not any(conflict["version"] == candidates[-1].get("version")
+                         for conflict in self.operation_log.get_conflicts().get(filename, [])):
+                logger.warning(f"Conflicto en {filename}: la copia de {node} es concurrente con la versión local {local_version}")
+                self.operation_log.record_operation(operation or candidates[-1], conflict=True)
+            return True
+        
+        if deleted:
+            logger.info(f"Eliminando {filename}: {node} lo borró mientras este nodo no sincronizaba")
+            self.file_manager.delete_file(filename, node, log_operation=False)
+        elif sha256 != local_sha256 and not self.network_manager.fetch_file(filename, [node], sha256):
+            # Falló la descarga o el nodo ya cambió el archivo: se reintenta en la próxima sincronización
+            return False
+        
+        if operation:
+            # Con la marca del nodo: el mismo identificador que en su log
+            self.operation_log.add_operation(
+                operation["type"], operation["source_node"], target_node=operation.get("target_node"),
+                filename=filename, timestamp=operation["timestamp"], hlc=operation.get("hlc"),
+                version=version, sha256=operation.get("sha256")
+            )
+        else:
+            # La operación del estado ya se descartó de su log: el cambio se registra como propio
+            self.operation_log.add_operation(
+                "delete" if deleted else "write", node_name, filename=filename, version=version, sha256=sha256
+            )
+        return True
+    
+    def _should_hold(self, filename):
+        """Indica si este nodo debe guardar un archivo: si es una de sus réplicas o, sin anillo, siempre"""
+        owners = self.locate(filename) if self.locate else []
+        return not owners or self.network_manager.node_name in owners
+    
+    def _apply_operations(self, operations):
+        """Aplica las operaciones que faltan en orden; devuelve cuántas del principio quedaron aplicadas o apartadas"""
+        applied = len(operations)
+        for index, operation in enumerate(operations):
+            if self.operation_log.operation_exists(operation["operation_id"]):
+                continue
+            if self.apply_operation(operation):
+                self._clear_attempts(operation)
+            elif not self._defer(operation) and applied == len(operations):
+                applied = index
+        return applied
+    
+    def _defer(self, operation):
+        """Cuenta un fallo de la operación; tras SYNC_MAX_ATTEMPTS la aparta para que no frene el cursor y devuelve True"""
+        operation_id = operation["operation_id"]
+        with self.retry_lock:
+            self.attempts[operation_id] = self.attempts.get(operation_id, 0) + 1
+            if self.attempts[operation_id] < SYNC_MAX_ATTEMPTS:
+                return False
+            del self.attempts[operation_id]
+            self.deferred[operation_id] = operation
+            self._write_json(self.retry_file, self.deferred)
+        logger.warning(f"Operación {operation_id} ({operation.get('type')} de {operation.get('filename')}) apartada "
+                       f"tras {SYNC_MAX_ATTEMPTS} intentos; se reintentará en segundo plano")
+        return True
+    
+    def _clear_attempts(self, operation):
+        """Olvida los fallos previos de una operación ya aplicada"""
+        with self.retry_lock:
+            self.attempts.pop(operation["operation_id"], None)
+    
+    def _retry_deferred(self):
+        """Reintenta las operaciones apartadas; quedan en la lista solo las que siguen fallando"""
+        with self.retry_lock:
+            deferred = list(self.deferred.values())
+        if not deferred:
+            return
         
+        done = [operation["operation_id"] for operation in deferred
+                if self.operation_log.operation_exists(operation["operation_id"]) or self.apply_operation(operation)]
+        if done:
+            with self.retry_lock:
+                for operation_id in done:
+                    self.deferred.pop(operation_id, None)
+                self._write_json(self.retry_file, self.deferred)
+                remaining = len(self.deferred)
+            logger.info(f"{len(done)} operaciones apartadas aplicadas; quedan {remaining}")
+    
+    def _request(self, node, message):
+        """Envía un mensaje de sincronización; devuelve la respuesta o None si no fue válida"""
+        message["source_node"] = self.network_manager.node_name
         response = self.network_manager._send_message(node, message)
         
         # Verificar que la respuesta sea un diccionario (no None o True)
         if isinstance(response, dict) and response.get("status") == "ok":
-            operations = response.get("operations", [])
+            return response
+        return None
+    
+    def _fetch_missing_operations(self, node):
+        """Obtiene las operaciones del nodo que faltan localmente bajando solo por los subárboles de Merkle distintos (None si no lo soporta)"""
+        prefixes = ['']
+        for _ in range(MERKLE_DEPTH):
+            response = self._request(node, {"type": "merkle_nodes", "prefixes": prefixes})
+            if response is None or "nodes" not in response:
+                return None
             
-            # Aplicar operaciones en orden cronológico
-            operations.sort(key=lambda op: op["timestamp"])
+            local_nodes = self.operation_log.get_merkle_children(prefixes)
+            differing = []
+            for prefix, remote_children in response["nodes"].items():
+                local_children = local_nodes.get(prefix)
+                if local_children is None:
+                    continue
+                differing.extend(prefix + HEX_DIGITS[i]
+                                 for i, (remote, local) in enumerate(zip(remote_children, local_children))
+                                 if remote != local)
             
-            for operation in operations:
-                if not self.operation_log.operation_exists(operation["operation_id"]):
-                    self.apply_operation(operation)
+            if not differing:
+                return []
+            prefixes = differing
+        
+        response = self._request(node, {"type": "merkle_leaves", "prefixes": prefixes})
+        if response is None:
+            return None
+        
+        missing = [operation_id
+                   for operation_ids in response.get("leaves", {}).values()
+                   for operation_id in operation_ids
+                   if not self.operation_log.operation_exists(operation_id)]
+        
+        operations = []
+        for start in range(0, len(missing), SYNC_BATCH_SIZE):
+            batch = missing[start:start + SYNC_BATCH_SIZE]
+            response = self._request(node, {"type": "get_operations", "operation_ids": batch})
+            if response is None:
+                break
+            operations.extend(response.get("operations", []))
+        
+        logger.debug(f"Árbol de Merkle: {len(missing)} operaciones faltantes en {len(prefixes)} hojas distintas con {node}")
+        return operations
     
     def apply_operation(self, operation):
-        """Aplica una operación de sincronización"""
+        """Aplica una operación de sincronización comparando su vector de versiones con el local; devuelve False si hay que reintentarla"""
+        filename = operation.get("filename")
+        if not filename or "version" not in operation:
+            # Operación sin versión (protocolo anterior): se aplica si afecta a este nodo
+            if filename and self._affects_local_copy(operation):
+                return self._apply_operation(operation)
+            self.operation_log.record_operation(operation)
+            return True
+        
+        local_version, local_sha256 = self.operation_log.get_file_version(filename)
+        relation = vector_clock.compare(operation["version"], local_version)
+        
+        if relation in (vector_clock.EQUAL, vector_clock.BEFORE) or not self._affects_local_copy(operation):
+            # La copia local ya incluye la operación o no la afecta: registrarla sin leer ni transferir nada
+            self.operation_log.record_operation(operation)
+            return True
+        
+        if relation == vector_clock.CONCURRENT:
+            if operation.get("sha256") == local_sha256:
+                # Escrituras concurrentes con el mismo contenido: basta con unir las versiones
+                self.operation_log.add_operation(
+                    operation["type"], operation["source_node"], target_node=operation.get("target_node"),
+                    filename=filename, timestamp=operation["timestamp"], hlc=operation.get("hlc"),
+                    version=vector_clock.merge(local_version, operation["version"]), sha256=local_sha256
+                )
+                return True
+            
+            logger.warning(f"Conflicto en {filename}: {operation['type']} de {operation['source_node']} "
+                           f"es concurrente con la versión local {local_version}")
+            self.operation_log.record_operation(operation, conflict=True)
+            return True
+        
+        return self._apply_operation(operation)
+    
+    def _affects_local_copy(self, operation):
+        """Indica si una operación cambia el contenido de este nodo"""
+        operation_type = operation.get("type")
+        if operation_type == "transfer":
+            return operation.get("target_node") == self.network_manager.node_name
+        if operation_type == "resolve":
+            # La resolución se propaga a quien tenga una copia del archivo
+            return self.file_manager.get_file_path(operation["filename"]) is not None
+        return operation_type == "delete"
+    
+    def _apply_operation(self, operation):
+        """Aplica una operación de sincronización y la registra en el log local; devuelve False si no se pudo"""
         operation_type = operation.get("type")
         source_node = operation.get("source_node")
         filename = operation.get("filename")
         timestamp = operation.get("timestamp")
+        hlc = operation.get("hlc")
+        version = operation.get("version")
+        sha256 = operation.get("sha256")
         
-        if operation_type == "delete":
+        if operation_type == "delete" or (operation_type == "resolve" and not sha256):
             # Aplicar eliminación
             self.file_manager.delete_file(filename, source_node, log_operation=False)
             
             # Registrar en el log local
-            if not self.operation_log.operation_exists(operation["operation_id"]):
-                self.operation_log.add_operation(
-                    "delete", source_node, filename=filename, timestamp=timestamp
-                )
+            self.operation_log.add_operation(
+                operation_type, source_node, filename=filename, timestamp=timestamp, version=version, hlc=hlc
+            )
         
-        elif operation_type == "transfer":
+        elif operation_type in ("transfer", "resolve"):
             target_node = operation.get("target_node")
             
-            # Solo aplicar si somos el destino o el origen
-            if target_node == self.network_manager.node_name:
-                # Solicitar el archivo actual al nodo origen
-                request_message = {
-                    "type": "get_file",
-                    "source_node": self.network_manager.node_name,
-                    "filename": filename
-                }
-                
-                response = self.network_manager._send_message(source_node, request_message)
-                
-                # Asegurarse de que la respuesta sea un diccionario
-                if isinstance(response, dict) and response.get("status") == "ok":
-                    file_data = response.get("file_data")
-                    if file_data:
-                        self.file_manager.save_file(filename, file_data)
-                
-                # Registrar en el log local
-                if not self.operation_log.operation_exists(operation["operation_id"]):
-                    self.operation_log.add_operation(
-                        "transfer", source_node, target_node=target_node, 
-                        filename=filename, timestamp=timestamp
-                    )
\ No newline at end of file
+            # Solicitar al nodo origen el contenido de la operación; si ya cambió o falla se reintenta en la próxima sincronización
+            if not self.network_manager.fetch_file(filename, [source_node], sha256):
+                return False
+            
+            # Registrar en el log local
+            self.operation_log.add_operation(
+                operation_type, source_node, target_node=target_node,
+                filename=filename, timestamp=timestamp, version=version, sha256=sha256, hlc=hlc
+            )
+        
+        return True
+    
+    def resolve_conflict(self, filename, keep):
+        """Resuelve los conflictos de un archivo conservando la copia local ("local") o la remota más reciente ("remote")"""
+        conflicts = self.operation_log.get_conflicts().get(filename)
+        if not conflicts:
+            return False
+        
+        node_name = self.network_manager.node_name
+        version, _ = self.operation_log.get_file_version(filename)
+        for conflict in conflicts:
+            version = vector_clock.merge(version, conflict["version"])
+        
+        if keep == "remote":
+            remote = max(conflicts, key=lambda op: op["timestamp"])
+            if remote["type"] == "delete" or (remote["type"] == "resolve" and not remote.get("sha256")):
+                self.file_manager.delete_file(filename, node_name, log_operation=False)
+            elif not self.network_manager.fetch_file(filename, [remote["source_node"]]):
+                return False
+        
+        # La resolución sucede a todas las versiones en conflicto y se propaga a las demás copias
+        info = self.file_manager.get_file_info(filename)
+        self.operation_log.add_operation(
+            "resolve", node_name, filename=filename,
+            version=vector_clock.increment(version, node_name), sha256=info["sha256"] if info else None
+        )
+        logger.info(f"Conflicto en {filename} resuelto conservando la copia {keep}")
+        return True
@@ -0,0 +1,49 @@
+import io
+import os
+
+import delta
+
+BLOCK_SIZE = 1024
+
+
+def write_file(path, data):
+    with open(path, 'wb') as f:
+        f.write(data)
+    return str(path)
+
+
+def test_delta_roundtrip_with_small_change(tmp_path):
+    base = os.urandom(64 * BLOCK_SIZE)
+    changed = base[:10 * BLOCK_SIZE] + b'cambio' + base[10 * BLOCK_SIZE:]
+    base_path = write_file(tmp_path / "base", base)
+    changed_path = write_file(tmp_path / "changed", changed)
+
+    out = io.BytesIO()
+    signatures = delta.compute_signatures(base_path, BLOCK_SIZE)
+    sha256 = delta.write_delta(changed_path, signatures, BLOCK_SIZE, out, max_literal=len(changed) // 2)
+    assert sha256 is not None
+    assert len(out.getvalue()) < len(changed) // 2
+
+    rebuilt = io.BytesIO()
+    out.seek(0)
+    assert delta.apply_delta(base_path, out, BLOCK_SIZE, rebuilt) == sha256
+    assert rebuilt.getvalue() == changed
+
+
+def test_delta_stops_once_literals_exceed_limit(tmp_path):
+    base_path = write_file(tmp_path / "base", os.urandom(64 * BLOCK_SIZE))
+    rewritten_path = write_file(tmp_path / "rewritten", os.urandom(1024 * BLOCK_SIZE))
+
+    out = io.BytesIO()
+    signatures = delta.compute_signatures(base_path, BLOCK_SIZE)
+    assert delta.write_delta(rewritten_path, signatures, BLOCK_SIZE, out, max_literal=4 * BLOCK_SIZE) is None
+    # Se abandona antes de escribir el primer registro literal completo
+    assert out.getvalue() == b''
+
+
+def test_delta_limit_counts_trailing_literal(tmp_path):
+    base_path = write_file(tmp_path / "base", os.urandom(8 * BLOCK_SIZE))
+    rewritten_path = write_file(tmp_path / "rewritten", os.urandom(BLOCK_SIZE // 2))
+
+    signatures = delta.compute_signatures(base_path, BLOCK_SIZE)
+    assert delta.write_delta(rewritten_path, signatures, BLOCK_SIZE, io.BytesIO(), max_literal=100) is None
@@ -0,0 +1,67 @@
+import asyncio
+import os
+
+import pytest
+
+import file_manager
+import network
+from operation_log import OperationLog
+
+
+@pytest.fixture
+def shared(tmp_path, monkeypatch):
+    """FileManager sobre un directorio compartido temporal, con un archivo ajeno justo fuera de él"""
+    monkeypatch.setattr(file_manager, "SHARED_DIR", str(tmp_path / "shared"))
+    outside = tmp_path / "victima.txt"
+    outside.write_bytes(b"fuera del directorio compartido")
+    log = OperationLog(str(tmp_path / "operations.log"))
+    manager = file_manager.FileManager(log)
+    yield manager, outside
+    manager.index.stop()
+    log.close()
+
+
+def network_manager(manager):
+    """NetworkManager sin arrancar, solo con lo que usan los manejadores de mensajes"""
+    nm = object.__new__(network.NetworkManager)
+    nm.file_manager = manager
+    nm.operation_log = manager.operation_log
+    nm.node_name = "Nodo1"
+    nm._update_node_seen = lambda node: None
+    return nm
+
+
+@pytest.mark.parametrize("filename", ["../victima.txt", "/tmp/victima.txt", "..", "operations.log", ""])
+def test_file_manager_rejects_names_outside_shared_dir(shared, filename):
+    manager, outside = shared
+    with pytest.raises(ValueError):
+        manager.create_temp_file(filename)
+    assert manager.save_file(filename, b"x", is_base64=False) is False
+    assert manager.delete_file(filename, "Nodo2", log_operation=False) is False
+    assert outside.read_bytes() == b"fuera del directorio compartido"
+
+
+def test_delete_handler_rejects_traversal(shared):
+    manager, outside = shared
+    response = network_manager(manager)._process_message(
+        {"type": "delete_file", "source_node": "Nodo2", "filename": "../victima.txt"}
+    )
+    assert response["status"] == "error"
+    assert outside.exists()
+
+
+def test_stream_receiver_rejects_traversal(shared):
+    manager, outside = shared
+    nm = network_manager(manager)
+
+    async def receive():
+        reader = asyncio.StreamReader()
+        reader.feed_data(b"contenido nuevo")
+        reader.feed_eof()
+        message = {"type": "transfer_file_stream", "source_node": "Nodo2", "filename": "../victima.txt", "size": 15}
+        await nm._receive_file_stream(reader, message)
+
+    with pytest.raises(ConnectionError):
+        asyncio.run(receive())
+    assert outside.read_bytes() == b"fuera del directorio compartido"
+    assert os.listdir(outside.parent / "shared") in ([], [".chunk_store"])
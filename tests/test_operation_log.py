@@ -0,0 +1,54 @@
+import time
+
+import hlc
+from config import TOMBSTONE_RETENTION
+from operation_log import OperationLog, make_operation_id
+
+
+def remote_write(filename, stamp, source_node="Nodo2"):
+    """Operación de escritura de otro nodo con una marca dada"""
+    return {
+        "type": "write", "source_node": source_node, "timestamp": 1.0, "hlc": stamp,
+        "operation_id": make_operation_id(stamp, source_node), "filename": filename,
+        "version": {source_node: 1}, "sha256": "remoto"
+    }
+
+
+def test_head_survives_compaction_and_reload(tmp_path):
+    log_file = str(tmp_path / "operations.log")
+    log = OperationLog(log_file)
+    log.add_operation("write", "Nodo1", filename="a.txt", sha256="uno")
+    log.add_operation("write", "Nodo1", filename="a.txt", sha256="dos")
+    # Anterior a la escritura local: la compactación la descarta y deja la cabeza sin operación
+    log.record_operation(remote_write("a.txt", hlc.encode(1, 0)))
+    log.compact()
+    head = log.get_cursor()
+    log.close()
+
+    log = OperationLog(log_file)
+    assert log.get_cursor() == head
+
+    operation = log.add_operation("write", "Nodo1", filename="b.txt", sha256="tres")
+    operations, cursor, has_more = log.get_operations_after(head)
+    assert [op["operation_id"] for op in operations] == [operation["operation_id"]]
+    assert cursor["position"] == head["position"] + 1
+    assert not has_more
+    log.close()
+
+
+def test_removed_versions_follow_tombstone_retention(tmp_path):
+    log = OperationLog(str(tmp_path / "operations.log"))
+    log.set_peers([])
+    old = time.time() - TOMBSTONE_RETENTION - 60
+    for filename, timestamp in (("viejo.txt", old), ("reciente.txt", time.time())):
+        log.add_operation("write", "Nodo1", filename=filename, sha256="uno", timestamp=timestamp, hlc=log.clock.now())
+        log.add_operation("delete", "Nodo1", filename=filename, timestamp=timestamp, hlc=log.clock.now())
+    log.compact()
+
+    # Las dos lápidas ya se aplicaron en todos los nodos; solo la reciente conserva su versión
+    assert log.get_deletion("reciente.txt") is None
+    _, files, _, _ = log.get_snapshot()
+    assert list(files) == ["reciente.txt"]
+    assert files["reciente.txt"]["deleted"]
+    assert log.get_file_version("viejo.txt") == ({}, None)
+    log.close()
@@ -0,0 +1,27 @@
+import threading
+import time
+
+class TokenBucket:
+    """Limita un caudal (por ejemplo, bytes por segundo) permitiendo ráfagas de hasta `capacity`"""
+
+    def __init__(self, rate, capacity=None):
+        self.rate = rate  # Unidades por segundo; 0 o menos desactiva el límite
+        self.capacity = capacity if capacity is not None else rate
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def consume(self, amount):
+        """Toma `amount` unidades esperando lo necesario; una petición mayor que la capacidad deja saldo negativo"""
+        if self.rate <= 0:
+            return
+
+        with self.lock:
+            now = time.monotonic()
+            self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+            self.updated = now
+            self.tokens -= amount
+            wait = -self.tokens / self.rate if self.tokens < 0 else 0
+
+        if wait > 0:
+            time.sleep(wait)
@@ -0,0 +1,36 @@
+EQUAL = "equal"
+BEFORE = "before"
+AFTER = "after"
+CONCURRENT = "concurrent"
+
+def increment(version, node):
+    """Copia de un vector de versiones con el contador del nodo avanzado en uno"""
+    version = dict(version or {})
+    version[node] = version.get(node, 0) + 1
+    return version
+
+def merge(a, b):
+    """Máximo componente a componente de dos vectores de versiones"""
+    merged = dict(a or {})
+    for node, counter in (b or {}).items():
+        merged[node] = max(merged.get(node, 0), counter)
+    return merged
+
+def compare(a, b):
+    """Relación causal de `a` respecto de `b`: EQUAL, BEFORE, AFTER o CONCURRENT"""
+    a = a or {}
+    b = b or {}
+    nodes = set(a) | set(b)
+    less = any(a.get(node, 0) < b.get(node, 0) for node in nodes)
+    greater = any(a.get(node, 0) > b.get(node, 0) for node in nodes)
+    if less and greater:
+        return CONCURRENT
+    if less:
+        return BEFORE
+    if greater:
+        return AFTER
+    return EQUAL
+
+def dominates(a, b):
+    """Indica si `a` ya incluye todo lo que registra `b`"""
+    return compare(a, b) in (EQUAL, AFTER)